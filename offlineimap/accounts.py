@@ -41,6 +41,67 @@ except:
     except:
         pass # Ok if this fails, we can do without.
 
+class FolderScheduler(object):
+    """Orders the folders of an account for syncing.
+
+    Folders listed in the 'folderpriority' option come first, in the given
+    order. The others are sorted by estimated cost, folders which often
+    change looking cheaper, so that small and busy folders don't wait for
+    big archives to be synced. The cost is the message count seen at the
+    last sync, or estimated from the size of the status cache before.
+
+    The statistics live as long as the account, i.e. across autorefresh
+    runs."""
+
+    # Weight of the last sync in the change rate.
+    changeweight = 0.3
+    # Rough size of a message in the status cache, in bytes.
+    statusentrysize = 32
+
+    def __init__(self, priorities):
+        self.priorities = priorities
+        self.lock = Lock()
+        self.stats = {} # Key: folder name, value: [messages, change rate].
+
+    def record(self, name, messages, changed):
+        """Records the outcome of the sync of folder name."""
+
+        with self.lock:
+            stats = self.stats.setdefault(name, [messages, 0.0])
+            stats[0] = messages
+            stats[1] += self.changeweight * (float(bool(changed)) - stats[1])
+
+    def __estimate(self, name, statusfolder):
+        if name in self.stats:
+            return self.stats[name][0]
+        try:
+            return os.path.getsize(statusfolder.filename) // \
+                self.statusentrysize
+        except (AttributeError, OSError):
+            return None # New folder, could be anything.
+
+    def order(self, folders):
+        """Returns the list of (remotefolder, statusfolder) pairs sorted in
+        the order they should be synced."""
+
+        def key(pair):
+            remotefolder, statusfolder = pair
+            name = remotefolder.getname()
+            priority = len(self.priorities)
+            for num, prioritized in enumerate(self.priorities):
+                if prioritized in (name, remotefolder.getvisiblename()):
+                    priority = num
+                    break
+            cost = self.__estimate(name, statusfolder)
+            if cost is None:
+                return (priority, 1, 0)
+            rate = self.stats.get(name, [0, 0.0])[1]
+            return (priority, 0, cost / (1.0 + 9.0 * rate))
+
+        # Stable: unknown folders keep the order of the repository.
+        return sorted(folders, key=key)
+
+
 # FIXME: spaghetti code alert!
 def getaccountlist(customconfig):
     # Account names in a list.
@@ -229,6 +290,10 @@ class SyncableAccount(Account):
         self._lockfd = None
         self._lockfilepath = os.path.join(
             self.config.getmetadatadir(), "%s.lock"% self)
+        self.scheduler = FolderScheduler(
+            self.getconflist('folderpriority', r',\s*', ['INBOX']))
+        # The asyncio engine syncing the folders, if any.
+        self.engine = None
 
     def __lock(self):
         """Lock the account, throwing an exception if it is locked already."""
@@ -378,11 +443,8 @@ class SyncableAccount(Account):
                 self.ui.syncfolders(remoterepos, localrepos)
 
             # Iterate through all folders on the remote repo and sync.
+            folders = []
             for remotefolder in remoterepos.getfolders():
-                # Check for CTRL-C or SIGTERM.
-                if Account.abort_NOW_signal.is_set():
-                    break
-
                 if not remotefolder.sync_this:
                     self.ui.debug('', "Not syncing filtered folder '%s'"
                                   "[%s]"% (remotefolder.getname(), remoterepos))
@@ -406,6 +468,22 @@ class SyncableAccount(Account):
                                  "[%s]"% (localfolder.getname(), localfolder.repository))
                     continue # Ignore filtered folder.
 
+                statusfolder = statusrepos.getfolder(remotefolder.
+                    getvisiblename().replace(remoterepos.getsep(),
+                    statusrepos.getsep()))
+                folders.append((remotefolder, statusfolder))
+
+            folders = self.scheduler.order(folders)
+            if self.engine is not None and folders:
+                self.engine.syncfolders(self,
+                    [remotefolder for remotefolder, _ in folders], quick)
+                startedThread = True
+                folders = []
+            for remotefolder, statusfolder in folders:
+                # Check for CTRL-C or SIGTERM.
+                if Account.abort_NOW_signal.is_set():
+                    break
+
                 if not globals.options.singlethreading:
                     thread = InstanceLimitedThread(
                         limitNamespace="%s%s"% (
@@ -644,15 +722,29 @@ def syncfolder(account, remotefolder, quick):
                 remotestart)
             check_uid_validity()
         else:
-            localfolder.cachemessagelist()
             if quick:
+                # The local folder loads its messagelist only if needed.
                 if (not localfolder.quickchanged(statusfolder) and
                     not remotefolder.quickchanged(statusfolder)):
                     ui.skippingfolder(remotefolder)
+                    localfolder.marksynced()
                     localrepos.restore_atime()
+                    account.scheduler.record(remotefolder.getname(),
+                        statusfolder.getmessagecount(), False)
                     return
+            localfolder.cachemessagelist()
             check_uid_validity()
-            remotefolder.cachemessagelist()
+            if not remotefolder.cachemessagelist_incremental(statusfolder):
+                remotefolder.cachemessagelist()
+
+        if globals.options.planonly:
+            # Only output what the sync would change.
+            ui.syncplan(remotefolder, localfolder,
+                remotefolder.plansync(localfolder, statusfolder))
+            ui.syncplan(localfolder, remotefolder,
+                localfolder.plansync(remotefolder, statusfolder))
+            localrepos.restore_atime()
+            return
 
         # Synchronize remote changes.
         if not localrepos.getconfboolean('readonly', False):
@@ -671,7 +763,12 @@ def syncfolder(account, remotefolder, quick):
                     remoterepos.getname())
 
         statusfolder.save()
+        remotefolder.savesyncstate(statusfolder)
+        localfolder.marksynced()
         localrepos.restore_atime()
+        account.scheduler.record(remotefolder.getname(),
+            remotefolder.getmessagecount(),
+            remotefolder.syncchanges + localfolder.syncchanges)
     except (KeyboardInterrupt, SystemExit):
         raise
     except OfflineImapError as e:
@@ -0,0 +1,123 @@
+# asyncio sync engine
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""Sync engine running the accounts and their folders as asyncio tasks.
+
+Used when the 'syncengine' option of the [general] section is 'asyncio'.
+The repositories are blocking: the account runs and the folder syncs are
+run in thread pools, the event loop only schedules them. A folder waiting
+for its turn is a task instead of a thread, so that the number of threads
+only depends on 'maxsyncaccounts' and 'maxsyncfolders', not on the number
+of folders."""
+
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from offlineimap import accounts, threadutil
+from offlineimap.ui import getglobalui
+
+
+class AsyncEngine(object):
+    def __init__(self, config):
+        self.config = config
+        self.maxaccounts = config.getdefaultint('general', 'maxsyncaccounts', 1)
+        self.maxfolders = config.getdefaultint('general', 'maxsyncfolders', 8)
+        self.loop = None
+        self.accountexecutor = None
+        self.folderexecutor = None
+
+    def run(self, list_accounts):
+        """Syncs the accounts, returns once they are all done."""
+
+        self.loop = asyncio.new_event_loop()
+        self.accountexecutor = ThreadPoolExecutor(self.maxaccounts)
+        self.folderexecutor = ThreadPoolExecutor(self.maxfolders)
+        try:
+            self.loop.run_until_complete(self.__syncaccounts(list_accounts))
+        finally:
+            self.accountexecutor.shutdown()
+            self.folderexecutor.shutdown()
+            self.loop.close()
+
+    async def __syncaccounts(self, list_accounts):
+        tasks = {}
+        for accountname in list_accounts:
+            account = accounts.SyncableAccount(self.config, accountname)
+            account.engine = self
+            tasks[self.loop.run_in_executor(
+                self.accountexecutor, account.syncrunner)] = account
+        pending = set(tasks)
+        while pending:
+            # Accounts in autorefresh mode never return: report the errors
+            # as soon as they happen.
+            done, pending = await asyncio.wait(pending,
+                return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    self.__accountexception(tasks[task], task.exception())
+
+    def __accountexception(self, account, exc):
+        """Reports the exception which ended the run of account the way
+        the threads engine does: the monitor passes it to
+        ui.threadException() from the main thread."""
+
+        thread = threadutil.ExitNotifyThread(
+            name="Account sync %s"% account.getname())
+        thread.set_exit_exception(exc, ''.join(traceback.format_exception(
+            type(exc), exc, exc.__traceback__)))
+        thread.notify_exit()
+        # The monitor terminates the program, but unlike the account threads
+        # of the threads engine, the executor threads are waited for at exit.
+        accounts.Account.set_abort_event(self.config, 3)
+
+    def syncfolders(self, account, remotefolders, quick):
+        """Syncs the folders of account, in the given order.
+
+        Called from the thread running the account. At most
+        'maxconnections' folders of the account are synced at a time."""
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.__syncfolders(account, remotefolders, quick), self.loop)
+        future.result()
+
+    async def __syncfolders(self, account, remotefolders, quick):
+        # The semaphore wakes the tasks up in order of creation.
+        semaphore = asyncio.Semaphore(
+            account.remoterepos.getmaxconnections())
+        tasks = [self.__syncfolder(semaphore, account, remotefolder, quick)
+            for remotefolder in remotefolders]
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                raise result
+
+    async def __syncfolder(self, semaphore, account, remotefolder, quick):
+        async with semaphore:
+            # Check for CTRL-C or SIGTERM.
+            if accounts.Account.abort_NOW_signal.is_set():
+                return
+            await self.loop.run_in_executor(self.folderexecutor,
+                accounts.syncfolder, account, remotefolder, quick)
+
+
+def syncitall(list_accounts, config):
+    """The target when in multithreading mode with the asyncio engine."""
+
+    if config.getdefault('general', 'accountbackend', 'threads') != 'threads':
+        getglobalui().warn("accountbackend is ignored by the asyncio "
+            "syncengine")
+    AsyncEngine(config).run(list_accounts)
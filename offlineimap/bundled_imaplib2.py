@@ -57,7 +57,7 @@ __author__ = "Piers Lauder <piers@janeelix.com> & offlineimap team"
 __URL__ = "http://imaplib2.sourceforge.net"
 __license__ = "Python License"
 
-import binascii, errno, os, random, re, select, socket, sys, time, threading, zlib
+import binascii, errno, itertools, os, random, re, select, socket, sys, time, threading, zlib
 
 if bytes != str:
     # Python 3, but NB assumes strings in all I/O
@@ -70,6 +70,18 @@ else:
 
 select_module = select
 
+try:
+    import selectors
+except ImportError:
+    selectors = None                            # No shared I/O thread (py2)
+
+try:
+    import ssl
+    _ssl_want_errors = (ssl.SSLWantReadError, ssl.SSLWantWriteError)
+except (ImportError, AttributeError):
+    ssl = None
+    _ssl_want_errors = ()
+
 #       Globals
 
 CRLF = '\r\n'
@@ -81,6 +93,8 @@ IDLE_TIMEOUT_RESPONSE = '* IDLE TIMEOUT\r\n'
 IDLE_TIMEOUT = 60*29                            # Don't stay in IDLE state longer
 READ_POLL_TIMEOUT = 30                          # Without this timeout interrupted network connections can hang reader
 READ_SIZE = 32768                               # Consume all available in socket
+LITERAL_READ_SIZE = 1048576                     # Largest read into a literal buffer
+DEFLATE_READ_SIZE = 65536                       # Compressed data read at once
 
 DFLT_DEBUG_BUF_LVL = 3                          # Level above which the logging output goes directly to stderr
 
@@ -125,6 +139,7 @@ Commands = {
         'MYRIGHTS':     ((AUTH, SELECTED),            True),
         'NAMESPACE':    ((AUTH, SELECTED),            True),
         'NOOP':         ((NONAUTH, AUTH, SELECTED),   True),
+        'NOTIFY':       ((AUTH, SELECTED),            False),
         'PARTIAL':      ((SELECTED,),                 True),
         'PROXYAUTH':    ((AUTH,),                     False),
         'RENAME':       ((AUTH, SELECTED),            True),
@@ -161,6 +176,155 @@ def Int2AP(num):
 
 
 
+class _SharedIO(object):
+
+    """Private class to read the responses of all the connections
+    using 'shared_io' from one thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changes = []                       # [(connection, add), ...]
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            os.set_blocking(fd, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self._run, name='imaplib2 shared io')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def add(self, connection):
+        self._change(connection, True)
+
+    def remove(self, connection):
+        self._change(connection, False)
+
+    def _change(self, connection, add):
+        # The selector is only modified by the I/O thread.
+        with self.lock:
+            self.changes.append((connection, add))
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except (OSError, IOError):
+            pass                                # Pipe full: wakeup pending
+
+    def _apply_changes(self):
+        with self.lock:
+            changes, self.changes = self.changes, []
+        for connection, add in changes:
+            try:
+                fd = connection.read_fd
+                key = self.selector.get_map().get(fd)
+                if key is not None and key.data is not connection:
+                    # Stale registration of a closed descriptor.
+                    self._drop(key.data)
+                    key = None
+                if add and key is None:
+                    self.selector.register(fd, selectors.EVENT_READ, connection)
+                elif not add:
+                    if key is not None:
+                        self.selector.unregister(fd)
+                    connection._rd_stopped.set()
+            except Exception:
+                self._abort(connection, 'shared io error: %s - %s' % sys.exc_info()[:2])
+
+    def _drop(self, connection):
+        try:
+            self.selector.unregister(connection.read_fd)
+        except (KeyError, ValueError, OSError, IOError):
+            pass
+        connection._rd_stopped.set()
+
+    def _abort(self, connection, reason):
+        self._drop(connection)
+        connection.inq.put((connection.abort, reason))
+
+    def _drop_closed(self):
+        # A descriptor was closed without being removed first.
+        for key in list(self.selector.get_map().values()):
+            if key.data is None:
+                continue
+            try:
+                os.fstat(key.fd)
+            except OSError:
+                self._abort(key.data, 'socket error: descriptor closed')
+
+    def _run(self):
+        # The thread must survive anything: the connections are left
+        # waiting on it otherwise.
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                reason = 'shared io error: %s - %s' % sys.exc_info()[:2]
+                for key in list(self.selector.get_map().values()):
+                    if key.data is not None:
+                        self._abort(key.data, reason)
+
+    def _run_once(self):
+        try:
+            events = self.selector.select()
+        except (OSError, IOError, ValueError):
+            self._drop_closed()
+            return
+        for key, mask in events:
+            if key.data is None:
+                try:
+                    while os.read(self.wakeup_r, 4096):
+                        pass
+                except (OSError, IOError):
+                    pass
+                continue
+            if key.data._rd_stopped.is_set():
+                continue                    # Dropped meanwhile
+            if not key.data._shared_read():
+                self._drop(key.data)
+        self._apply_changes()
+
+
+_shared_io = None
+_shared_io_lock = threading.Lock()
+
+def _get_shared_io():
+    global _shared_io
+    with _shared_io_lock:
+        if _shared_io is None:
+            _shared_io = _SharedIO()
+        return _shared_io
+
+
+
+class _Literal(object):
+
+    """Private class to pass a literal read in one buffer to the handler."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+
+class _WrappedChunks(object):
+
+    """Private class to enclose a sized iterable of literal chunks."""
+
+    def __init__(self, prefix, chunks, suffix):
+        self.prefix = prefix
+        self.chunks = chunks
+        self.suffix = suffix
+
+    def __len__(self):
+        return len(self.prefix) + len(self.chunks) + len(self.suffix)
+
+    def __iter__(self):
+        yield self.prefix
+        for chunk in self.chunks:
+            yield chunk
+        yield self.suffix
+
+
+
 class Request(object):
 
     """Private class to represent a request awaiting response."""
@@ -278,6 +442,17 @@ class IMAP4(object):
     with a type that doesn't evaluate to 'string_types' (eg: 'bytearray')
     and it will be converted to a string without quoting.
 
+    If the instance variable 'shared_io' is set before the connection is
+    opened, the responses are read by one thread shared by all such
+    connections, and the requests are sent by the calling threads: only
+    the handler thread is started per connection. This implies
+    'literal_reader'.
+
+    If the instance variable 'literal_reader' is set before the
+    connection is opened (eg: by a sub-class __init__), the reader thread
+    parses the literal lengths itself and reads each literal into one
+    preallocated buffer, instead of passing it line by line to the handler.
+
     There is one instance variable, 'state', that is useful for tracking
     whether the client needs to login to the server. If it has the
     value "AUTH" after instantiating the class, then the connection
@@ -312,6 +487,12 @@ class IMAP4(object):
     mustquote_cre = re.compile(r"[^!#$&'+,./0-9:;<=>?@A-Z\[^_`a-z|}~-]")
     response_code_cre = re.compile(r'\[(?P<type>[A-Z-]+)( (?P<data>[^\]]*))?\]')
     untagged_response_cre = re.compile(r'\* (?P<type>[A-Z-]+)( (?P<data>.*))?')
+    literal_line_cre = re.compile(br'.*{(?P<size>\d+)}\r?\n$', re.DOTALL)
+
+    literal_reader = False          # Read literals in one buffer
+    shared_io = False               # Use the shared I/O thread
+    compress_level = zlib.Z_DEFAULT_COMPRESSION     # COMPRESS=DEFLATE level
+    compress_wbits = 15             # COMPRESS=DEFLATE window size (bits)
 
 
     def __init__(self, host=None, port=None, debug=None, debug_file=None, identifier=None, timeout=None, debug_buf_lvl=None):
@@ -330,8 +511,19 @@ class IMAP4(object):
         self._accumulated_data = []     # Message data accumulated so far
         self._literal_expected = None   # Message data descriptor
 
+        self._rd_line_part = b''        # literal_reader: incomplete line
+        self._rd_literal = None         # literal_reader: literal being read
+        self._rd_literal_pos = 0
+        self._rd_in_literal_response = False
+        self._rd_nonblocking = False    # shared_io: TLS socket not blocking
+        self._rd_timeout = None         # shared_io: timeout to restore
+        self._rd_eof = False            # Last raw read by _decompress() empty
+
         self.compressor = None          # COMPRESS/DEFLATE if not None
         self.decompressor = None
+        self._compress_more = False     # Don't flush the compressor yet
+        self.compression_stats = {      # Bytes, once compressing
+            'raw_in': 0, 'compressed_in': 0, 'raw_out': 0, 'compressed_out': 0}
         self._tls_established = False
 
         # Create unique tag for this session,
@@ -382,12 +574,17 @@ class IMAP4(object):
         self.ouq = queue.Queue(10)
         self.inq = queue.Queue()
 
-        self.wrth = threading.Thread(target=self._writer)
-        self.wrth.setDaemon(True)
-        self.wrth.start()
-        self.rdth = threading.Thread(target=self._reader)
-        self.rdth.setDaemon(True)
-        self.rdth.start()
+        if self.shared_io and selectors is None:
+            self.shared_io = False
+        if self.shared_io:
+            self.literal_reader = True
+            self.send_lock = threading.Lock()
+            self.wrth = None
+        else:
+            self.wrth = threading.Thread(target=self._writer)
+            self.wrth.setDaemon(True)
+            self.wrth.start()
+        self._start_reader()
         self.inth = threading.Thread(target=self._handler)
         self.inth.setDaemon(True)
         self.inth.start()
@@ -575,9 +772,42 @@ class IMAP4(object):
         """start_compressing()
         Enable deflate compression on the socket (RFC 4978)."""
 
-        # rfc 1951 - pure DEFLATE, so use -15 for both windows
+        # rfc 1951 - pure DEFLATE, so negative windows. The server may use
+        # the largest window, but ours can be smaller to save memory.
         self.decompressor = zlib.decompressobj(-15)
-        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self.compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -self.compress_wbits)
+
+
+    def _compress(self, data):
+
+        # Compress data to send, flushing unless more is to come.
+
+        if bytes != str and not isinstance(data, bytes):
+            data = bytes(data, 'utf8')
+        stats = self.compression_stats
+        stats['raw_out'] += len(data)
+        data = self.compressor.compress(data)
+        if not self._compress_more:
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        stats['compressed_out'] += len(data)
+        return data
+
+
+    def _decompress(self, read, size):
+
+        # Return at most 'size' bytes of decompressed data, calling read()
+        # for more compressed data when needed.
+
+        if self.decompressor.unconsumed_tail:
+            data = self.decompressor.unconsumed_tail
+            self._rd_eof = False
+        else:
+            data = read(DEFLATE_READ_SIZE)
+            self._rd_eof = not data
+            self.compression_stats['compressed_in'] += len(data)
+        data = self.decompressor.decompress(data, size)
+        self.compression_stats['raw_in'] += len(data)
+        return data
 
 
     def read(self, size):
@@ -587,12 +817,7 @@ class IMAP4(object):
         if self.decompressor is None:
             return self.sock.recv(size)
 
-        if self.decompressor.unconsumed_tail:
-            data = self.decompressor.unconsumed_tail
-        else:
-            data = self.sock.recv(READ_SIZE)
-
-        return self.decompressor.decompress(data, size)
+        return self._decompress(self.sock.recv, size)
 
 
     def send(self, data):
@@ -600,13 +825,31 @@ class IMAP4(object):
         Send 'data' to remote."""
 
         if self.compressor is not None:
-            data = self.compressor.compress(data)
-            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            data = self._compress(data)
 
-        if bytes != str:
+        if bytes != str and not isinstance(data, bytes):
             data = bytes(data, 'ASCII')
 
-        self.sock.sendall(data)
+        self._sendall(data)
+
+
+    def _sendall(self, data):
+
+        if not self._rd_nonblocking:
+            self.sock.sendall(data)
+            return
+
+        # The socket is not blocking, see _start_reader().
+        view = memoryview(data)
+        while len(view):
+            try:
+                sent = self.sock.send(view)
+            except _ssl_want_errors:
+                sent = 0
+            if sent:
+                view = view[sent:]
+            elif not select.select([], [self.sock], [], self._rd_timeout)[1]:
+                raise socket.timeout('timed out')
 
 
     def shutdown(self):
@@ -710,9 +953,16 @@ class IMAP4(object):
             date_time = Time2Internaldate(date_time)
         else:
             date_time = None
-        literal = self.mapCRLF_cre.sub(CRLF, message)
-        if self.utf8_enabled:
-            literal = b'UTF8 (' + literal + b')'
+        if isinstance(message, string_types):
+            literal = self.mapCRLF_cre.sub(CRLF, message)
+            if self.utf8_enabled:
+                literal = b'UTF8 (' + literal + b')'
+        else:
+            # Sized iterable of chunks already using CRLF line endings,
+            # sent chunk by chunk.
+            literal = message
+            if self.utf8_enabled:
+                literal = _WrappedChunks('UTF8 (', literal, ')')
         self.literal = literal
         try:
             return self._simple_command(name, mailbox, flags, date_time, **kw)
@@ -1043,6 +1293,17 @@ class IMAP4(object):
         return self._simple_command('NOOP', **kw)
 
 
+    def notify(self, *args, **kw):
+        """(typ, [data]) = notify(*args)
+        Set or cancel event notifications (RFC 5465),
+        e.g. notify('SET', '(selected (MessageNew MessageExpunge))')."""
+
+        try:
+            return self._simple_command('NOTIFY', *args, **kw)
+        finally:
+            self._release_state_change()
+
+
     def partial(self, message_num, message_part, start, length, **kw):
         """(typ, [data, ...]) = partial(message_num, message_part, start, length)
         Fetch truncated part of a message.
@@ -1184,15 +1445,13 @@ class IMAP4(object):
             typ, dat = self._simple_command(name)
         finally:
             self._release_state_change()
-            self.rdth.join()
+            self._join_reader()
             self.TerminateReader = False
             self.read_size = READ_SIZE
 
         if typ != 'OK':
             # Restart reader thread and error
-            self.rdth = threading.Thread(target=self._reader)
-            self.rdth.setDaemon(True)
-            self.rdth.start()
+            self._start_reader()
             raise self.error("Couldn't establish TLS session: %s" % dat)
 
         self.keyfile = keyfile
@@ -1206,9 +1465,7 @@ class IMAP4(object):
             self.ssl_wrap_socket()
         finally:
             # Restart reader thread
-            self.rdth = threading.Thread(target=self._reader)
-            self.rdth.setDaemon(True)
-            self.rdth.start()
+            self._start_reader()
 
         typ, dat = self.capability()
         if dat == [None]:
@@ -1435,7 +1692,7 @@ class IMAP4(object):
         literal = self.literal
         if literal is not None:
             self.literal = None
-            if isinstance(literal, string_types):
+            if isinstance(literal, string_types) or not callable(literal):
                 literator = None
                 data = '%s {%s}' % (data, len(literal))
             else:
@@ -1446,13 +1703,13 @@ class IMAP4(object):
         rqb.data = '%s%s' % (data, CRLF)
 
         if literal is None:
-            self.ouq.put(rqb)
+            self._send_request(rqb)
             return rqb
 
         # Must setup continuation expectancy *before* ouq.put 
         crqb = self._request_push(name=name, tag='continuation')
 
-        self.ouq.put(rqb)
+        self._send_request(rqb)
 
         while True:
             # Wait for continuation response
@@ -1481,8 +1738,11 @@ class IMAP4(object):
                 crqb = self._request_push(name=name, tag='continuation')
 
             if __debug__: self._log(4, 'write literal size %s' % len(literal))
-            crqb.data = '%s%s' % (literal, CRLF)
-            self.ouq.put(crqb)
+            if isinstance(literal, string_types):
+                crqb.data = '%s%s' % (literal, CRLF)
+            else:
+                crqb.data = itertools.chain(literal, (CRLF,))
+            self._send_request(crqb)
 
             if literator is None:
                 break
@@ -1559,7 +1819,7 @@ class IMAP4(object):
         self.idle_timeout = None
         self.idle_lock.release()
         irqb.data = 'DONE%s' % CRLF
-        self.ouq.put(irqb)
+        self._send_request(irqb)
         if __debug__: self._log(2, 'server IDLE finished')
 
 
@@ -1697,6 +1957,19 @@ class IMAP4(object):
             if __debug__: self._log(1, '%s response: %s' % (typ, dat))
 
 
+    def _put_literal(self, data):
+
+        # A whole literal, read in one buffer by the reader.
+
+        if __debug__: self._log(5, '_put_literal expecting data len %s, got %s' % (self._expecting_data_len, len(data)))
+        self._expecting_data = False
+        self._expecting_data_len = 0
+        if bytes != str:
+            self._accumulated_data.append(data.decode(errors='ignore'))
+        else:
+            self._accumulated_data.append(str(data))
+
+
     def _quote(self, arg):
 
         return '"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"')
@@ -1772,17 +2045,141 @@ class IMAP4(object):
 
         if __debug__: self._log(1, '_close_threads')
 
-        self.ouq.put(None)
-        self.wrth.join()
+        if self.shared_io:
+            _get_shared_io().remove(self)
+            self._rd_stopped.wait()
+            self.inq.put((self.abort, 'connection closed'))
+        else:
+            self.ouq.put(None)
+            self.wrth.join()
 
         if __debug__: self._log(1, 'call shutdown')
 
         self.shutdown()
 
-        self.rdth.join()
+        self._join_reader()
         self.inth.join()
 
 
+    def _start_reader(self):
+
+        if self.shared_io:
+            self._rd_stopped = threading.Event()
+            if ssl is not None and isinstance(getattr(self, 'sock', None), ssl.SSLSocket):
+                # A readable socket might hold part of a TLS record only: a
+                # blocking read would stall the thread shared by all.
+                self._rd_timeout = self.sock.gettimeout()
+                self.sock.setblocking(False)
+                self._rd_nonblocking = True
+            _get_shared_io().add(self)
+        else:
+            self.rdth = threading.Thread(target=self._reader)
+            self.rdth.setDaemon(True)
+            self.rdth.start()
+
+
+    def _join_reader(self):
+
+        if self.shared_io:
+            self._rd_stopped.wait()
+            if self._rd_nonblocking:
+                self._rd_nonblocking = False
+                try:
+                    self.sock.settimeout(self._rd_timeout)
+                except (OSError, IOError, socket.error):
+                    pass                        # Closed already
+        else:
+            self.rdth.join()
+
+
+    def _send_request(self, rqb):
+
+        # Sent by the writer thread, or right away with shared_io.
+
+        if not self.shared_io:
+            self.ouq.put(rqb)
+            return
+
+        with self.send_lock:
+            if self.Terminate:
+                rqb.abort(self.abort, 'connection terminated')
+                return
+            try:
+                self._write_request(rqb)
+            except:
+                reason = 'socket error: %s - %s' % sys.exc_info()[:2]
+                if __debug__:
+                    if not self.Terminate:
+                        self._print_log()
+                        if self.debug: self.debug += 4          # Output all
+                        self._log(1, reason)
+                rqb.abort(self.abort, reason)
+                self.inq.put((self.abort, reason))
+
+
+    def _write_request(self, rqb):
+
+        if isinstance(rqb.data, string_types):
+            self.send(rqb.data)
+            if __debug__: self._log(4, '> %s' % rqb.data)
+        else:
+            # Chunked literal: flush the compressor after the last chunk only.
+            self._compress_more = self.compressor is not None
+            try:
+                for chunk in rqb.data:
+                    self.send(chunk)
+            finally:
+                self._compress_more = False
+            if self.compressor is not None:
+                self.send('')
+            if __debug__: self._log(4, '> [chunked literal]')
+
+
+    def _shared_read(self):
+
+        # Called by the shared I/O thread when read_fd is readable.
+        # Returns False to stop reading.
+
+        try:
+            data = self.read(self._read_size())
+            if __debug__: self._log(5, 'rcvd %s' % len(data))
+            if not data:
+                if self.decompressor is not None and not self._rd_eof:
+                    # Compressed data without output, e.g. a sync flush.
+                    return not (self.TerminateReader or self.Terminate)
+                # Readable but empty: closed, maybe after a BYE still queued.
+                self.inq.put((self.abort, 'connection closed by server'))
+                return False
+            self._read_data(data)
+            # Data buffered by ssl or zlib doesn't wake the selector up.
+            while not (self.TerminateReader or self.Terminate) \
+                    and self._read_pending():
+                data = self.read(self._read_size())
+                if not data:
+                    break
+                self._read_data(data)
+        except _ssl_want_errors:
+            pass                                # Incomplete TLS record
+        except:
+            reason = 'socket error: %s - %s' % sys.exc_info()[:2]
+            if __debug__:
+                if not self.Terminate:
+                    self._print_log()
+                    if self.debug: self.debug += 4          # Output all
+                    self._log(1, reason)
+            self.inq.put((self.abort, reason))
+            return False
+        return not (self.TerminateReader or self.Terminate)
+
+
+    def _read_pending(self):
+
+        if self.decompressor is not None and self.decompressor.unconsumed_tail:
+            return True
+        pending = getattr(getattr(self, 'sock', None), 'pending', None)
+        return pending is not None and pending() > 0
+
+
     def _handler(self):
 
         resp_timeout = self.resp_timeout
@@ -1827,6 +2224,10 @@ class IMAP4(object):
                 if __debug__: self._log(1, 'inq None - terminating')
                 break
 
+            if isinstance(line, _Literal):
+                self._put_literal(line.data)
+                continue
+
             if not isinstance(line, string_types):
                 typ, val = line
                 break
@@ -1861,6 +2262,69 @@ class IMAP4(object):
         if __debug__: self._log(1, 'finished')
 
 
+    def _read_size(self):
+
+        # Read the rest of a literal in as few reads as possible.
+
+        if self.literal_reader and self._rd_literal is not None:
+            left = len(self._rd_literal) - self._rd_literal_pos
+            if left > self.read_size:
+                return min(left, LITERAL_READ_SIZE)
+        return self.read_size
+
+
+    def _read_data(self, data):
+
+        # Split received data into response lines and literals (literal_reader).
+        # A literal follows a line ending with "{size}" which is an untagged
+        # response, or the continuation of one after a literal.
+
+        start = 0
+        dlen = len(data)
+        view = memoryview(data)
+
+        while start < dlen:
+            literal = self._rd_literal
+            if literal is not None:
+                pos = self._rd_literal_pos
+                n = min(len(literal) - pos, dlen - start)
+                literal[pos:pos+n] = view[start:start+n]
+                start += n
+                self._rd_literal_pos = pos = pos + n
+                if pos < len(literal):
+                    break
+                if __debug__: self._log(4, '< [literal %s bytes]' % len(literal))
+                self.inq.put(_Literal(literal))
+                self._rd_literal = None
+                self._rd_in_literal_response = True
+                continue
+
+            stop = data.find(b'\n', start)
+            if stop < 0:
+                self._rd_line_part += data[start:]
+                break
+            stop += 1
+            line = self._rd_line_part + data[start:stop]
+            self._rd_line_part, start = b'', stop
+
+            if self._rd_in_literal_response or line.startswith(b'* '):
+                mo = self.literal_line_cre.match(line)
+                if mo is not None:
+                    self._rd_literal = bytearray(int(mo.group('size')))
+                    self._rd_literal_pos = 0
+            self._rd_in_literal_response = False
+
+            if bytes != str:
+                line = line.decode(errors='ignore')
+            if __debug__: self._log(4, '< %s' % line)
+            self.inq.put(line)
+
+            if self._rd_literal is not None and not len(self._rd_literal):
+                self.inq.put(_Literal(self._rd_literal))
+                self._rd_literal = None
+                self._rd_in_literal_response = True
+
+
     if hasattr(select_module, "poll"):
 
       def _reader(self):
@@ -1896,7 +2360,10 @@ class IMAP4(object):
             else:
                 timeout = read_poll_timeout
             try:
-                r = poll.poll(timeout)
+                if self._read_pending():
+                    r = [(self.read_fd, select.POLLIN)]  # Buffered data
+                else:
+                    r = poll.poll(timeout)
                 if __debug__: self._log(5, 'poll => %s' % repr(r))
                 if not r:
                     continue                                    # Timeout
@@ -1904,7 +2371,7 @@ class IMAP4(object):
                 fd,state = r[0]
 
                 if state & select.POLLIN:
-                    data = self.read(self.read_size)            # Drain ssl buffer if present
+                    data = self.read(self._read_size())         # Drain ssl buffer if present
                     start = 0
                     dlen = len(data)
                     if __debug__: self._log(5, 'rcvd %s' % dlen)
@@ -1916,6 +2383,12 @@ class IMAP4(object):
                         continue                                # Try again
                     rxzero = 0
 
+                    if self.literal_reader:
+                        self._read_data(data)
+                        if self.TerminateReader:
+                            terminate = True
+                        continue
+
                     while True:
                         if bytes != str:
                             stop = data.find(b'\n', start)
@@ -1978,12 +2451,15 @@ class IMAP4(object):
             else:
                 timeout = self.read_poll_timeout
             try:
-                r,w,e = select.select([self.read_fd], [], [], timeout)
+                if self._read_pending():
+                    r,w,e = [self.read_fd], [], []      # Buffered data
+                else:
+                    r,w,e = select.select([self.read_fd], [], [], timeout)
                 if __debug__: self._log(5, 'select => %s, %s, %s' % (r,w,e))
                 if not r:                                       # Timeout
                     continue
 
-                data = self.read(self.read_size)                # Drain ssl buffer if present
+                data = self.read(self._read_size())             # Drain ssl buffer if present
                 start = 0
                 dlen = len(data)
                 if __debug__: self._log(5, 'rcvd %s' % dlen)
@@ -1995,6 +2471,12 @@ class IMAP4(object):
                     continue                                    # Try again
                 rxzero = 0
 
+                if self.literal_reader:
+                    self._read_data(data)
+                    if self.TerminateReader:
+                        terminate = True
+                    continue
+
                 while True:
                     if bytes != str:
                         stop = data.find(b'\n', start)
@@ -2043,8 +2525,7 @@ class IMAP4(object):
                 break   # Outq flushed
 
             try:
-                self.send(rqb.data)
-                if __debug__: self._log(4, '> %s' % rqb.data)
+                self._write_request(rqb)
             except:
                 reason = 'socket error: %s - %s' % sys.exc_info()[:2]
                 if __debug__:
@@ -2211,12 +2692,7 @@ class IMAP4_SSL(IMAP4):
         if self.decompressor is None:
             return self.sock.read(size)
 
-        if self.decompressor.unconsumed_tail:
-            data = self.decompressor.unconsumed_tail
-        else:
-            data = self.sock.read(READ_SIZE)
-
-        return self.decompressor.decompress(data, size)
+        return self._decompress(self.sock.read, size)
 
 
     def send(self, data):
@@ -2224,14 +2700,13 @@ class IMAP4_SSL(IMAP4):
         Send 'data' to remote."""
 
         if self.compressor is not None:
-            data = self.compressor.compress(data)
-            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            data = self._compress(data)
 
-        if bytes != str:
+        if bytes != str and not isinstance(data, bytes):
             data = bytes(data, 'utf8')
 
         if hasattr(self.sock, "sendall"):
-            self.sock.sendall(data)
+            self._sendall(data)
         else:
             dlen = len(data)
             while dlen > 0:
@@ -2298,22 +2773,16 @@ class IMAP4_stream(IMAP4):
         if self.decompressor is None:
             return os.read(self.read_fd, size)
 
-        if self.decompressor.unconsumed_tail:
-            data = self.decompressor.unconsumed_tail
-        else:
-            data = os.read(self.read_fd, READ_SIZE)
-
-        return self.decompressor.decompress(data, size)
+        return self._decompress(lambda n: os.read(self.read_fd, n), size)
 
 
     def send(self, data):
         """Send data to remote."""
 
         if self.compressor is not None:
-            data = self.compressor.compress(data)
-            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            data = self._compress(data)
 
-        if bytes != str:
+        if bytes != str and not isinstance(data, bytes):
             data = bytes(data, 'utf8')
 
         self.writefile.write(data)
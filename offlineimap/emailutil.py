@@ -25,6 +25,10 @@ def get_message_date(content, header='Date'):
     :returns: timestamp or `None` in the case of failure.
     """
 
+    # Only parse the headers, the body could be huge.
+    eoh = find_eoh(content)
+    if eoh != -1:
+        content = content[:eoh]
     message = MailParser().parsestr(content, True)
     dateheader = message.get(header)
     # parsedate_tz returns a 10-tuple that can be passed to mktime_tz
@@ -34,3 +38,89 @@ def get_message_date(content, header='Date'):
     if datetuple is None:
         return None
     return email.utils.mktime_tz(datetuple)
+
+
+# Size of the chunks messages are written out with.
+CHUNKSIZE = 65536
+
+def find_eoh(content):
+    """Returns the position right after the blank line ending the headers.
+
+    Both '\\n\\n' and '\\r\\n\\r\\n' are recognized. Returns -1 if the
+    message has no body separator."""
+
+    eoh = -1
+    for sep in ('\n\n', '\r\n\r\n'):
+        pos = content.find(sep)
+        if pos != -1 and (eoh == -1 or pos + len(sep) < eoh):
+            eoh = pos + len(sep)
+    return eoh
+
+
+class MessageChunks(object):
+    """Message content as a sized iterable of chunks.
+
+    The message is made of `head` followed by content[start:]. Line breaks
+    are converted to `linebreak` ('\\n' or '\\r\\n') chunk by chunk while
+    iterating, so that the body is never copied as a whole. Only the head,
+    usually the headers of the message, is held as a separate string and
+    can be rewritten freely. An optional `tail` is appended as is."""
+
+    def __init__(self, content, linebreak, head='', start=0, tail='',
+            chunksize=CHUNKSIZE):
+        self.content = content
+        self.linebreak = linebreak
+        self.head = head
+        self.start = start
+        self.tail = tail
+        self.chunksize = chunksize
+
+    @classmethod
+    def split(cls, content, linebreak, **kwargs):
+        """Returns MessageChunks whose head holds the headers of content,
+        including the blank line ending them."""
+
+        eoh = find_eoh(content)
+        if eoh == -1:
+            eoh = len(content)
+        return cls(content, linebreak, head=content[:eoh], start=eoh,
+            **kwargs)
+
+    def _convert(self, data):
+        if self.linebreak == '\n':
+            return data.replace('\r\n', '\n')
+        return data.replace('\r\n', '\n').replace('\n', '\r\n')
+
+    def _convertedlen(self, data, start=0):
+        crlfs = data.count('\r\n', start)
+        if self.linebreak == '\n':
+            return len(data) - start - crlfs
+        return len(data) - start + data.count('\n', start) - crlfs
+
+    def __len__(self):
+        return (self._convertedlen(self.head) +
+            self._convertedlen(self.content, self.start) + len(self.tail))
+
+    def __iter__(self):
+        yield self._convert(self.head)
+        pos = self.start
+        end = len(self.content)
+        while pos < end:
+            nxt = min(pos + self.chunksize, end)
+            # Never split a CRLF between two chunks.
+            if self.content[nxt - 1] == '\r' and nxt < end:
+                nxt += 1
+            yield self._convert(self.content[pos:nxt])
+            pos = nxt
+        if self.tail:
+            yield self.tail
+
+    def encodedlen(self, encoding='utf-8'):
+        """Returns the length in bytes of the message once encoded."""
+
+        if isinstance(self.content, bytes):
+            return len(self)
+        return sum(len(chunk.encode(encoding)) for chunk in self)
+
+    def __str__(self):
+        return ''.join(self)
@@ -23,6 +23,7 @@ from sys import exc_info
 from offlineimap import threadutil
 from offlineimap.ui import getglobalui
 from offlineimap.error import OfflineImapError
+from offlineimap.folder.MessageList import CompactMessageList
 import offlineimap.accounts
 
 
@@ -47,6 +48,7 @@ class BaseFolder(object):
         if self.name == 'INBOX':
             self.newmail_hook = repository.newmail_hook
         self.have_newmail = False
+        self.syncchanges = 0 # Changes made by the last syncmessagesto().
         self.copy_ignoreUIDs = None # List of UIDs to ignore.
         self.repository = repository
         self.visiblename = repository.nametrans(name)
@@ -71,6 +73,9 @@ class BaseFolder(object):
         self._sync_deletes = self.config.getdefaultboolean(
             self.repoconfname, "sync_deletes", True)
         self._dofsync = self.config.getdefaultboolean("general", "fsync", True)
+        self._compactmessagelist = self.config.getdefaultboolean(
+            self.repoconfname, "compactmessagelist", False)
+        self.messagelist = self._newmessagelist()
 
         # Determine if we're running static or dynamic folder filtering
         # and check filtering status.
@@ -283,6 +288,40 @@ class BaseFolder(object):
 
         raise NotImplementedError
 
+    def cachemessagelist_incremental(self, statusfolder):
+        """Cache the list of messages from the changes since the last sync.
+
+        Backends able to report which messages changed since the previous
+        sync (e.g. IMAP CONDSTORE/QRESYNC) rebuild their message list from
+        the statusfolder plus these changes instead of listing everything.
+
+        :returns: True if the message list was cached, False if the caller
+                  must fall back to cachemessagelist()."""
+
+        return False
+
+    def getchangeduidlist(self):
+        """Gets the UIDs known to have changed since the last sync.
+
+        :returns: a sorted list of UIDs, or None if the message list was not
+                  cached incrementally and all UIDs must be considered."""
+
+        return None
+
+    def savesyncstate(self, statusfolder):
+        """Record backend specific sync state once the sync succeeded.
+
+        This is where the state used by cachemessagelist_incremental() is
+        saved."""
+
+        pass
+
+    def marksynced(self):
+        """Called on the local folder once its changes were synced and the
+        status saved."""
+
+        pass
+
     def ismessagelistempty(self):
         """Is the list of messages empty."""
 
@@ -293,7 +332,17 @@ class BaseFolder(object):
     def dropmessagelistcache(self):
         """Empty everythings we know about messages."""
 
-        self.messagelist = {}
+        self.messagelist = self._newmessagelist()
+
+    def _newmessagelist(self):
+        """Returns an empty messagelist.
+
+        This is a CompactMessageList if the 'compactmessagelist' option is
+        enabled, a dict otherwise."""
+
+        if self._compactmessagelist:
+            return CompactMessageList(self.msglist_item_initializer(0))
+        return {}
 
     def getmessagelist(self):
         """Gets the current message list.
@@ -323,6 +372,62 @@ class BaseFolder(object):
 
         return sorted(self.getmessagelist().keys())
 
+    def getmessageuidset(self):
+        """Gets the UIDs for uidsin(), uidsmissing() and uidsnotin().
+
+        This is the CompactMessageList itself if the folder uses one, so that
+        the UIDs of two such folders are compared by walking their sorted
+        arrays, and the list of UIDs otherwise.
+
+        You may have to call cachemessagelist() before calling this function!"""
+
+        messagelist = self.getmessagelist()
+        if isinstance(messagelist, CompactMessageList):
+            return messagelist
+        return self.getmessageuidlist()
+
+    def __compareuids(self, uids, present):
+        """Returns the sorted list of the UIDs of uids which are (if present)
+        or are not in this folder."""
+
+        mine = self.getmessageuidset()
+        if isinstance(uids, CompactMessageList):
+            if present:
+                return uids.intersection(mine)
+            return uids.difference(mine)
+        if not isinstance(mine, CompactMessageList):
+            mine = set(mine)
+        return sorted([uid for uid in set(uids) if (uid in mine) == present])
+
+    def uidsin(self, uids):
+        """Returns the sorted list of the UIDs of uids in this folder.
+
+        :param uids: an iterable of UIDs, or the result of
+                     getmessageuidset() of a folder."""
+
+        return self.__compareuids(uids, True)
+
+    def uidsmissing(self, uids):
+        """Returns the sorted list of the UIDs of uids not in this folder.
+
+        :param uids: an iterable of UIDs, or the result of
+                     getmessageuidset() of a folder."""
+
+        return self.__compareuids(uids, False)
+
+    def uidsnotin(self, uids):
+        """Returns the sorted list of the UIDs of this folder not in uids.
+
+        :param uids: an iterable of UIDs, or the result of
+                     getmessageuidset() of a folder."""
+
+        mine = self.getmessageuidset()
+        if isinstance(mine, CompactMessageList):
+            return mine.difference(uids)
+        if not isinstance(uids, CompactMessageList):
+            uids = set(uids)
+        return sorted([uid for uid in mine if uid not in uids])
+
     def getmessagecount(self):
         """Gets the number of messages."""
 
@@ -333,6 +438,18 @@ class BaseFolder(object):
 
         raise NotImplementedError
 
+    def prefetchmessages(self, uidlist):
+        """Hint that the bodies of uidlist are about to be read in order.
+
+        Backends with costly round trips can load the messages at the head of
+        uidlist in one go so that the next getmessage() calls are cheap.
+
+        :returns: the number of UIDs at the head of uidlist that were
+                  handled; prefetchmessages() is called again for the
+                  following ones."""
+
+        return len(uidlist)
+
     def getmaxage(self):
         """Return maxage.
 
@@ -443,6 +560,29 @@ class BaseFolder(object):
 
         raise NotImplementedError
 
+    def savemessages(self, messages):
+        """Writes several messages to this folder.
+
+        :param messages: a list of (uid, content, flags, rtime) tuples, each
+                         as the arguments of savemessage().
+        :returns: the list of the UIDs savemessage() would have returned for
+                  each message, in the same order.
+
+        Backends able to store many messages in one go override this
+        together with getsavebatchlimits().  Note that savemessages() does
+        not check against dryrun settings."""
+
+        return [self.savemessage(uid, content, flags, rtime)
+                for uid, content, flags, rtime in messages]
+
+    def getsavebatchlimits(self):
+        """Returns how many messages savemessages() should get at once.
+
+        :returns: a (number of messages, number of bytes) tuple.  A number of
+                  messages of 1 means savemessages() has no benefit."""
+
+        return (1, 0)
+
     def getmessagetime(self, uid):
         """Return the received time for the specified message."""
 
@@ -458,6 +598,13 @@ class BaseFolder(object):
 
         raise NotImplementedError
 
+    def getmessagesflags(self, uidlist):
+        """Returns a dict of the flags of the messages of uidlist which
+        are in this folder."""
+
+        return dict((uid, self.getmessageflags(uid))
+                    for uid in self.uidsin(uidlist))
+
     def getmessagekeywords(self, uid):
         """Returns the keywords for the specified message."""
 
@@ -517,6 +664,34 @@ class BaseFolder(object):
         for uid in uidlist:
             self.deletemessageflags(uid, flags)
 
+    def changemessagesflags(self, addflaglist, delflaglist):
+        """Applies the flag changes of a sync at once.
+
+        Each message gets its flags saved once, whatever the number of
+        flags changed.
+
+        Note that this function does not check against dryrun settings,
+        so you need to ensure that it is never called in a
+        dryrun mode.
+
+        :param addflaglist: dict mapping each flag to the list of the UIDs
+            it must be added to.
+        :param delflaglist: dict mapping each flag to the list of the UIDs
+            it must be removed from."""
+
+        changes = {}
+        for flag, uids in addflaglist.items():
+            for uid in uids:
+                changes.setdefault(uid, (set(), set()))[0].add(flag)
+        for flag, uids in delflaglist.items():
+            for uid in uids:
+                changes.setdefault(uid, (set(), set()))[1].add(flag)
+        for uid in sorted(changes):
+            if self.uidexists(uid):
+                add, delete = changes[uid]
+                self.savemessageflags(uid,
+                    (self.getmessageflags(uid) | add) - delete)
+
     def getmessagelabels(self, uid):
         """Returns the labels for the specified message."""
 
@@ -531,6 +706,46 @@ class BaseFolder(object):
 
         raise NotImplementedError
 
+    def savemessageslabelsbulk(self, labels):
+        """Sets the labels of several messages, from a dict mapping each
+        UID to its set of labels.
+
+        Note that this function does not check against dryrun settings,
+        so you need to ensure that it is never called in a
+        dryrun mode."""
+
+        for uid in sorted(labels):
+            self.savemessagelabels(uid, labels[uid])
+
+    def changemessageslabels(self, addlabellist, dellabellist):
+        """Applies the label changes of a sync at once.
+
+        Each message gets its labels saved once, whatever the number of
+        labels changed.
+
+        Note that this function does not check against dryrun settings,
+        so you need to ensure that it is never called in a
+        dryrun mode.
+
+        :param addlabellist: dict mapping each label to the list of the UIDs
+            it must be added to.
+        :param dellabellist: dict mapping each label to the list of the UIDs
+            it must be removed from."""
+
+        changes = {}
+        for label, uids in addlabellist.items():
+            for uid in uids:
+                changes.setdefault(uid, (set(), set()))[0].add(label)
+        for label, uids in dellabellist.items():
+            for uid in uids:
+                changes.setdefault(uid, (set(), set()))[1].add(label)
+        labels = {}
+        for uid, (add, delete) in changes.items():
+            if self.uidexists(uid):
+                labels[uid] = (self.getmessagelabels(uid) | add) - delete
+        if labels:
+            self.savemessageslabelsbulk(labels)
+
     def addmessagelabels(self, uid, labels):
         """Adds the specified labels to the message's labels set.  If a given
         label is already present, it will not be duplicated.
@@ -837,34 +1052,9 @@ class BaseFolder(object):
             # load it up.
             if dstfolder.storesmessages():
                 message = self.getmessage(uid)
-            # Succeeded? -> IMAP actually assigned a UID. If newid
-            # remained negative, no server was willing to assign us an
-            # UID. If newid is 0, saving succeeded, but we could not
-            # retrieve the new UID. Ignore message in this case.
             new_uid = dstfolder.savemessage(uid, message, flags, rtime)
-            if new_uid > 0:
-                if new_uid != uid:
-                    # Got new UID, change the local uid to match the new one.
-                    self.change_message_uid(uid, new_uid)
-                    statusfolder.deletemessage(uid)
-                    # Got new UID, change the local uid.
-                # Save uploaded status in the statusfolder.
-                statusfolder.savemessage(new_uid, message, flags, rtime)
-                # Check whether the mail has been seen.
-                if 'S' not in flags:
-                    self.have_newmail = True
-            elif new_uid == 0:
-                # Message was stored to dstfolder, but we can't find it's UID
-                # This means we can't link current message to the one created
-                # in IMAP. So we just delete local message and on next run
-                # we'll sync it back
-                # XXX This could cause infinite loop on syncing between two
-                # IMAP servers ...
-                self.deletemessage(uid)
-            else:
-                raise OfflineImapError("Trying to save msg (uid %d) on folder "
-                    "%s returned invalid uid %d"% (uid, dstfolder.getvisiblename(),
-                    new_uid), OfflineImapError.ERROR.MESSAGE)
+            self.__copiedmessage(uid, new_uid, message, flags, rtime,
+                dstfolder, statusfolder)
         except (KeyboardInterrupt): # Bubble up CTRL-C.
             raise
         except OfflineImapError as e:
@@ -876,6 +1066,177 @@ class BaseFolder(object):
               msg = "Copying message %s [acc: %s]"% (uid, self.accountname))
             raise  # Raise on unknown errors, so we can fix those.
 
+    def __copiedmessage(self, uid, new_uid, message, flags, rtime, dstfolder,
+            statusfolder):
+        """Update self and statusfolder once a message was saved in dstfolder.
+
+        :param new_uid: the UID returned by dstfolder.savemessage()."""
+
+        # Succeeded? -> IMAP actually assigned a UID. If newid
+        # remained negative, no server was willing to assign us an
+        # UID. If newid is 0, saving succeeded, but we could not
+        # retrieve the new UID. Ignore message in this case.
+        if new_uid > 0:
+            if new_uid != uid:
+                # Got new UID, change the local uid to match the new one.
+                self.change_message_uid(uid, new_uid)
+                statusfolder.deletemessage(uid)
+                # Got new UID, change the local uid.
+            # Save uploaded status in the statusfolder.
+            statusfolder.savemessage(new_uid, message, flags, rtime)
+            # Check whether the mail has been seen.
+            if 'S' not in flags:
+                self.have_newmail = True
+        elif new_uid == 0:
+            # Message was stored to dstfolder, but we can't find it's UID
+            # This means we can't link current message to the one created
+            # in IMAP. So we just delete local message and on next run
+            # we'll sync it back
+            # XXX This could cause infinite loop on syncing between two
+            # IMAP servers ...
+            self.deletemessage(uid)
+        else:
+            raise OfflineImapError("Trying to save msg (uid %d) on folder "
+                "%s returned invalid uid %d"% (uid, dstfolder.getvisiblename(),
+                new_uid), OfflineImapError.ERROR.MESSAGE)
+
+    def copymessagesto(self, uidlist, dstfolder, statusfolder):
+        """Copies several messages from self to dst with one savemessages()
+
+        Messages are handed to dstfolder.savemessages() in batches bounded
+        by dstfolder.getsavebatchlimits(). If a batch can't be saved, its
+        messages are copied one by one with copymessageto().
+
+        Note that this function does not check against dryrun settings,
+        so you need to ensure that it is never called in a
+        dryrun mode."""
+
+        maxbytes = dstfolder.getsavebatchlimits()[1]
+        batch = []
+        batchbytes = 0
+        for uid in uidlist:
+            try:
+                message = self.getmessage(uid)
+            except (KeyboardInterrupt):
+                raise
+            except Exception:
+                # Let copymessageto() report the error.
+                self.copymessageto(uid, dstfolder, statusfolder, register=0)
+                continue
+            batch.append((uid, message, self.getmessageflags(uid),
+                self.getmessagetime(uid)))
+            batchbytes += len(message)
+            if batchbytes >= maxbytes:
+                self.__savemessages(batch, dstfolder, statusfolder)
+                batch = []
+                batchbytes = 0
+        if len(batch) > 0:
+            self.__savemessages(batch, dstfolder, statusfolder)
+
+    def __savemessages(self, batch, dstfolder, statusfolder):
+        """Save a batch of (uid, message, flags, rtime) in dstfolder."""
+
+        try:
+            new_uids = dstfolder.savemessages(batch)
+        except (KeyboardInterrupt):
+            raise
+        except OfflineImapError as e:
+            if e.severity > OfflineImapError.ERROR.MESSAGE:
+                raise
+            self.ui.error(e, exc_info()[2], msg="Saving %d messages at once "
+                "to %s [acc: %s], retrying one by one"%
+                (len(batch), dstfolder, self.accountname))
+            for uid, message, flags, rtime in batch:
+                self.copymessageto(uid, dstfolder, statusfolder, register=0)
+            return
+
+        for (uid, message, flags, rtime), new_uid in zip(batch, new_uids):
+            try:
+                self.__copiedmessage(uid, new_uid, message, flags, rtime,
+                    dstfolder, statusfolder)
+            except OfflineImapError as e:
+                if e.severity > OfflineImapError.ERROR.MESSAGE:
+                    raise
+                self.ui.error(e, exc_info()[2], msg="Copying message %s "
+                    "[acc: %s]"% (uid, self.accountname))
+
+    def __plan_copy(self, statusfolder):
+        """Plan pass 1: messages in self but not in statusfolder.
+
+        :returns: a tuple of the sorted list of UIDs to copy and the sorted
+                  list of UIDs ignored because of 'copy_ignore_eval'."""
+
+        copylist = statusfolder.uidsmissing(self.getmessageuidset())
+        ignorelist = []
+        if self.copy_ignoreUIDs is not None:
+            ignoreset = set(self.copy_ignoreUIDs)
+            ignorelist = [uid for uid in copylist if uid in ignoreset]
+            copylist = [uid for uid in copylist if uid not in ignoreset]
+        return copylist, ignorelist
+
+    def __plan_delete(self, dstfolder, statusfolder):
+        """Plan pass 2: messages in statusfolder but not in self anymore.
+
+        :returns: a tuple of the sorted list of UIDs to remove from
+                  statusfolder and the sorted list of those to delete from
+                  dstfolder."""
+
+        gonelist = [uid for uid in statusfolder.uidsnotin(
+            self.getmessageuidset()) if uid >= 0]
+        if not self._sync_deletes:
+            gonelist = dstfolder.uidsmissing(gonelist)
+        return gonelist, dstfolder.uidsin(gonelist)
+
+    def __plan_flags(self, dstfolder, statusfolder):
+        """Plan pass 3: flags of self differing from the statusfolder.
+
+        :returns: a tuple of two dicts, mapping each flag to the list of the
+                  UIDs it must be added to, respectively removed from."""
+
+        # For each flag, we store a list of uids to which it should be
+        # added.  Then, we can call addmessagesflags() to apply them in
+        # bulk, rather than one call per message.
+        addflaglist = {}
+        delflaglist = {}
+        # Only the messages which changed since the last sync can have flags
+        # differing from the statusfolder.
+        uidlist = self.getchangeduidlist()
+        if uidlist is None:
+            uidlist = self.getmessageuidset()
+        # Ignore messages with negative UIDs missed by pass 1 and
+        # don't do anything if the message has been deleted remotely
+        uidlist = [uid for uid in dstfolder.uidsin(uidlist) if uid >= 0]
+        statusflaglist = statusfolder.getmessagesflags(uidlist)
+        for uid in uidlist:
+            statusflags = statusflaglist.get(uid, set())
+            selfflags = self.combine_flags_and_keywords(uid, dstfolder)
+
+            for flag in selfflags - statusflags:
+                addflaglist.setdefault(flag, []).append(uid)
+
+            for flag in statusflags - selfflags:
+                delflaglist.setdefault(flag, []).append(uid)
+
+        return addflaglist, delflaglist
+
+    def plansync(self, dstfolder, statusfolder):
+        """Computes what syncmessagesto() would change, without doing it.
+
+        The passes are all planned against the current state, so the plan
+        does not take the effect of the earlier passes into account (e.g.
+        the flags of the messages not copied yet).
+
+        :returns: a dict with the 'copy', 'ignore' and 'delete' lists of UIDs
+                  and the 'addflags' and 'delflags' dicts mapping flags to
+                  lists of UIDs."""
+
+        plan = {}
+        plan['copy'], plan['ignore'] = self.__plan_copy(statusfolder)
+        plan['delete'] = self.__plan_delete(dstfolder, statusfolder)[1]
+        plan['addflags'], plan['delflags'] = self.__plan_flags(dstfolder,
+            statusfolder)
+        return plan
+
     def __syncmessagesto_copy(self, dstfolder, statusfolder):
         """Pass1: Copy locally existing messages not on the other side.
 
@@ -892,18 +1253,13 @@ class BaseFolder(object):
         # We have no new mail yet.
         self.have_newmail = False
 
-        threads = []
-
-        copylist = [uid for uid in self.getmessageuidlist()
-            if not statusfolder.uidexists(uid)]
+        copylist, ignorelist = self.__plan_copy(statusfolder)
+        self.syncchanges += len(copylist)
         num_to_copy = len(copylist)
 
         # Honor 'copy_ignore_eval' configuration option.
-        if self.copy_ignoreUIDs is not None:
-            for uid in self.copy_ignoreUIDs:
-                if uid in copylist:
-                    copylist.remove(uid)
-                    self.ui.ignorecopyingmessage(uid, self, dstfolder)
+        for uid in ignorelist:
+            self.ui.ignorecopyingmessage(uid, self, dstfolder)
 
         if num_to_copy > 0 and self.repository.account.dryrun:
             self.ui.info("[DRYRUN] Copy {} messages from {}[{}] to {}".format(
@@ -911,12 +1267,37 @@ class BaseFolder(object):
             )
             return
 
+        # Messages can be saved in batches if the destination supports it.
+        batchsize = 1
+        if not self.suggeststhreads() and dstfolder.storesmessages():
+            batchsize = dstfolder.getsavebatchlimits()[0]
+        batch = []
+
+        # Copy with threads if either side suggests it: e.g. uploads from a
+        # Maildir to IMAP run in parallel on the pooled IMAP connections,
+        # bounded by the maxconnections of the destination.
+        threadfolder = None
+        if self.suggeststhreads():
+            threadfolder = self
+        elif batchsize <= 1 and dstfolder.suggeststhreads():
+            threadfolder = dstfolder
+        if threadfolder is not None:
+            account = self.repository.account
+            pool = threadutil.InstanceLimitedPool(
+                threadfolder.getinstancelimitnamespace(),
+                name="Copy message from %s:%s"% (self.repository, self),
+                initializer=lambda: self.ui.registerthread(account))
+
         with self:
+            prefetched = 0 # Position in copylist up to which we prefetched.
             for num, uid in enumerate(copylist):
                 # Bail out on CTRL-C or SIGTERM.
                 if offlineimap.accounts.Account.abort_NOW_signal.is_set():
                     break
 
+                if num >= prefetched and dstfolder.storesmessages():
+                    prefetched = num + self.prefetchmessages(copylist[num:])
+
                 if uid == 0:
                     self.ui.warn("Assertion that UID != 0 failed; ignoring message.")
                     continue
@@ -930,20 +1311,22 @@ class BaseFolder(object):
 
                 self.ui.copyingmessage(uid, num+1, num_to_copy, self, dstfolder)
                 # Exceptions are caught in copymessageto().
-                if self.suggeststhreads():
-                    self.waitforthread()
-                    thread = threadutil.InstanceLimitedThread(
-                        self.getinstancelimitnamespace(),
-                        target=self.copymessageto,
-                        name="Copy message from %s:%s"% (self.repository, self),
-                        args=(uid, dstfolder, statusfolder)
-                    )
-                    thread.start()
-                    threads.append(thread)
+                if threadfolder is not None:
+                    threadfolder.waitforthread()
+                    pool.submit(self.copymessageto, uid, dstfolder,
+                        statusfolder, 0)
+                elif batchsize > 1:
+                    batch.append(uid)
+                    if len(batch) >= batchsize:
+                        self.copymessagesto(batch, dstfolder, statusfolder)
+                        batch = []
                 else:
                     self.copymessageto(uid, dstfolder, statusfolder, register=0)
-            for thread in threads:
-                thread.join() # Block until all "copy" threads are done.
+            if len(batch) > 0 and \
+                    not offlineimap.accounts.Account.abort_NOW_signal.is_set():
+                self.copymessagesto(batch, dstfolder, statusfolder)
+            if threadfolder is not None:
+                pool.join() # Block until all "copy" jobs are done.
 
         # Execute new mail hook if we have new mail.
         if self.have_newmail:
@@ -962,20 +1345,18 @@ class BaseFolder(object):
         # The list of messages to delete. If sync of deletions is disabled we
         # still remove stale entries from statusfolder (neither in local nor
         # remote).
-        deletelist = [uid for uid in statusfolder.getmessageuidlist()
-                      if uid >= 0 and
-                      not self.uidexists(uid) and
-                      (self._sync_deletes or not dstfolder.uidexists(uid))]
+        statusdeletelist, deletelist = self.__plan_delete(dstfolder,
+            statusfolder)
+        self.syncchanges += len(statusdeletelist)
 
-        if len(deletelist):
+        if len(statusdeletelist):
             # Delete in statusfolder first to play safe. In case of abort, we
             # won't lose message, we will just unneccessarily retransmit some.
             # Delete messages from statusfolder that were either deleted by the
             # user, or not being tracked (e.g. because of maxage).
             if not self.repository.account.dryrun:
-                statusfolder.deletemessages(deletelist)
-            # Filter out untracked messages.
-            deletelist = [uid for uid in deletelist if dstfolder.uidexists(uid)]
+                statusfolder.deletemessages(statusdeletelist)
+            # Untracked messages are not in deletelist.
             if len(deletelist):
                 self.ui.deletingmessages(deletelist, [dstfolder])
                 if not self.repository.account.dryrun:
@@ -1028,50 +1409,19 @@ class BaseFolder(object):
         This function checks and protects us from action in ryrun mode.
         """
 
-        # For each flag, we store a list of uids to which it should be
-        # added.  Then, we can call addmessagesflags() to apply them in
-        # bulk, rather than one call per message.
-        addflaglist = {}
-        delflaglist = {}
-        for uid in self.getmessageuidlist():
-            # Ignore messages with negative UIDs missed by pass 1 and
-            # don't do anything if the message has been deleted remotely
-            if uid < 0 or not dstfolder.uidexists(uid):
-                continue
-
-            if statusfolder.uidexists(uid):
-                statusflags = statusfolder.getmessageflags(uid)
-            else:
-                statusflags = set()
-
-            selfflags = self.combine_flags_and_keywords(uid, dstfolder)
-
-            addflags = selfflags - statusflags
-            delflags = statusflags - selfflags
-
-            for flag in addflags:
-                if not flag in addflaglist:
-                    addflaglist[flag] = []
-                addflaglist[flag].append(uid)
-
-            for flag in delflags:
-                if not flag in delflaglist:
-                    delflaglist[flag] = []
-                delflaglist[flag].append(uid)
+        addflaglist, delflaglist = self.__plan_flags(dstfolder, statusfolder)
+        self.syncchanges += sum([len(uids) for uids in
+            list(addflaglist.values()) + list(delflaglist.values())])
 
         for flag, uids in addflaglist.items():
             self.ui.addingflags(uids, flag, dstfolder)
-            if self.repository.account.dryrun:
-                continue # Don't actually add in a dryrun.
-            dstfolder.addmessagesflags(uids, set(flag))
-            statusfolder.addmessagesflags(uids, set(flag))
-
         for flag, uids in delflaglist.items():
             self.ui.deletingflags(uids, flag, dstfolder)
-            if self.repository.account.dryrun:
-                continue # Don't actually remove in a dryrun.
-            dstfolder.deletemessagesflags(uids, set(flag))
-            statusfolder.deletemessagesflags(uids, set(flag))
+        if self.repository.account.dryrun:
+            return # Don't actually change flags in a dryrun.
+        if addflaglist or delflaglist:
+            dstfolder.changemessagesflags(addflaglist, delflaglist)
+            statusfolder.changemessagesflags(addflaglist, delflaglist)
 
     def syncmessagesto(self, dstfolder, statusfolder):
         """Syncs messages in this folder to the destination dstfolder.
@@ -1108,6 +1458,7 @@ class BaseFolder(object):
         :param statusfolder: LocalStatus instance to sync against.
         """
 
+        self.syncchanges = 0
         for action in self.syncmessagesto_passes:
             # Bail out on CTRL-C or SIGTERM.
             if offlineimap.accounts.Account.abort_NOW_signal.is_set():
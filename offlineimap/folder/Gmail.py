@@ -120,9 +120,12 @@ class GmailFolder(IMAPFolder):
                 min_date=min_date, min_uid=min_uid)
 
         self.dropmessagelistcache()
+        # Labels changes are not tracked by MODSEQ, always do a full listing.
+        self._changeduids = None
+        self._highestmodseq = None
 
         self.ui.collectingdata(None, self)
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             msgsToFetch = self._msgs_to_fetch(
                 imapobj, min_date=min_date, min_uid=min_uid)
@@ -173,6 +176,13 @@ class GmailFolder(IMAPFolder):
                 rtime = imaplibutil.Internaldate2epoch(messagestr)
                 self.messagelist[uid] = {'uid': uid, 'flags': flags, 'labels': labels, 'time': rtime}
 
+    # Interface from BaseFolder
+    def cachemessagelist_incremental(self, statusfolder):
+        if self.synclabels:
+            return False
+        return super(GmailFolder, self).cachemessagelist_incremental(
+            statusfolder)
+
     def savemessage(self, uid, content, flags, rtime):
         """Save the message on the Server
 
@@ -207,7 +217,7 @@ class GmailFolder(IMAPFolder):
         labels = labels - self.ignorelabels
         uidlist = [uid for uid in uidlist if uid > 0]
         if len(uidlist) > 0:
-            imapobj = self.imapserver.acquireconnection()
+            imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
             try:
                 labels_str = '(' + ' '.join([imaputil.quote(lb) for lb in labels]) + ')'
                 # Coalesce uid's into ranges
@@ -227,6 +237,20 @@ class GmailFolder(IMAPFolder):
                 return retlabels
         return None
 
+    def savemessages(self, messages):
+        """Save several messages on the Server, including their labels."""
+
+        uids = super(GmailFolder, self).savemessages(messages)
+        if self.synclabels:
+            for ret, (uid, content, flags, rtime) in zip(uids, messages):
+                labels = set()
+                for hstr in self.getmessageheaderlist(content,
+                        self.labelsheader):
+                    labels.update(imaputil.labels_from_header(
+                        self.labelsheader, hstr))
+                self.savemessagelabels(ret, labels)
+        return uids
+
     def savemessagelabels(self, uid, labels):
         """Change a message's labels to `labels`.
 
@@ -251,11 +275,8 @@ class GmailFolder(IMAPFolder):
         Note that this function does not check against dryrun settings,
         so you need to ensure that it is never called in a dryrun mode."""
 
-        labels = labels - self.ignorelabels
-        result = self._messagelabels_aux('+X-GM-LABELS', uidlist, labels)
-        if result:
-            for uid in uidlist:
-                self.messagelist[uid]['labels'] = self.messagelist[uid]['labels'] | labels
+        self.changemessageslabels(
+            dict((label, uidlist) for label in labels), {})
 
     def deletemessageslabels(self, uidlist, labels):
         """Delete `labels` from all messages in uidlist.
@@ -263,11 +284,57 @@ class GmailFolder(IMAPFolder):
         Note that this function does not check against dryrun settings,
         so you need to ensure that it is never called in a dryrun mode."""
 
-        labels = labels - self.ignorelabels
-        result = self._messagelabels_aux('-X-GM-LABELS', uidlist, labels)
-        if result:
-            for uid in uidlist:
-                self.messagelist[uid]['labels'] = self.messagelist[uid]['labels'] - labels
+        self.changemessageslabels(
+            {}, dict((label, uidlist) for label in labels))
+
+    def changemessageslabels(self, addlabellist, dellabellist):
+        """Applies the label changes with as few UID STORE as possible.
+
+        The UIDs are grouped by label or by set of labels and sent as
+        silent +X-GM-LABELS/-X-GM-LABELS STOREs of UID ranges, on one
+        connection after a single SELECT. Ignored labels are left alone.
+
+        Note that this function does not check against dryrun settings,
+        so you need to ensure that it is never called in a dryrun mode."""
+
+        def storable(labellist):
+            return dict((label, [uid for uid in uids if uid > 0])
+                for label, uids in labellist.items()
+                if label not in self.ignorelabels)
+
+        stores = self._planstores('+', storable(addlabellist)) + \
+            self._planstores('-', storable(dellabellist))
+        if not stores:
+            return
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
+        try:
+            try:
+                imapobj.select(self.getfullIMAPname())
+            except imapobj.readonly:
+                for operation, uids, labels in stores:
+                    self.ui.labelstoreadonly(self, uids, labels)
+                return
+            for operation, uids, labels in stores:
+                labels_str = '(' + ' '.join(
+                    [imaputil.quote(lb) for lb in sorted(labels)]) + ')'
+                for sequence, chunk in self._storesequences(uids):
+                    response = imapobj.uid('store', sequence,
+                        operation + 'X-GM-LABELS.SILENT', labels_str)
+                    if response[0] != 'OK':
+                        raise OfflineImapError(
+                            'Error with store: %s'% '. '.join(
+                                [str(r) for r in response[1]]),
+                            OfflineImapError.ERROR.MESSAGE)
+                    for uid in chunk:
+                        if uid not in self.messagelist:
+                            continue
+                        oldlabels = self.messagelist[uid]['labels']
+                        if operation == '+':
+                            self.messagelist[uid]['labels'] = oldlabels | labels
+                        else:
+                            self.messagelist[uid]['labels'] = oldlabels - labels
+        finally:
+            self.imapserver.releaseconnection(imapobj)
 
     def copymessageto(self, uid, dstfolder, statusfolder, register = 1):
         """Copies a message from self to dst if needed, updating the status
@@ -310,12 +377,13 @@ class GmailFolder(IMAPFolder):
 
         This function checks and protects us from action in dryrun mode.
         """
-        # This applies the labels message by message, as this makes more sense for a
-        # Maildir target. If applied with an other Gmail IMAP target it would not be
-        # the fastest thing in the world though...
-        uidlist = []
+        # For each label, the UIDs it must be added to or removed from, so
+        # that the destination can apply them in bulk.
+        addlabellist = {}
+        dellabellist = {}
+        labels = {}
 
-        # filter the uids (fast)
+        # Diff the labels in a single pass (fast).
         try:
             for uid in self.getmessageuidlist():
                 # bail out on CTRL-C or SIGTERM
@@ -335,31 +403,24 @@ class GmailFolder(IMAPFolder):
                     statuslabels = set()
 
                 if selflabels != statuslabels:
-                    uidlist.append(uid)
-
-            # now sync labels (slow)
-            mtimes = {}
-            labels = {}
-            for i, uid in enumerate(uidlist):
-                # bail out on CTRL-C or SIGTERM
-                if offlineimap.accounts.Account.abort_NOW_signal.is_set():
-                    break
-
-                selflabels = self.getmessagelabels(uid) - self.ignorelabels
+                    for lb in selflabels - statuslabels:
+                        addlabellist.setdefault(lb, []).append(uid)
+                    for lb in statuslabels - selflabels:
+                        dellabellist.setdefault(lb, []).append(uid)
+                    labels[uid] = selflabels
 
-                if statusfolder.uidexists(uid):
-                    statuslabels = statusfolder.getmessagelabels(uid) - self.ignorelabels
-                else:
-                    statuslabels = set()
+            for lb, uids in sorted(addlabellist.items()):
+                self.ui.addinglabels(uids, lb, dstfolder)
+            for lb, uids in sorted(dellabellist.items()):
+                self.ui.deletinglabels(uids, lb, dstfolder)
+            if self.repository.account.dryrun or not labels:
+                return # Don't actually change labels in a dryrun.
 
-                if selflabels != statuslabels:
-                    self.ui.settinglabels(uid, i+1, len(uidlist), sorted(selflabels), dstfolder)
-                    if self.repository.account.dryrun:
-                        continue #don't actually add in a dryrun
-                    dstfolder.savemessagelabels(uid, selflabels, ignorelabels = self.ignorelabels)
-                    mtime = dstfolder.getmessagemtime(uid)
-                    mtimes[uid] = mtime
-                    labels[uid] = selflabels
+            # Now sync labels (slow for a Maildir destination).
+            dstfolder.changemessageslabels(addlabellist, dellabellist)
+            mtimes = {}
+            for uid in labels:
+                mtimes[uid] = dstfolder.getmessagemtime(uid)
 
             # Update statusfolder in a single DB transaction. It is safe, as if something fails,
             # statusfolder will be updated on the next run.
@@ -51,6 +51,9 @@ class GmailMaildirFolder(MaildirFolder):
             raise Exception("GmailMaildir does not support quick mode"
                 " when 'utime_from_header' is enabled.")
 
+        if self._watcher is not None and \
+                not self._watcher.haschanged(self.getfullname()):
+            return False
         self.cachemessagelist()
         # Folder has different uids than statusfolder => TRUE.
         if sorted(self.getmessageuidlist()) != \
@@ -75,6 +78,7 @@ class GmailMaildirFolder(MaildirFolder):
 
     def cachemessagelist(self, min_date=None, min_uid=None):
         if self.ismessagelistempty():
+            self._startscan()
             self.messagelist = self._scanfolder(min_date=min_date,
                                                 min_uid=min_uid)
 
@@ -303,26 +307,16 @@ class GmailMaildirFolder(MaildirFolder):
                     dellabellist[lb].append(uid)
 
             for lb, uids in addlabellist.items():
-                # Bail out on CTRL-C or SIGTERM.
-                if offlineimap.accounts.Account.abort_NOW_signal.is_set():
-                    break
-
                 self.ui.addinglabels(uids, lb, dstfolder)
-                if self.repository.account.dryrun:
-                    continue # Don't actually add in a dryrun.
-                dstfolder.addmessageslabels(uids, set([lb]))
-                statusfolder.addmessageslabels(uids, set([lb]))
-
             for lb, uids in dellabellist.items():
-                # Bail out on CTRL-C or SIGTERM.
-                if offlineimap.accounts.Account.abort_NOW_signal.is_set():
-                    break
-
                 self.ui.deletinglabels(uids, lb, dstfolder)
-                if self.repository.account.dryrun:
-                    continue # Don't actually remove in a dryrun.
-                dstfolder.deletemessageslabels(uids, set([lb]))
-                statusfolder.deletemessageslabels(uids, set([lb]))
+
+            # Apply all the changes at once: a Gmail destination batches
+            # them into a few UID STOREs.
+            if not self.repository.account.dryrun and \
+                    not offlineimap.accounts.Account.abort_NOW_signal.is_set():
+                dstfolder.changemessageslabels(addlabellist, dellabellist)
+                statusfolder.changemessageslabels(addlabellist, dellabellist)
 
             # Update mtimes on StatusFolder. It is done last to be safe. If
             # something els fails and the mtime is not updated, the labels will
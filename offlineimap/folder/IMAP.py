@@ -24,6 +24,7 @@ import six
 
 from .Base import BaseFolder
 from offlineimap import imaputil, imaplibutil, emailutil, OfflineImapError
+from offlineimap import virtual_imaplib2
 from offlineimap import globals
 from offlineimap.virtual_imaplib2 import MonthNames
 
@@ -31,6 +32,8 @@ from offlineimap.virtual_imaplib2 import MonthNames
 # Globals
 CRLF = '\r\n'
 MSGCOPY_NAMESPACE = 'MSGCOPY_'
+# Longest sequence set of a STORE, for servers with a limited line length.
+FLAGSTORE_MAXSEQUENCE = 1000
 
 
 # NB: message returned from getmessage() will have '\n' all over the place,
@@ -66,6 +69,13 @@ class IMAPFolder(BaseFolder):
 
         # number of times to retry fetching messages
         self.retrycount = self.repository.getconfint('retrycount', 2)
+        # Bodies fetched in batches in the copy pass: str(uid) -> FETCH data.
+        self.fetchbatchmessages = self.repository.getfetchbatchmessages()
+        self.fetchbatchbytes = self.repository.getfetchbatchbytes()
+        # Messages uploaded at once with MULTIAPPEND.
+        self.appendbatchmessages = self.repository.getappendbatchmessages()
+        self.appendbatchbytes = self.repository.getappendbatchbytes()
+        self._prefetched = {}
 
         fh_conf = self.repository.account.getconf('filterheaders', '')
         self.filterheaders = [h for h in re.split(r'\s*,\s*', fh_conf) if h]
@@ -136,7 +146,7 @@ class IMAPFolder(BaseFolder):
         if hasattr(self, '_uidvalidity'):
             # Use cached value if existing.
             return self._uidvalidity
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             # SELECT (if not already done) and get current UIDVALIDITY.
             self.__selectro(imapobj)
@@ -156,7 +166,7 @@ class IMAPFolder(BaseFolder):
         retry = True # Should we attempt another round or exit?
         while retry:
             retry = False
-            imapobj = self.imapserver.acquireconnection()
+            imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
             try:
                 # Select folder and get number of messages.
                 restype, imapdata = imapobj.select(self.getfullIMAPname(), True,
@@ -261,7 +271,7 @@ class IMAPFolder(BaseFolder):
 
     # Interface from BaseFolder
     def msglist_item_initializer(self, uid):
-        return {'uid': uid, 'flags': set(), 'time': 0}
+        return {'uid': uid, 'flags': set(), 'time': 0, 'keywords': set()}
 
 
     # Interface from BaseFolder
@@ -269,20 +279,27 @@ class IMAPFolder(BaseFolder):
         self.ui.loadmessagelist(self.repository, self)
         self.dropmessagelistcache()
 
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             msgsToFetch = self._msgs_to_fetch(
                 imapobj, min_date=min_date, min_uid=min_uid)
+            self._changeduids = None
+            # Remember the HIGHESTMODSEQ of the full listing unless the
+            # listing is restricted (maxage, startdate...).
+            self._highestmodseq = None
+            if min_date is None and min_uid is None and \
+                    self.getmaxsize() is None:
+                self._highestmodseq = self._gethighestmodseq(imapobj)
             if not msgsToFetch:
                 return # No messages to sync.
 
             # Get the flags and UIDs for these. single-quotes prevent
             # imaplib2 from quoting the sequence.
             fetch_msg = "'%s'"% msgsToFetch
+            fetch_query = self._messageinfo_query('FLAGS UID INTERNALDATE')
             self.ui.debug('imap', "calling imaplib2 fetch command: %s %s"%
-                (fetch_msg, '(FLAGS UID INTERNALDATE)'))
-            res_type, response = imapobj.fetch(
-                fetch_msg, '(FLAGS UID INTERNALDATE)')
+                (fetch_msg, fetch_query))
+            res_type, response = imapobj.fetch(fetch_msg, fetch_query)
             if res_type != 'OK':
                 raise OfflineImapError("FETCHING UIDs in folder [%s]%s failed. "
                     "Server responded '[%s] %s'"% (self.getrepository(), self,
@@ -308,8 +325,196 @@ class IMAPFolder(BaseFolder):
                 rtime = imaplibutil.Internaldate2epoch(messagestr)
                 self.messagelist[uid] = {'uid': uid, 'flags': flags, 'time': rtime,
                     'keywords': keywords}
+                if 'RFC822.SIZE' in options:
+                    self.messagelist[uid]['size'] = int(options['RFC822.SIZE'])
         self.ui.messagelistloaded(self.repository, self, self.getmessagecount())
 
+    def _messageinfo_query(self, items):
+        """Returns the FETCH query used to list messages.
+
+        Sizes are only needed to honor 'fetchbatchbytes'."""
+
+        if self.fetchbatchmessages > 1:
+            items += ' RFC822.SIZE'
+        return "(%s)"% items
+
+    # Interface from BaseFolder
+    def dropmessagelistcache(self):
+        super(IMAPFolder, self).dropmessagelistcache()
+        self._prefetched = {}
+
+    def _usecondstore(self, imapobj):
+        """Whether the message list can be kept up-to-date with CONDSTORE."""
+
+        if not self.repository.getcondstore():
+            return False
+        return 'CONDSTORE' in imapobj.capabilities or \
+            'QRESYNC' in imapobj.capabilities
+
+    def _gethighestmodseq(self, imapobj):
+        """Returns the HIGHESTMODSEQ of the folder selected on imapobj.
+
+        Must be called right after a SELECT.
+
+        :returns: the modseq as integer or None if the server did not announce
+                  one (NOMODSEQ mailbox, CONDSTORE not supported or
+                  not enabled)."""
+
+        if not self._usecondstore(imapobj):
+            return None
+        typ, modseq = imapobj.response('HIGHESTMODSEQ')
+        if modseq == [None] or modseq is None:
+            return None
+        try:
+            return int(modseq[-1])
+        except ValueError:
+            return None
+
+    def _fetch_messageinfos(self, imapobj, uids, modifiers=None):
+        """UID FETCH flags and internal dates of the given UIDs.
+
+        :param uids: a sequence set such as '1:*', already suitable for
+                     imaplib2.
+        :param modifiers: optional FETCH modifiers, e.g. '(CHANGEDSINCE 12)'.
+        :returns: a dict mapping UIDs to messagelist items."""
+
+        args = ['FETCH', uids, self._messageinfo_query('FLAGS INTERNALDATE')]
+        if modifiers is not None:
+            args.append(modifiers)
+        self.ui.debug('imap', "calling imaplib2 uid command: %s"%
+            ' '.join(args))
+        res_type, response = imapobj.uid(*args)
+        if res_type != 'OK':
+            raise OfflineImapError("FETCHING UIDs in folder [%s]%s failed. "
+                "Server responded '[%s] %s'"% (self.getrepository(), self,
+                res_type, response), OfflineImapError.ERROR.FOLDER)
+
+        messages = {}
+        for messagestr in response:
+            if messagestr is None:
+                continue
+            messagestr = messagestr.split(' ', 1)[1]
+            options = imaputil.flags2hash(messagestr)
+            if 'UID' not in options:
+                self.ui.warn('No UID in message with options %s'%
+                    str(options), minor=1)
+                continue
+            uid = int(options['UID'])
+            messages[uid] = {'uid': uid,
+                'flags': imaputil.flagsimap2maildir(options['FLAGS']),
+                'time': imaplibutil.Internaldate2epoch(messagestr),
+                'keywords': imaputil.flagsimap2keywords(options['FLAGS'])}
+            if 'RFC822.SIZE' in options:
+                messages[uid]['size'] = int(options['RFC822.SIZE'])
+        return messages
+
+    # Interface from BaseFolder
+    def cachemessagelist_incremental(self, statusfolder):
+        """Cache the message list from the changes since the last sync.
+
+        Requires 'usecondstore' and a server with CONDSTORE (RFC 7162). The
+        message list is rebuilt from the statusfolder, updated with the
+        messages whose MODSEQ is greater than the HIGHESTMODSEQ recorded
+        after the previous sync. Expunged messages are learnt from the
+        VANISHED responses if QRESYNC is enabled, otherwise from a UID SEARCH
+        when the number of messages does not match."""
+
+        if self.getmaxsize() is not None:
+            return False
+        uidvalidity = self.get_uidvalidity()
+        lastmodseq = statusfolder.gethighestmodseq(uidvalidity)
+        if lastmodseq is None:
+            return False
+
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
+        try:
+            if not self._usecondstore(imapobj):
+                return False
+            # Force a new SELECT to get fresh EXISTS and HIGHESTMODSEQ.
+            res_type, imapdata = imapobj.select(self.getfullIMAPname(), True,
+                                                True)
+            highestmodseq = self._gethighestmodseq(imapobj)
+            if highestmodseq is None:
+                return False
+            exists = 0
+            if imapdata != [None]:
+                for msgid in imapdata:
+                    exists = max(int(msgid), exists)
+
+            self.ui.loadmessagelist(self.repository, self)
+            self.dropmessagelistcache()
+            for uid, item in statusfolder.getmessagelist().items():
+                self.messagelist[uid] = {'uid': uid,
+                    'flags': set(item['flags']), 'time': item['time'],
+                    'keywords': set()}
+
+            changed = {}
+            vanished = set()
+            if highestmodseq != lastmodseq and exists > 0:
+                qresync = getattr(imapobj, 'qresync_enabled', False)
+                if qresync:
+                    modifiers = '(CHANGEDSINCE %d VANISHED)'% lastmodseq
+                else:
+                    modifiers = '(CHANGEDSINCE %d)'% lastmodseq
+                changed = self._fetch_messageinfos(imapobj, "'1:*'",
+                    modifiers)
+                if qresync:
+                    typ, data = imapobj.response('VANISHED')
+                    for sequence in data or []:
+                        if sequence is None:
+                            continue
+                        # Looks like '(EARLIER) 41,43:116'.
+                        sequence = sequence.replace('(EARLIER)', '').strip()
+                        vanished.update(imaputil.uid_sequence_expand(sequence))
+
+            for uid in vanished:
+                self.messagelist.pop(uid, None)
+            self.messagelist.update(changed)
+
+            if len(self.messagelist) != exists:
+                # Expunged messages not reported through VANISHED or
+                # messages unknown to the statusfolder: get the real UID
+                # list and fetch what is missing.
+                if exists == 0:
+                    uids = []
+                else:
+                    res_type, data = imapobj.uid('SEARCH', 'ALL')
+                    if res_type != 'OK':
+                        raise OfflineImapError("SEARCH in folder [%s]%s "
+                            "failed. Server responded '[%s] %s'"% (
+                            self.getrepository(), self, res_type, data),
+                            OfflineImapError.ERROR.FOLDER)
+                    uids = [int(uid) for uid in ' '.join(
+                        [d for d in data if d]).split()]
+                for uid in set(self.messagelist.keys()) - set(uids):
+                    del self.messagelist[uid]
+                missing = [uid for uid in uids if uid not in self.messagelist]
+                if len(missing) > 0:
+                    fetched = self._fetch_messageinfos(imapobj,
+                        "'%s'"% imaputil.uid_sequence(missing))
+                    self.messagelist.update(fetched)
+                    changed.update(fetched)
+        finally:
+            self.imapserver.releaseconnection(imapobj)
+
+        self._highestmodseq = highestmodseq
+        self._changeduids = sorted(changed.keys())
+        self.ui.debug('imap', "%s: %d message(s) changed since MODSEQ %d"%
+            (self, len(self._changeduids), lastmodseq))
+        self.ui.messagelistloaded(self.repository, self, self.getmessagecount())
+        return True
+
+    # Interface from BaseFolder
+    def getchangeduidlist(self):
+        return getattr(self, '_changeduids', None)
+
+    # Interface from BaseFolder
+    def savesyncstate(self, statusfolder):
+        highestmodseq = getattr(self, '_highestmodseq', None)
+        if highestmodseq is None or self.repository.account.dryrun:
+            return
+        statusfolder.savehighestmodseq(self.get_uidvalidity(), highestmodseq)
+
     # Interface from BaseFolder
     def getmessage(self, uid):
         """Retrieve message with UID from the IMAP server (incl body).
@@ -339,6 +544,47 @@ class IMAPFolder(BaseFolder):
 
         return data
 
+    # Interface from BaseFolder
+    def prefetchmessages(self, uidlist):
+        """Fetch the bodies of the next messages to copy with one UID FETCH.
+
+        The batch is bounded by 'fetchbatchmessages' and 'fetchbatchbytes'.
+        Fetched messages are kept until getmessage() is called for them."""
+
+        if self.fetchbatchmessages < 2:
+            return len(uidlist)
+
+        batch = []
+        batchsize = 0
+        for uid in uidlist:
+            if len(batch) >= self.fetchbatchmessages:
+                break
+            size = self.messagelist[uid].get('size', 0)
+            if len(batch) > 0 and batchsize + size > self.fetchbatchbytes:
+                break
+            batch.append(uid)
+            batchsize += size
+        if len(batch) < 2:
+            return len(batch)
+
+        try:
+            data = self._fetch_from_imap(imaputil.uid_sequence(batch),
+                self.retrycount, single=False)
+        except OfflineImapError as e:
+            if e.severity > OfflineImapError.ERROR.MESSAGE:
+                raise
+            # Messages will be fetched one by one by getmessage().
+            self.ui.warn("Could not fetch messages %s of folder %s in a "
+                "batch: %s"% (imaputil.uid_sequence(batch), self, e))
+            return len(batch)
+
+        for response in data:
+            # Looks like ('320 (UID 17061 BODY[] {2565}', 'msgbody....').
+            m = re.search(r'UID (\d+)', response[0])
+            if m is not None:
+                self._prefetched[m.group(1)] = response
+        return len(batch)
+
     # Interface from BaseFolder
     def getmessagetime(self, uid):
         return self.messagelist[uid]['time']
@@ -414,6 +660,83 @@ class IMAPFolder(BaseFolder):
             )
         return int(matchinguids[0])
 
+    def __getuidnext(self, imapobj):
+        """Returns the UIDNEXT of the folder, None if unknown."""
+
+        try:
+            typ, dat = imapobj.status(imaputil.quote(self.getfullIMAPname()),
+                '(UIDNEXT)')
+        except imapobj.error as err:
+            self.ui.debug('imap', "__getuidnext: STATUS failed: %s"% err)
+            return None
+        if typ != 'OK' or not dat or dat[0] is None:
+            return None
+        status = imaputil.flags2hash(imaputil.imapsplit(dat[0])[1])
+        try:
+            return int(status['UIDNEXT'])
+        except (KeyError, ValueError):
+            return None
+
+    def __savemessage_digest(self, message, headervalue):
+        """Returns the digest matched by __savemessages_matchdigests()."""
+
+        # RFC822.SIZE counts bytes, not characters.
+        return (message.encodedlen(),
+                self.getmessageheader(message.head, 'message-id'), headervalue)
+
+    def __savemessages_matchdigests(self, imapobj, uidnext, digests):
+        """Finds the UIDs of appended messages without searching.
+
+        The messages appended since UIDNEXT was uidnext are fetched with
+        their size and their Message-ID and X-OfflineIMAP headers, and
+        matched against the digests of the messages we appended. Messages
+        appended meanwhile by other clients are just not matched. Since
+        STATUS on the selected folder might be outdated, a message not found
+        here is searched for the usual way.
+
+        :param digests: list of __savemessage_digest() of the messages.
+        :returns: the list of the UIDs, 0 for the messages not found."""
+
+        uids = [0] * len(digests)
+        if uidnext is None:
+            return uids
+        newuidnext = self.__getuidnext(imapobj)
+        if newuidnext is None or newuidnext <= uidnext or \
+                newuidnext - uidnext > 2 * len(digests) + 100:
+            return uids
+        typ, data = imapobj.uid('FETCH', "'%d:%d'"% (uidnext, newuidnext - 1),
+            '(RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID X-OFFLINEIMAP)])')
+        if typ != 'OK':
+            return uids
+
+        # data is like:
+        # [('12 (UID 40 RFC822.SIZE 1234 BODY[HEADER.FIELDS (...)] {80}',
+        #   'Message-ID: <...>\r\nX-OfflineIMAP: ...\r\n\r\n'), ')', ...]
+        # with UID possibly after the literal.
+        fetched = []
+        for item in data:
+            if isinstance(item, tuple):
+                fetched.append([item[0], item[1]])
+            elif item is not None and fetched:
+                fetched[-1][0] += item
+        indexes = {}
+        for num, digest in enumerate(digests):
+            indexes.setdefault(digest, []).append(num)
+        for meta, headers in fetched:
+            uid = re.search(r'UID\s+(\d+)', meta, flags=re.IGNORECASE)
+            size = re.search(r'RFC822\.SIZE\s+(\d+)', meta,
+                flags=re.IGNORECASE)
+            if not uid or not size:
+                continue
+            headers = headers.replace(CRLF, '\n')
+            digest = (int(size.group(1)),
+                self.getmessageheader(headers, 'message-id'),
+                self.getmessageheader(headers, 'X-OfflineIMAP'))
+            if indexes.get(digest):
+                uids[indexes[digest].pop(0)] = int(uid.group(1))
+        self.ui.debug('imap', "__savemessages_matchdigests: found %s"% uids)
+        return uids
+
     def __savemessage_fetchheaders(self, imapobj, headername, headervalue):
         """ We fetch all new mail headers and search for the right
         X-OfflineImap line by hand. The response from the server has form:
@@ -580,6 +903,183 @@ class IMAPFolder(BaseFolder):
 
         return internaldate
 
+    def __savemessage_prepare(self, content, rtime):
+        """Get a message ready to be APPENDed.
+
+        Only the headers are rewritten here. Proper CRLF is used all over
+        the message while it is sent, chunk by chunk, so that big messages
+        are not copied as a whole.
+
+        :returns: a (message, date) tuple, message being an
+                  emailutil.MessageChunks and date being suitable for
+                  append()."""
+
+        message = emailutil.MessageChunks.split(content, CRLF)
+        # Headers are handled with '\n' line endings, see the NB above.
+        message.head = self.deletemessageheaders(
+            message.head.replace(CRLF, '\n'), self.filterheaders)
+
+        # Get the date of the message, so we can pass it to the server.
+        date = self.__getmessageinternaldate(message.head, rtime)
+        return message, date
+
+    def __appendliteral(self, message):
+        """Returns message as append() takes it.
+
+        Only the bundled imaplib2 sends a message chunk by chunk, a system
+        imaplib2 gets the message as a string."""
+
+        if virtual_imaplib2.DESC == 'bundled':
+            return message
+        return str(message)
+
+    # Interface from BaseFolder
+    def getsavebatchlimits(self):
+        return (self.appendbatchmessages, self.appendbatchbytes)
+
+    # Interface from BaseFolder
+    def savemessages(self, messages):
+        """Save several messages on the server with one MULTIAPPEND
+
+        Uses MULTIAPPEND (RFC 3502) to APPEND all the messages with a single
+        command. With UIDPLUS the new UIDs are all read from the APPENDUID
+        response, otherwise each message gets a random header we search for
+        like savemessage() does. Falls back to savemessage() for each message
+        if the server does not support MULTIAPPEND.
+
+        MULTIAPPEND is atomic: if it fails, none of the messages was saved.
+
+        :returns: the list of UIDs as savemessage() returns them."""
+
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
+        if 'MULTIAPPEND' not in imapobj.capabilities or len(messages) < 2:
+            self.imapserver.releaseconnection(imapobj)
+            return super(IMAPFolder, self).savemessages(messages)
+
+        # NB: as in savemessage(), set imapobj to None if the connection was
+        # released already.
+        try:
+            use_uidplus = 'UIDPLUS' in imapobj.capabilities
+            headers = []
+            digests = []
+            literals = []
+            for uid, content, flags, rtime in messages:
+                self.ui.savemessage('imap', uid, flags, self)
+                message, date = self.__savemessage_prepare(content, rtime)
+                if not use_uidplus:
+                    # Insert a random unique header that we can fetch later.
+                    header = self.__generate_randomheader(content)
+                    message.head = self.addmessageheader(message.head, '\n',
+                        *header)
+                    headers.append(header)
+                    digests.append(self.__savemessage_digest(message,
+                        header[1]))
+                literals.append((imaputil.flagsmaildir2imap(flags), date,
+                    message))
+
+            try:
+                # Select folder for append and make the box READ-WRITE.
+                imapobj.select(self.getfullIMAPname())
+            except imapobj.readonly:
+                for uid, content, flags, rtime in messages:
+                    self.ui.msgtoreadonly(self, uid, content, flags)
+                return [uid for uid, content, flags, rtime in messages]
+            uidnext = None
+            if not use_uidplus:
+                uidnext = self.__getuidnext(imapobj)
+
+            # The command line announces the first literal. Each literal
+            # sent on continuation is followed by the announce of the next
+            # one: 'APPEND box (flags) date {n1}', 'msg1 (flags) date {n2}'...
+            flags, date, message = literals[0]
+            args = [self.getfullIMAPname(), flags, date,
+                "'{%d}'"% len(message)]
+            parts = []
+            for num, (flags, date, message) in enumerate(literals):
+                if num + 1 < len(literals):
+                    nflags, ndate, nmessage = literals[num + 1]
+                    message.tail = ' ' + ' '.join([x for x in (nflags, ndate,
+                        '{%d}'% len(nmessage)) if x is not None])
+                parts.append(self.__appendliteral(message))
+            parts = iter(parts)
+
+            self.ui.debug('imap', "savemessages: MULTIAPPEND %d messages"%
+                len(literals))
+            try:
+                imapobj.literal = lambda data, rqb: next(parts, None)
+                try:
+                    typ, dat = imapobj._simple_command('APPEND', *args)
+                finally:
+                    imapobj._release_state_change()
+            except imapobj.abort as e:
+                self.imapserver.releaseconnection(imapobj, True)
+                imapobj = None
+                six.reraise(OfflineImapError,
+                            OfflineImapError("Saving %d msgs in folder '%s', "
+                                "repository '%s' failed (abort). Server "
+                                "responded: %s"% (len(literals), self,
+                                self.getrepository(), str(e)),
+                                OfflineImapError.ERROR.MESSAGE),
+                            exc_info()[2])
+            except imapobj.error as e:
+                self.imapserver.releaseconnection(imapobj, True)
+                imapobj = None
+                six.reraise(OfflineImapError,
+                            OfflineImapError("Saving %d msgs in folder '%s', "
+                                "repository '%s' failed (error). Server "
+                                "responded: %s"% (len(literals), self,
+                                self.getrepository(), str(e)),
+                                OfflineImapError.ERROR.MESSAGE),
+                            exc_info()[2])
+            if typ != 'OK':
+                # Most likely a quota issue, see savemessage().
+                raise OfflineImapError("Saving %d msgs in folder '%s', "
+                    "repository '%s' failed (abort). Server responded: %s %s\n"%
+                    (len(literals), self, self.getrepository(), typ, dat),
+                    OfflineImapError.ERROR.REPO)
+
+            # Checkpoint, see savemessage().
+            (typ, dat) = imapobj.check()
+            assert(typ == 'OK')
+
+            uids = [0] * len(literals)
+            if use_uidplus:
+                # Looks like OK [APPENDUID 38505 3955:3957], the UIDs being
+                # given in the order of the messages.
+                resp = imapobj._get_untagged_response('APPENDUID')
+                try:
+                    newuids = imaputil.uid_sequence_expand(
+                        resp[-1].split(' ')[1])
+                except Exception:
+                    newuids = []
+                if len(newuids) == len(uids):
+                    uids = newuids
+                else:
+                    self.ui.warn("savemessages: Server supports UIDPLUS, but"
+                        " we got no usable UIDs back. APPENDUID reponse was "
+                        "'%s'"% str(resp))
+            else:
+                uids = self.__savemessages_matchdigests(imapobj, uidnext,
+                    digests)
+                for num, (headername, headervalue) in enumerate(headers):
+                    if uids[num] != 0:
+                        continue
+                    uids[num] = self.__savemessage_searchforheader(imapobj,
+                        headername, headervalue)
+                    if uids[num] == 0:
+                        uids[num] = self.__savemessage_fetchheaders(imapobj,
+                            headername, headervalue)
+        finally:
+            if imapobj:
+                self.imapserver.releaseconnection(imapobj)
+
+        for uid, (olduid, content, flags, rtime) in zip(uids, messages):
+            if uid: # Avoid UID FETCH 0 crash happening later on.
+                self.messagelist[uid] = self.msglist_item_initializer(uid)
+                self.messagelist[uid]['flags'] = flags
+        self.ui.debug('imap', 'savemessages: returning new UIDs %s'% uids)
+        return uids
+
     # Interface from BaseFolder
     def savemessage(self, uid, content, flags, rtime):
         """Save the message on the Server
@@ -606,21 +1106,15 @@ class IMAPFolder(BaseFolder):
             self.savemessageflags(uid, flags)
             return uid
 
-        content = self.deletemessageheaders(content, self.filterheaders)
-
-        # Use proper CRLF all over the message.
-        content = re.sub("(?<!\r)\n", CRLF, content)
-
-        # Get the date of the message, so we can pass it to the server.
-        date = self.__getmessageinternaldate(content, rtime)
+        message, date = self.__savemessage_prepare(content, rtime)
 
         # Message-ID is handy for debugging messages.
-        msg_id = self.getmessageheader(content, "message-id")
+        msg_id = self.getmessageheader(message.head, "message-id")
         if not msg_id:
             msg_id = '[unknown message-id]'
 
         retry_left = 2 # succeeded in APPENDING?
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         # NB: in the finally clause for this try we will release
         # NB: the acquired imapobj, so don't do that twice unless
         # NB: you will put another connection to imapobj.  If you
@@ -638,12 +1132,13 @@ class IMAPFolder(BaseFolder):
                         content)
                     self.ui.debug('imap', 'savemessage: header is: %s: %s'%
                         (headername, headervalue))
-                    content = self.addmessageheader(content, CRLF, headername, headervalue)
+                    message.head = self.addmessageheader(message.head, '\n',
+                        headername, headervalue)
 
-                if len(content) > 200:
-                    dbg_output = "%s...%s"% (content[:150], content[-50:])
+                if len(message) > 200:
+                    dbg_output = "%s...%s"% (message.head[:150], content[-50:])
                 else:
-                    dbg_output = content
+                    dbg_output = str(message)
                 self.ui.debug('imap', "savemessage: date: %s, content: '%s'"%
                     (date, dbg_output))
 
@@ -659,7 +1154,8 @@ class IMAPFolder(BaseFolder):
                 # Do the APPEND.
                 try:
                     (typ, dat) = imapobj.append(self.getfullIMAPname(),
-                        imaputil.flagsmaildir2imap(flags), date, content)
+                        imaputil.flagsmaildir2imap(flags), date,
+                        self.__appendliteral(message))
                     # This should only catch 'NO' responses since append()
                     # will raise an exception for 'BAD' responses:
                     if typ != 'OK':
@@ -679,7 +1175,7 @@ class IMAPFolder(BaseFolder):
                     # Connection has been reset, release connection and retry.
                     retry_left -= 1
                     self.imapserver.releaseconnection(imapobj, True)
-                    imapobj = self.imapserver.acquireconnection()
+                    imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
                     if not retry_left:
                         six.reraise(OfflineImapError,
                                     OfflineImapError("Saving msg (%s) in folder '%s', "
@@ -767,16 +1263,23 @@ class IMAPFolder(BaseFolder):
         return uid
 
 
-    def _fetch_from_imap(self, uids, retry_num=1):
+    def _fetch_from_imap(self, uids, retry_num=1, single=True):
         """Fetches data from IMAP server.
 
         Arguments:
         - uids: message UIDS
         - retry_num: number of retries to make
+        - single: whether uids is a single UID, in which case exactly one
+          message is expected.
 
         Returns: data obtained by this query."""
 
-        imapobj = self.imapserver.acquireconnection()
+        # Already fetched by prefetchmessages()?
+        data = self._prefetched.pop(uids, None)
+        if data is not None:
+            return [data]
+
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             query = "(%s)"% (" ".join(self.imap_query))
             fails_left = retry_num  # Retry on dropped connection.
@@ -803,7 +1306,7 @@ class IMAPFolder(BaseFolder):
                         )
                     # Release dropped connection, and get a new one.
                     self.imapserver.releaseconnection(imapobj, True)
-                    imapobj = self.imapserver.acquireconnection()
+                    imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         finally:
              # The imapobj here might be different than the one created before
              # the ``try`` clause. So please avoid transforming this to a nice
@@ -813,13 +1316,14 @@ class IMAPFolder(BaseFolder):
         # Ensure to not consider unsolicited FETCH responses caused by flag
         # changes from concurrent connections.  These appear as strings in
         # 'data' (the BODY response appears as a tuple).  This should leave
-        # exactly one response.
+        # exactly one response per message.
         if res_type == 'OK':
             data = [res for res in data if not isinstance(res, str)]
 
         # Could not fetch message.  Note: it is allowed by rfc3501 to return any
         # data for the UID FETCH command.
-        if data == [None] or res_type != 'OK' or len(data) != 1:
+        if data == [None] or res_type != 'OK' or len(data) < 1 or \
+                (single and len(data) != 1):
             severity = OfflineImapError.ERROR.MESSAGE
             reason = "IMAP server '%s' failed to fetch messages UID '%s'."\
                 " Server responded: %s %s"% (self.getrepository(), uids,
@@ -860,7 +1364,7 @@ class IMAPFolder(BaseFolder):
         so you need to ensure that it is never called in a
         dryrun mode."""
 
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             result = self._store_to_imap(imapobj, str(uid), 'FLAGS',
                 imaputil.flagsmaildir2imap(flags))
@@ -899,59 +1403,110 @@ class IMAPFolder(BaseFolder):
     def deletemessagesflags(self, uidlist, flags):
         self.__processmessagesflags('-', uidlist, flags)
 
-    def __processmessagesflags_real(self, operation, uidlist, flags):
-        imapobj = self.imapserver.acquireconnection()
+    # Interface from BaseFolder
+    def changemessagesflags(self, addflaglist, delflaglist):
+        """Applies the flag changes with as few UID STORE as possible.
+
+        See __storeflags()."""
+
+        self.__storeflags(self._planstores('+', addflaglist) +
+            self._planstores('-', delflaglist))
+
+    def __processmessagesflags(self, operation, uidlist, flags):
+        self.__storeflags(self._planstores(operation,
+            dict((flag, uidlist) for flag in flags)))
+
+    def _planstores(self, operation, flaglist):
+        """Groups the UIDs of a flag -> UIDs dict into STORE commands.
+
+        UIDs are grouped either by flag or by set of flags, whichever needs
+        fewer commands. Works the same for Gmail labels.
+
+        :returns: a list of (operation, sorted UIDs, flags) tuples."""
+
+        byflag = [(operation, sorted(uids), set(flag))
+                  for flag, uids in flaglist.items() if len(uids)]
+        uidflags = {}
+        for flag, uids in flaglist.items():
+            for uid in uids:
+                uidflags.setdefault(uid, set()).add(flag)
+        byset = {}
+        for uid, flags in uidflags.items():
+            byset.setdefault(frozenset(flags), []).append(uid)
+        if len(byset) < len(byflag):
+            return [(operation, sorted(uids), set(flags))
+                    for flags, uids in byset.items()]
+        return byflag
+
+    def _storesequences(self, uids):
+        """Yields (sequence set, UIDs) pairs of uids, keeping the sequence
+        sets short for the IMAP servers with a limited line length."""
+
+        pieces, length = [], 0
+        for piece in imaputil.uid_sequence(uids).split(','):
+            if pieces and length + len(piece) > FLAGSTORE_MAXSEQUENCE:
+                sequence = ','.join(pieces)
+                yield sequence, imaputil.uid_sequence_expand(sequence)
+                pieces, length = [], 0
+            pieces.append(piece)
+            length += len(piece) + 1
+        if pieces:
+            sequence = ','.join(pieces)
+            yield sequence, imaputil.uid_sequence_expand(sequence)
+
+    def __storeflags(self, stores):
+        """Runs the UID STORE commands planned by _planstores().
+
+        All the commands are sent on one connection after a single SELECT.
+        They are silent: the messagelist is updated with the changes made,
+        then with the FETCH responses the server sends anyway (e.g. for
+        changes made meanwhile by other clients)."""
+
+        if not stores:
+            return
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             try:
                 imapobj.select(self.getfullIMAPname())
             except imapobj.readonly:
-                self.ui.flagstoreadonly(self, uidlist, flags)
+                for operation, uids, flags in stores:
+                    self.ui.flagstoreadonly(self, uids, flags)
                 return
-            response = imapobj.uid('store',
-                imaputil.uid_sequence(uidlist), operation + 'FLAGS',
-                    imaputil.flagsmaildir2imap(flags))
-            if response[0] != 'OK':
-                raise OfflineImapError(
-                    'Error with store: %s'% '. '.join(response[1]),
-                    OfflineImapError.ERROR.MESSAGE)
-            response = response[1]
+            for operation, uids, flags in stores:
+                for sequence, chunk in self._storesequences(uids):
+                    response = imapobj.uid('store', sequence,
+                        operation + 'FLAGS.SILENT',
+                        imaputil.flagsmaildir2imap(flags))
+                    if response[0] != 'OK':
+                        raise OfflineImapError(
+                            'Error with store: %s'% '. '.join(response[1]),
+                            OfflineImapError.ERROR.MESSAGE)
+                    for uid in chunk:
+                        if uid not in self.messagelist:
+                            continue
+                        if operation == '+':
+                            self.messagelist[uid]['flags'] |= flags
+                        else:
+                            self.messagelist[uid]['flags'] -= flags
+                    self.__updateflagsfromfetch(response[1])
         finally:
             self.imapserver.releaseconnection(imapobj)
-        # Some IMAP servers do not always return a result.  Therefore,
-        # only update the ones that it talks about, and manually fix
-        # the others.
-        needupdate = list(uidlist)
-        for result in response:
-            if result is None:
-                # Compensate for servers that don't return anything from
-                # STORE.
+
+    def __updateflagsfromfetch(self, data):
+        """Updates the messagelist from untagged FETCH responses with both
+        UID and FLAGS, e.g. '12 (UID 40 FLAGS (\\Seen))'."""
+
+        for result in data:
+            if result is None or isinstance(result, tuple):
                 continue
             attributehash = imaputil.flags2hash(imaputil.imapsplit(result)[1])
             if not ('UID' in attributehash and 'FLAGS' in attributehash):
-                # Compensate for servers that don't return a UID attribute.
+                # Unsolicited FETCH without UID, can't tell which message.
                 continue
-            flagstr = attributehash['FLAGS']
             uid = int(attributehash['UID'])
-            self.messagelist[uid]['flags'] = imaputil.flagsimap2maildir(flagstr)
-            try:
-                needupdate.remove(uid)
-            except ValueError:  # Let it slide if it's not in the list.
-                pass
-        for uid in needupdate:
-            if operation == '+':
-                self.messagelist[uid]['flags'] |= flags
-            elif operation == '-':
-                self.messagelist[uid]['flags'] -= flags
-
-
-    def __processmessagesflags(self, operation, uidlist, flags):
-        # Hack for those IMAP servers with a limited line length.
-        batch_size = 100
-        for i in range(0, len(uidlist), batch_size):
-            self.__processmessagesflags_real(operation,
-              uidlist[i:i + batch_size], flags)
-        return
-
+            if uid in self.messagelist:
+                self.messagelist[uid]['flags'] = \
+                    imaputil.flagsimap2maildir(attributehash['FLAGS'])
 
     # Interface from BaseFolder
     def change_message_uid(self, uid, new_uid):
@@ -975,7 +1530,7 @@ class IMAPFolder(BaseFolder):
             return
 
         self.__addmessagesflags_noconvert(uidlist, set('T'))
-        imapobj = self.imapserver.acquireconnection()
+        imapobj = self.imapserver.acquireconnection(self.getfullIMAPname())
         try:
             try:
                 imapobj.select(self.getfullIMAPname())
@@ -264,6 +264,14 @@ class LocalStatusFolder(BaseFolder):
     def getmessagemtime(self, uid):
         return self.messagelist[uid]['mtime']
 
+    def gethighestmodseq(self, uidvalidity):
+        """The plain text backend does not record HIGHESTMODSEQ values."""
+
+        return None
+
+    def savehighestmodseq(self, uidvalidity, modseq):
+        pass
+
     # Interface from BaseFolder
     def deletemessage(self, uid):
         self.deletemessages([uid])
@@ -51,6 +51,72 @@ class DatabaseFileLock(object):
         return self._counter < 1
 
 
+class StatusMessageList(object):
+    """Dict-like messagelist reading the status rows on demand.
+
+    Only the rows looked up (or saved) during a sync are kept in memory.
+    Writes to the database are still done by the folder methods, this only
+    caches their view of the rows."""
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._cache = {}
+
+    def _query(self, sql, args=()):
+        return self._folder.connection.execute(sql, args)
+
+    def __contains__(self, uid):
+        if uid in self._cache:
+            return True
+        return self._query('SELECT 1 FROM status WHERE id=?',
+            (uid,)).fetchone() is not None
+
+    def __getitem__(self, uid):
+        try:
+            return self._cache[uid]
+        except KeyError:
+            row = self._query('SELECT id,flags,mtime,labels FROM status '
+                'WHERE id=?', (uid,)).fetchone()
+            if row is None:
+                raise
+            item = self._folder._row2msglistitem(row)
+            self._cache[uid] = item
+            return item
+
+    def get(self, uid, default=None):
+        try:
+            return self[uid]
+        except KeyError:
+            return default
+
+    def __setitem__(self, uid, item):
+        self._cache[uid] = item
+
+    def __delitem__(self, uid):
+        self._cache.pop(uid, None)
+
+    def __len__(self):
+        return self._query('SELECT count(id) FROM status').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [row[0] for row in
+                self._query('SELECT id FROM status ORDER BY id')]
+
+    def items(self):
+        """Returns all the (uid, item) pairs, without caching them."""
+
+        return [(row[0], self._cache.get(row[0]) or
+                 self._folder._row2msglistitem(row))
+                for row in self._query('SELECT id,flags,mtime,labels FROM '
+                    'status ORDER BY id')]
+
+    def values(self):
+        return [item for uid, item in self.items()]
+
+
 class LocalStatusSQLiteFolder(BaseFolder):
     """LocalStatus backend implemented with an SQLite database
 
@@ -93,6 +159,11 @@ class LocalStatusSQLiteFolder(BaseFolder):
         self._databaseFileLock = LocalStatusSQLiteFolder.locks[self.filename]
         self._in_transactions = 0
 
+        # Answer lookups straight from the database instead of loading the
+        # whole status in memory.
+        self._lazy = repository.account.getconfboolean('status_lazy', False)
+        self.dropmessagelistcache()
+
     def __enter__(self):
         if not self.dofsync():
             assert self.connection is not None
@@ -238,32 +309,47 @@ class LocalStatusSQLiteFolder(BaseFolder):
         return {'uid': uid, 'flags': set(), 'labels': set(), 'time': 0, 'mtime': 0}
 
 
+    # Interface from BaseFolder
+    def dropmessagelistcache(self):
+        if self._lazy:
+            self.messagelist = StatusMessageList(self)
+        else:
+            self.messagelist = self._newmessagelist()
+
     # Interface from BaseFolder
     def cachemessagelist(self):
         self.dropmessagelistcache()
+        if self._lazy:
+            return # Rows are read on demand.
         cursor = self.connection.execute('SELECT id,flags,mtime,labels from status')
         for row in cursor:
-            uid = row[0]
-            self.messagelist[uid] = self.msglist_item_initializer(uid)
-            flags = set(row[1])
-            try:
-                labels = set([lb.strip() for lb in
-                    row[3].split(',') if len(lb.strip()) > 0])
-            except AttributeError:
-                # FIXME: This except clause was introduced because row[3] from
-                # database can be found of unexpected type NoneType. See
-                # https://github.com/OfflineIMAP/offlineimap/issues/103
-                #
-                # We are fixing the type here but this would require more
-                # researches to find the true root cause. row[3] is expected to
-                # be a (empty) string, not None.
-                #
-                # Also, since database might return None, we have to fix the
-                # database, too.
-                labels = set()
-            self.messagelist[uid]['flags'] = flags
-            self.messagelist[uid]['labels'] = labels
-            self.messagelist[uid]['mtime'] = row[2]
+            self.messagelist[row[0]] = self._row2msglistitem(row)
+
+    def _row2msglistitem(self, row):
+        """Returns the messagelist item of a (id,flags,mtime,labels) row."""
+
+        uid = row[0]
+        item = self.msglist_item_initializer(uid)
+        flags = set(row[1])
+        try:
+            labels = set([lb.strip() for lb in
+                row[3].split(',') if len(lb.strip()) > 0])
+        except AttributeError:
+            # FIXME: This except clause was introduced because row[3] from
+            # database can be found of unexpected type NoneType. See
+            # https://github.com/OfflineIMAP/offlineimap/issues/103
+            #
+            # We are fixing the type here but this would require more
+            # researches to find the true root cause. row[3] is expected to
+            # be a (empty) string, not None.
+            #
+            # Also, since database might return None, we have to fix the
+            # database, too.
+            labels = set()
+        item['flags'] = flags
+        item['labels'] = labels
+        item['mtime'] = row[2]
+        return item
 
     def closefiles(self):
         with self._databaseFileLock.getLock():
@@ -375,6 +461,56 @@ class LocalStatusSQLiteFolder(BaseFolder):
         return self.messagelist[uid]['flags']
 
 
+    def __queryuids(self, uids, sql):
+        """Returns the rows of the query sql, in which the temporary table
+        syncuids holds the UIDs of uids.
+
+        This lets SQLite compute the set operations of the sync planner
+        instead of loading the whole status in lazy mode."""
+
+        with self._databaseFileLock.getLock():
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS '
+                'syncuids (id INTEGER PRIMARY KEY)')
+            try:
+                self.connection.executemany('INSERT OR IGNORE INTO syncuids '
+                    '(id) VALUES (?)', [(uid,) for uid in uids])
+                return self.connection.execute(sql).fetchall()
+            finally:
+                self.connection.execute('DELETE FROM syncuids')
+                if not self._in_transactions:
+                    self.connection.commit()
+
+    # Interface from BaseFolder
+    def uidsin(self, uids):
+        if not self._lazy:
+            return super(LocalStatusSQLiteFolder, self).uidsin(uids)
+        return [row[0] for row in self.__queryuids(uids, 'SELECT id FROM '
+            'syncuids WHERE id IN (SELECT id FROM status) ORDER BY id')]
+
+    # Interface from BaseFolder
+    def uidsmissing(self, uids):
+        if not self._lazy:
+            return super(LocalStatusSQLiteFolder, self).uidsmissing(uids)
+        return [row[0] for row in self.__queryuids(uids, 'SELECT id FROM '
+            'syncuids WHERE id NOT IN (SELECT id FROM status) ORDER BY id')]
+
+    # Interface from BaseFolder
+    def uidsnotin(self, uids):
+        if not self._lazy:
+            return super(LocalStatusSQLiteFolder, self).uidsnotin(uids)
+        return [row[0] for row in self.__queryuids(uids, 'SELECT id FROM '
+            'status WHERE id NOT IN (SELECT id FROM syncuids) ORDER BY id')]
+
+    # Interface from BaseFolder
+    def getmessagesflags(self, uidlist):
+        if not self._lazy:
+            return super(LocalStatusSQLiteFolder, self).getmessagesflags(
+                uidlist)
+        return dict((row[0], set(row[1])) for row in self.__queryuids(
+            uidlist, 'SELECT status.id,status.flags FROM status '
+            'JOIN syncuids ON status.id = syncuids.id'))
+
+
     def savemessagelabels(self, uid, labels, mtime=None):
         self.messagelist[uid]['labels'] = labels
         if mtime: self.messagelist[uid]['mtime'] = mtime
@@ -421,6 +557,33 @@ class LocalStatusSQLiteFolder(BaseFolder):
         return self.messagelist[uid]['labels']
 
 
+    def gethighestmodseq(self, uidvalidity):
+        """Return the HIGHESTMODSEQ recorded for the remote folder
+
+        :returns: the modseq as integer, or None if none was saved yet or
+            if it was saved for another UIDVALIDITY."""
+
+        cursor = self.connection.execute(
+            "SELECT value FROM metadata WHERE key='highestmodseq'")
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        try:
+            saved_uidvalidity, modseq = [int(x) for x in row[0].split(':')]
+        except ValueError:
+            return None
+        if saved_uidvalidity != uidvalidity:
+            return None
+        return modseq
+
+
+    def savehighestmodseq(self, uidvalidity, modseq):
+        """Record the HIGHESTMODSEQ of the remote folder after a sync."""
+
+        self.__sql_write('INSERT OR REPLACE INTO metadata (key,value) '
+            'VALUES (?,?)', ('highestmodseq', "%d:%d"% (uidvalidity, modseq)))
+
+
     def savemessagesmtimebulk(self, mtimes):
         """Saves mtimes from the mtimes dictionary in a single database operation."""
 
@@ -15,6 +15,7 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 
+import errno
 import socket
 import time
 import re
@@ -60,6 +61,9 @@ def _gettimeseq(date=None):
 
 
 class MaildirFolder(BaseFolder):
+    # Header of the scan cache file: version, infosep and folder md5.
+    scancache_magicline = "OFFLINEIMAP MAILDIR SCAN CACHE 1 %s %s"
+
     def __init__(self, root, name, sep, repository):
         self.sep = sep # needs to be set before super().__init__
         super(MaildirFolder, self).__init__(name, repository)
@@ -86,6 +90,16 @@ class MaildirFolder(BaseFolder):
         self.sep_subst = '-'
         if os.path.sep == self.sep_subst:
             self.sep_subst = '_'
+        # UID -> filename index from a rescan, see _locatemessage().
+        self._uidfiles = None
+        # Tracks changes of new|cur between scans, if enabled.
+        self._watcher = repository.getwatcher()
+        # Persistent cache of the parsed new|cur entries, if enabled.
+        self._scancachefile = None
+        scancachedir = repository.getscancachedir()
+        if scancachedir is not None:
+            self._scancachefile = os.path.join(scancachedir,
+                self.getfolderbasename())
 
     # Interface from BaseFolder
     def getfullname(self):
@@ -156,6 +170,98 @@ class MaildirFolder(BaseFolder):
             flags = set((c for c in flagmatch.group(1)))
         return prefix, uid, fmd5, flags
 
+    def _loadscancache(self):
+        """Load the scan cache of this folder.
+
+        :returns: dict of dirannex -> (dirstate, {filename: (uid, flags,
+            size)}). Empty if there is no usable cache."""
+
+        cache = {}
+        if self._scancachefile is None or \
+                not os.path.exists(self._scancachefile):
+            return cache
+        magicline = self.scancache_magicline % (self.infosep, self._foldermd5)
+        try:
+            with open(self._scancachefile, 'rt') as cachefd:
+                if cachefd.readline().rstrip('\n') != magicline:
+                    return cache # Stale format or folder settings.
+                entries = None
+                for line in cachefd:
+                    line = line.rstrip('\n')
+                    if line.startswith('D '):
+                        _, dirannex, dirstate = line.split(' ', 2)
+                        entries = {}
+                        cache[dirannex] = (dirstate, entries)
+                        continue
+                    uid, flags, size, filename = line.split('\t', 3)
+                    uid = None if uid == '-' else int(uid)
+                    size = None if size == '-' else int(size)
+                    entries[filename] = (uid, set(flags), size)
+        except (ValueError, TypeError) as e:
+            self.ui.warn("Ignoring corrupt Maildir scan cache '%s': %s"%
+                (self._scancachefile, e))
+            return {}
+        return cache
+
+    def _savescancache(self, cache):
+        """Write the scan cache of this folder, see _loadscancache()."""
+
+        if self._scancachefile is None:
+            return
+        magicline = self.scancache_magicline % (self.infosep, self._foldermd5)
+        with open(self._scancachefile + ".tmp", "wt") as cachefd:
+            cachefd.write(magicline + "\n")
+            for dirannex, (dirstate, entries) in cache.items():
+                cachefd.write("D %s %s\n"% (dirannex, dirstate))
+                for filename, (uid, flags, size) in entries.items():
+                    cachefd.write("%s\t%s\t%s\t%s\n"% (
+                        '-' if uid is None else uid, ''.join(sorted(flags)),
+                        '-' if size is None else size, filename))
+        os.rename(self._scancachefile + ".tmp", self._scancachefile)
+
+    def _scandir(self, dirannex, cache, newcache, maxsize):
+        """Returns the parsed entries of the dirannex (new|cur) directory.
+
+        Entries are taken from the scan cache when the directory did not
+        change. Otherwise, only the files unknown to the cache are parsed.
+        The entries are recorded in newcache, without the directory state
+        if the directory changed too recently to trust its mtime.
+
+        :returns: dict of filename -> (uid, flags, size). size is None if
+            it was not needed."""
+
+        fulldirname = os.path.join(self.getfullname(), dirannex)
+        st = os.stat(fulldirname)
+        dirstate = "%d %d %r"% (st.st_dev, st.st_ino,
+            getattr(st, 'st_mtime_ns', st.st_mtime))
+        cachedstate, cached = cache.get(dirannex, (None, {}))
+        if dirstate == cachedstate and \
+                (not maxsize or None not in (e[2] for e in cached.values())):
+            newcache[dirannex] = (dirstate, cached)
+            return cached
+
+        entries = {}
+        cacheable = True
+        for filename in os.listdir(fulldirname):
+            if filename.startswith('.'):
+                continue # Ignore dot files.
+            entry = cached.get(filename)
+            if entry is None:
+                prefix, uid, fmd5, flags = self._parse_filename(filename)
+                entry = (uid, flags, None)
+            if maxsize and entry[2] is None:
+                entry = entry[:2] + (os.path.getsize(
+                    os.path.join(fulldirname, filename)),)
+            entries[filename] = entry
+            if '\n' in filename or '\t' in filename:
+                cacheable = False
+        if cacheable:
+            # Changes within the mtime granularity could go unnoticed.
+            if time.time() - st.st_mtime <= 2:
+                dirstate = '-'
+            newcache[dirannex] = (dirstate, entries)
+        return entries
+
     def _scanfolder(self, min_date=None, min_uid=None):
         """Cache the message list from a Maildir.
 
@@ -172,37 +278,31 @@ class MaildirFolder(BaseFolder):
 
         maxsize = self.getmaxsize()
 
-        retval = {}
+        retval = self._newmessagelist()
         files = []
         nouidcounter = -1   # Messages without UIDs get negative UIDs.
+        cache = self._loadscancache()
+        newcache = {}
         for dirannex in ['new', 'cur']:
-            fulldirname = os.path.join(self.getfullname(), dirannex)
-            files.extend((dirannex, filename) for
-                         filename in os.listdir(fulldirname))
+            entries = self._scandir(dirannex, cache, newcache, maxsize)
+            files.extend((dirannex, filename, entry) for
+                         filename, entry in entries.items())
+        if newcache != cache:
+            self._savescancache(newcache)
 
         date_excludees = {}
-        for dirannex, filename in files:
-            if filename.startswith('.'):
-                continue # Ignore dot files.
+        for dirannex, filename, (uid, flags, size) in files:
             # We store just dirannex and filename, ie 'cur/123...'
             filepath = os.path.join(dirannex, filename)
             # Check maxsize if this message should be considered.
-            if maxsize and (os.path.getsize(
-                    os.path.join(self.getfullname(), filepath)) > maxsize):
+            if maxsize and size > maxsize:
                 continue
 
-            prefix, uid, fmd5, flags = self._parse_filename(filename)
             if uid is None: # Assign negative uid to upload it.
                 uid = nouidcounter
                 nouidcounter -= 1
-            else:                       # It comes from our folder.
-                uidmatch = re_uidmatch.search(filename)
-                uid = None
-                if not uidmatch:
-                    uid = nouidcounter
-                    nouidcounter -= 1
-                else:
-                    uid = int(uidmatch.group(1))
+            # Copy the cached flags, they get modified with the messagelist.
+            flags = set(flags)
             if min_uid != None and uid > 0 and uid < min_uid:
                 continue
             if min_date != None and not self._iswithintime(filename, min_date):
@@ -239,7 +339,14 @@ class MaildirFolder(BaseFolder):
     def quickchanged(self, statusfolder):
         """Returns True if the Maildir has changed
 
-        Assumes cachemessagelist() has already been called """
+        If the repository watches its folders and nothing happened in this
+        one since it was last scanned, returns False right away. Otherwise
+        the folder is compared with the statusfolder."""
+
+        if self._watcher is not None and \
+                not self._watcher.haschanged(self.getfullname()):
+            return False
+        self.cachemessagelist()
         # Folder has different uids than statusfolder => TRUE.
         if sorted(self.getmessageuidlist()) != \
                 sorted(statusfolder.getmessageuidlist()):
@@ -259,10 +366,65 @@ class MaildirFolder(BaseFolder):
     def cachemessagelist(self, min_date=None, min_uid=None):
         if self.ismessagelistempty():
             self.ui.loadmessagelist(self.repository, self)
+            self._startscan()
             self.messagelist = self._scanfolder(min_date=min_date,
                 min_uid=min_uid)
             self.ui.messagelistloaded(self.repository, self, self.getmessagecount())
 
+    # Interface from BaseFolder
+    def marksynced(self):
+        if self._watcher is None or self.repository.account.dryrun:
+            return
+        self._watcher.synced(self.getfullname())
+
+    def _startscan(self):
+        """To be called before scanning the folder to load the messagelist."""
+
+        self._uidfiles = None
+        if self._watcher is not None:
+            self._watcher.scanning(self.getfullname())
+
+    # Interface from BaseFolder
+    def dropmessagelistcache(self):
+        super(MaildirFolder, self).dropmessagelistcache()
+        self._uidfiles = None
+
+    def _locatemessage(self, uid):
+        """Returns the current filename of message uid, or None if it is gone.
+
+        Used when the file recorded in the messagelist is missing, e.g.
+        because a mail client renamed it to change its flags. The folder is
+        rescanned at most once per messagelist: all the lookups share the
+        resulting UID-to-filename index, which our own renames keep
+        up-to-date."""
+
+        if self._uidfiles is None:
+            self._uidfiles = dict((u, msg['filename'])
+                for u, msg in self._scanfolder().items() if u > 0)
+        return self._uidfiles.get(uid)
+
+    def _renamemessagefile(self, uid, oldfilename, newfilename, new_uid=None):
+        """Renames the file of message uid, looking for it if it is missing.
+
+        :param new_uid: the new UID of the message, if it changes."""
+
+        fullname = self.getfullname()
+        try:
+            os.rename(os.path.join(fullname, oldfilename),
+                      os.path.join(fullname, newfilename))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            oldfilename = self._locatemessage(uid)
+            if oldfilename is None:
+                raise
+            if oldfilename != newfilename:
+                os.rename(os.path.join(fullname, oldfilename),
+                          os.path.join(fullname, newfilename))
+        if self._uidfiles is not None:
+            self._uidfiles.pop(uid, None)
+            self._uidfiles[uid if new_uid is None else new_uid] = newfilename
+
     # Interface from BaseFolder
     def getmessage(self, uid):
         """Return the content of the message."""
@@ -274,7 +436,10 @@ class MaildirFolder(BaseFolder):
         file.close()
         #TODO: WHY are we replacing \r\n with \n here? And why do we
         #      read it as text?
-        return retval.replace("\r\n", "\n")
+        if "\r\n" in retval:
+            # Don't copy the whole message if there is nothing to replace.
+            retval = retval.replace("\r\n", "\n")
+        return retval
 
     # Interface from BaseFolder
     def getmessagetime(self, uid):
@@ -300,6 +465,9 @@ class MaildirFolder(BaseFolder):
         """Saves given content to the named temporary file in the
         'tmp' subdirectory of $CWD.
 
+        The content is written out chunk by chunk with '\n' line endings,
+        so that big messages are not copied as a whole.
+
         Arguments:
         - filename: name of the temporary file;
         - content: data to be saved.
@@ -334,7 +502,8 @@ class MaildirFolder(BaseFolder):
                     raise
 
         fd = os.fdopen(fd, 'wt')
-        fd.write(content)
+        for chunk in emailutil.MessageChunks(content, '\n'):
+            fd.write(chunk)
         # Make sure the data hits the disk.
         fd.flush()
         if self.dofsync():
@@ -450,8 +619,7 @@ class MaildirFolder(BaseFolder):
         newfilename = os.path.join(dir_prefix, filename)
         if (newfilename != oldfilename):
             try:
-                os.rename(os.path.join(self.getfullname(), oldfilename),
-                          os.path.join(self.getfullname(), newfilename))
+                self._renamemessagefile(uid, oldfilename, newfilename)
             except OSError as e:
                 six.reraise(OfflineImapError,
                             OfflineImapError(
@@ -485,8 +653,7 @@ class MaildirFolder(BaseFolder):
         # filename_use_mail_timestamp configuration option.
         newfilename = os.path.join(dir_prefix,
           self.new_message_filename(new_uid, flags))
-        os.rename(os.path.join(self.getfullname(), oldfilename),
-                  os.path.join(self.getfullname(), newfilename))
+        self._renamemessagefile(uid, oldfilename, newfilename, new_uid)
         self.messagelist[new_uid] = self.messagelist[uid]
         self.messagelist[new_uid]['filename'] = newfilename
         del self.messagelist[uid]
@@ -506,12 +673,13 @@ class MaildirFolder(BaseFolder):
             os.unlink(filepath)
         except OSError:
             # Can't find the file -- maybe already deleted?
-            newmsglist = self._scanfolder()
-            if uid in newmsglist:       # Nope, try new filename.
-                filename = newmsglist[uid]['filename']
+            filename = self._locatemessage(uid)
+            if filename is not None:    # Nope, try new filename.
                 filepath = os.path.join(self.getfullname(), filename)
                 os.unlink(filepath)
             # Yep -- return.
+        if self._uidfiles is not None:
+            self._uidfiles.pop(uid, None)
         del(self.messagelist[uid])
 
     def migratefmd5(self, dryrun=False):
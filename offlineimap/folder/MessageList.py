@@ -0,0 +1,438 @@
+# Compact message list
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+from array import array
+from bisect import bisect_left
+import copy
+import string
+
+import six
+
+
+# Maildir flags and custom flags, one bit each.
+FLAGCHARS = 'DFPRST' + string.ascii_lowercase
+FLAGBITS = dict((c, 1 << i) for i, c in enumerate(FLAGCHARS))
+_flagchars = {0: ()} # Bitmask -> flag characters, filled on demand.
+
+# Python 2 has no 'q' typecode, 'l' is 64 bits there on LP64 systems.
+try:
+    INTCODE = array('q').typecode
+except ValueError:
+    INTCODE = 'l'
+
+# Keys stored in integer arrays, and the values of the arrays for missing
+# keys, None and values stored in _extras instead.
+INTKEYS = ('time', 'mtime', 'size')
+INT_MAX = 2**(8 * array(INTCODE).itemsize - 1) - 1
+INT_MISSING = -INT_MAX - 1
+INT_NONE = INT_MISSING + 1
+INT_EXTRA = INT_MISSING + 2
+
+# Marker of an initializer key missing from an item.
+_MISSING = object()
+
+
+def flags2mask(flags):
+    """Returns the bitmask of a set of flags, None if some flag can't be
+    represented."""
+
+    mask = 0
+    try:
+        for flag in flags:
+            mask |= FLAGBITS[flag]
+    except KeyError:
+        return None
+    return mask
+
+
+def mask2flags(mask):
+    """Returns a new set of the flags of a bitmask."""
+
+    try:
+        return set(_flagchars[mask])
+    except KeyError:
+        chars = tuple(c for c in FLAGCHARS if mask & FLAGBITS[c])
+        _flagchars[mask] = chars
+        return set(chars)
+
+
+class CompactMessageList(object):
+    """Dict-like messagelist storing the messages in arrays.
+
+    UIDs are kept sorted in an array, flags as bitmasks and the 'time',
+    'mtime' and 'size' values as 64 bits integers. Other keys are stored per
+    key and only when they differ from the msglist_item_initializer() values
+    given as defaults. This takes a few tens of bytes per message instead of
+    hundreds for a dict of dicts.
+
+    self[uid] returns a view of the message: the usual
+    messagelist[uid][key] = value idiom works, but values must not be
+    modified in place after being stored (except mutable defaults like
+    'labels', which are copied on access). Messages inserted out of order
+    and deleted messages are merged into the arrays in bulk.
+
+    The sorted arrays also give fast membership tests and set operations
+    on UIDs, see intersection() and difference()."""
+
+    def __init__(self, defaults=None):
+        self._defaults = {}
+        for key, value in (defaults or {}).items():
+            if key not in ('uid', 'flags') + INTKEYS:
+                self._defaults[key] = value
+        self._uids = array(INTCODE)
+        self._flags = array('L')
+        self._ints = dict((key, array(INTCODE)) for key in INTKEYS)
+        self._extras = {}    # Key -> {uid: value}.
+        self._pending = {}   # UID -> item inserted out of order.
+        self._deleted = set()
+        self._copied = False # Some mutable default was copied to _extras.
+
+    def _index(self, uid):
+        """Returns the index of uid in the arrays or -1."""
+
+        i = bisect_left(self._uids, uid)
+        if i < len(self._uids) and self._uids[i] == uid and \
+                uid not in self._deleted:
+            return i
+        return -1
+
+    def _merge(self):
+        """Merges the pending and deleted messages into the arrays."""
+
+        if self._copied:
+            self._prune()
+        if not self._pending and not self._deleted:
+            return
+        rows = [(uid, self._flags[i]) +
+                tuple(self._ints[key][i] for key in INTKEYS)
+                for i, uid in enumerate(self._uids)
+                if uid not in self._deleted]
+        for uid in self._deleted:
+            for values in self._extras.values():
+                values.pop(uid, None)
+        self._deleted = set()
+        pending, self._pending = self._pending, {}
+        for uid, item in pending.items():
+            rows.append((uid,) + self._encode(uid, item))
+        rows.sort()
+        self._uids = array(INTCODE, [row[0] for row in rows])
+        self._flags = array('L', [row[1] for row in rows])
+        for n, key in enumerate(INTKEYS):
+            self._ints[key] = array(INTCODE, [row[n + 2] for row in rows])
+
+    def _maybemerge(self):
+        if len(self._pending) + len(self._deleted) > \
+                1024 + len(self._uids) // 4:
+            self._merge()
+
+    def _prune(self):
+        """Drops the copies of mutable defaults which were not modified."""
+
+        self._copied = False
+        for key, default in self._defaults.items():
+            values = self._extras.get(key, {})
+            for uid in [uid for uid, value in values.items()
+                        if value == default]:
+                del values[uid]
+
+    def _encode(self, uid, item):
+        """Stores the extra keys of item and returns its array values."""
+
+        mask = flags2mask(item.get('flags', ()))
+        for key in self._defaults:
+            if key not in item:
+                self._extras.setdefault(key, {})[uid] = _MISSING
+        for key, value in item.items():
+            if key in ('uid',) + INTKEYS:
+                continue
+            if key == 'flags':
+                if mask is not None:
+                    self._extras.get('flags', {}).pop(uid, None)
+                    continue
+            elif key in self._defaults and value == self._defaults[key]:
+                self._extras.get(key, {}).pop(uid, None)
+                continue
+            self._extras.setdefault(key, {})[uid] = value
+        return (mask or 0,) + tuple(self._encodeint(uid, key,
+            item.get(key, _MISSING)) for key in INTKEYS)
+
+    def _encodeint(self, uid, key, value):
+        """Returns the array value of key, storing in _extras the values
+        which don't fit in the arrays."""
+
+        if value is _MISSING:
+            return INT_MISSING
+        if value is None:
+            return INT_NONE
+        if isinstance(value, six.integer_types) and \
+                not isinstance(value, bool) and \
+                INT_EXTRA < value <= INT_MAX:
+            return value
+        self._extras.setdefault(key, {})[uid] = value
+        return INT_EXTRA
+
+    def _getvalue(self, uid, key):
+        """Returns the value of key for a message stored in the arrays."""
+
+        if key == 'uid':
+            return uid
+        if key == 'flags' or key in INTKEYS:
+            if uid in self._extras.get(key, {}):
+                return self._extras[key][uid]
+            i = self._index(uid)
+            if i < 0:
+                raise KeyError(uid)
+            if key == 'flags':
+                return mask2flags(self._flags[i])
+            value = self._ints[key][i]
+            if value == INT_MISSING:
+                raise KeyError(key)
+            return None if value == INT_NONE else value
+        values = self._extras.get(key, {})
+        if uid in values:
+            value = values[uid]
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if key not in self._defaults:
+            raise KeyError(key)
+        value = self._defaults[key]
+        if isinstance(value, (set, list, dict)):
+            # Could be modified in place by the caller, dropped by _prune()
+            # if it was not.
+            value = copy.copy(value)
+            self._extras.setdefault(key, {})[uid] = value
+            self._copied = True
+        return value
+
+    def _setvalue(self, uid, key, value):
+        """Sets the value of key for a message stored in the arrays."""
+
+        if key == 'uid':
+            return
+        i = self._index(uid)
+        if i < 0:
+            raise KeyError(uid)
+        if key == 'flags':
+            mask = flags2mask(value)
+            if mask is None:
+                self._extras.setdefault('flags', {})[uid] = value
+            else:
+                self._extras.get('flags', {}).pop(uid, None)
+                self._flags[i] = mask
+        elif key in INTKEYS:
+            self._extras.get(key, {}).pop(uid, None)
+            self._ints[key][i] = self._encodeint(uid, key, value)
+        else:
+            self._extras.setdefault(key, {})[uid] = value
+
+    def _keys(self, uid):
+        i = self._index(uid)
+        if i < 0:
+            raise KeyError(uid)
+        keys = ['uid', 'flags']
+        for key in INTKEYS:
+            if self._ints[key][i] != INT_MISSING:
+                keys.append(key)
+        for key, values in self._extras.items():
+            if key not in keys and uid in values and \
+                    values[uid] is not _MISSING:
+                keys.append(key)
+        for key in self._defaults:
+            if key not in keys and uid not in self._extras.get(key, {}):
+                keys.append(key)
+        return keys
+
+    def __contains__(self, uid):
+        return uid in self._pending or self._index(uid) >= 0
+
+    def __getitem__(self, uid):
+        try:
+            return self._pending[uid]
+        except KeyError:
+            if self._index(uid) < 0:
+                raise
+            return CompactMessageItem(self, uid)
+
+    def get(self, uid, default=None):
+        try:
+            return self[uid]
+        except KeyError:
+            return default
+
+    def __setitem__(self, uid, item):
+        if isinstance(item, CompactMessageItem):
+            item = dict(item.items())
+        if self._index(uid) >= 0:
+            # Replace the message in place.
+            for values in self._extras.values():
+                values.pop(uid, None)
+            i = self._index(uid)
+            values = self._encode(uid, item)
+            self._flags[i] = values[0]
+            for n, key in enumerate(INTKEYS):
+                self._ints[key][i] = values[n + 1]
+        elif uid in self._deleted or \
+                (len(self._uids) and uid <= self._uids[-1]):
+            self._pending[uid] = item
+            self._maybemerge()
+        elif uid in self._pending:
+            self._pending[uid] = item
+        else:
+            # Appending in UID order is the common case.
+            values = self._encode(uid, item)
+            self._uids.append(uid)
+            self._flags.append(values[0])
+            for n, key in enumerate(INTKEYS):
+                self._ints[key].append(values[n + 1])
+
+    def __delitem__(self, uid):
+        if uid in self._pending:
+            del self._pending[uid]
+        elif self._index(uid) >= 0:
+            self._deleted.add(uid)
+            self._maybemerge()
+        else:
+            raise KeyError(uid)
+
+    def pop(self, uid, *default):
+        try:
+            item = self[uid]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        if isinstance(item, CompactMessageItem):
+            item = dict(item.items())
+        del self[uid]
+        return item
+
+    def update(self, other):
+        for uid, item in other.items():
+            self[uid] = item
+
+    def __len__(self):
+        return len(self._uids) - len(self._deleted) + len(self._pending)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Returns the sorted list of UIDs."""
+
+        self._merge()
+        return self._uids.tolist()
+
+    def items(self):
+        return [(uid, self[uid]) for uid in self.keys()]
+
+    def values(self):
+        return [self[uid] for uid in self.keys()]
+
+    def uids(self):
+        """Returns the sorted UIDs as an array."""
+
+        self._merge()
+        return array(INTCODE, self._uids)
+
+    def intersection(self, other):
+        """Returns the sorted list of the UIDs also in other, which is
+        either a CompactMessageList or an iterable of UIDs."""
+
+        if not isinstance(other, CompactMessageList):
+            return [uid for uid in sorted(set(other)) if uid in self]
+        return self._walk(other, True)
+
+    def difference(self, other):
+        """Returns the sorted list of the UIDs not in other, which is
+        either a CompactMessageList or an iterable of UIDs."""
+
+        if not isinstance(other, CompactMessageList):
+            other = set(other)
+            return [uid for uid in self.keys() if uid not in other]
+        return self._walk(other, False)
+
+    def _walk(self, other, common):
+        """Walks both sorted arrays at once, returning the UIDs of self
+        which are (if common) or are not in other."""
+
+        self._merge()
+        other._merge()
+        mine, theirs = self._uids, other._uids
+        result = []
+        j, n = 0, len(theirs)
+        for uid in mine:
+            while j < n and theirs[j] < uid:
+                j += 1
+            if (j < n and theirs[j] == uid) == common:
+                result.append(uid)
+        return result
+
+
+class CompactMessageItem(object):
+    """Dict-like view of a message of a CompactMessageList."""
+
+    __hash__ = None
+
+    def __init__(self, messagelist, uid):
+        self._list = messagelist
+        self._uid = uid
+
+    def __getitem__(self, key):
+        return self._list._getvalue(self._uid, key)
+
+    def __setitem__(self, key, value):
+        uid = self._uid
+        if uid in self._list._pending:
+            # Merged meanwhile into the pending messages.
+            self._list._pending[uid][key] = value
+        else:
+            self._list._setvalue(uid, key, value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._list._keys(self._uid)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -38,12 +38,22 @@ class MappedIMAPFolder(IMAPFolder):
       l2r: dict mapping message uids: self.r2l[localuid]=remoteuid
       #TODO: what is the difference, how are they used?
       diskr2l: dict mapping message uids: self.r2l[remoteuid]=localuid
-      diskl2r: dict mapping message uids: self.r2l[localuid]=remoteuid"""
+      diskl2r: dict mapping message uids: self.r2l[localuid]=remoteuid
+
+    The mapping file has one 'localuid:remoteuid' line per message. With
+    the 'log' uidmapformat, changes are appended to the file as
+    'localuid:remoteuid' or '-localuid' lines instead of rewriting it. The
+    file is compacted once the log outgrows the mapping."""
+
+    # Appended lines allowed before compacting, on top of the mapping size.
+    maplogslack = 1000
 
     def __init__(self, imapserver, name, repository, decode=True):
         IMAPFolder.__init__(self, imapserver, name, repository, decode=False)
         self.dryrun = self.config.getdefaultboolean("general", "dry-run", True)
         self.maplock = Lock()
+        self._maplog = repository.getuidmapformat() == 'log'
+        self._maplogsize = 0 # Lines in the mapping file.
         self.diskr2l, self.diskl2r = self._loadmaps()
         self.r2l, self.l2r = None, None
         # Representing the local IMAP Folder using local UIDs.
@@ -74,29 +84,61 @@ class MappedIMAPFolder(IMAPFolder):
             file = open(mapfilename, 'rt')
             r2l = {}
             l2r = {}
+            self._maplogsize = 0
             while True:
                 line = file.readline()
                 if not len(line):
                     break
+                self._maplogsize += 1
+                if not line.endswith('\n'):
+                    # Appending to this line would corrupt it: have the next
+                    # save rewrite the file.
+                    self._maplogsize = float('inf')
                 try:
-                    line = line.strip()
+                    if line.startswith('-'):
+                        # Deleted mapping, from the log format.
+                        loc = int(line[1:])
+                        rem = None
+                    else:
+                        (str1, str2) = line.strip().split(':')
+                        loc = int(str1)
+                        rem = int(str2)
                 except ValueError:
+                    if self._maplog and not line.endswith('\n'):
+                        # Interrupted append, the change was not recorded.
+                        self.ui.warn("Ignoring truncated last line '%s' in "
+                            "UID mapping file '%s'"% (line, mapfilename))
+                        break
                     six.reraise(Exception,
                             Exception(
                                 "Corrupt line '%s' in UID mapping file '%s'"%
                                 (line, mapfilename)),
                             exc_info()[2])
-                (str1, str2) = line.split(':')
-                loc = int(str1)
-                rem = int(str2)
-                r2l[rem] = loc
-                l2r[loc] = rem
+                if loc in l2r:
+                    r2l.pop(l2r.pop(loc), None)
+                if rem is not None:
+                    r2l[rem] = loc
+                    l2r[loc] = rem
+            file.close()
             return (r2l, l2r)
 
-    def _savemaps(self):
+    def _savemaps(self, changes=None):
+        """Write the mapping to disk.
+
+        :param changes: list of the (localuid, remoteuid) mappings changed
+            since the last save, remoteuid being None for deleted mappings.
+            With the 'log' uidmapformat, only these are appended to the
+            file. None to rewrite the whole file."""
+
         if self.dryrun is True:
             return
 
+        if self._maplog and changes is not None and \
+                self._maplogsize + len(changes) <= \
+                2 * len(self.diskl2r) + self.maplogslack:
+            self._appendmaps(changes)
+            return
+
         mapfilename = self._getmapfilename()
         # Do not use the map file directly to prevent from leaving it truncated.
         mapfilenametmp = "%s.tmp"% mapfilename
@@ -116,6 +158,28 @@ class MappedIMAPFolder(IMAPFolder):
                     fsync(mapfilefd)
             # The lock is released when the file descriptor ends.
             shutil.move(mapfilenametmp, mapfilename)
+            self._maplogsize = len(self.diskl2r)
+
+    def _appendmaps(self, changes):
+        """Append changes to the mapping file, see _savemaps()."""
+
+        mapfilename = self._getmapfilename()
+        mapfilenamelock = "%s.lock"% mapfilename
+        with open(mapfilenamelock, 'w') as mapfilelock:
+            try:
+                fnctl.lockf(mapfilelock, fnctl.LOCK_EX) # Blocks until acquired.
+            except NameError:
+                pass # Windows...
+            with open(mapfilename, 'at') as mapfilefd:
+                for (luid, ruid) in changes:
+                    if ruid is None:
+                        mapfilefd.write("-%d\n"% luid)
+                    else:
+                        mapfilefd.write("%d:%d\n"% (luid, ruid))
+                if self.dofsync():
+                    mapfilefd.flush()
+                    fsync(mapfilefd)
+            self._maplogsize += len(changes)
 
     def _uidlist(self, mapping, items):
         try:
@@ -194,6 +258,10 @@ class MappedIMAPFolder(IMAPFolder):
         # much more efficient for the mapped case.
         return self.r2l.keys()
 
+    # Interface from BaseFolder
+    def getmessageuidset(self):
+        return self.getmessageuidlist()
+
     # Interface from BaseFolder
     def getmessagecount(self):
         """Gets the number of messages in this folder.
@@ -233,6 +301,11 @@ class MappedIMAPFolder(IMAPFolder):
         """Returns the content of the specified message."""
         return self._mb.getmessage(self.r2l[uid])
 
+    # Interface from BaseFolder
+    def getsavebatchlimits(self):
+        # Messages must be saved one by one through the UID mapping.
+        return (1, 0)
+
     # Interface from BaseFolder
     def savemessage(self, uid, content, flags, rtime):
         """Writes a new message, with the specified uid.
@@ -278,7 +351,7 @@ class MappedIMAPFolder(IMAPFolder):
             self.diskr2l[uid] = newluid
             self.l2r[newluid] = uid
             self.r2l[uid] = newluid
-            self._savemaps()
+            self._savemaps([(newluid, uid)])
         return uid
 
     # Interface from BaseFolder
@@ -306,6 +379,14 @@ class MappedIMAPFolder(IMAPFolder):
         self._mb.addmessagesflags(self._uidlist(self.r2l, uidlist),
                                   flags)
 
+    # Interface from BaseFolder
+    def changemessagesflags(self, addflaglist, delflaglist):
+        self._mb.changemessagesflags(
+            dict((flag, self._uidlist(self.r2l, uids))
+                 for flag, uids in addflaglist.items()),
+            dict((flag, self._uidlist(self.r2l, uids))
+                 for flag, uids in delflaglist.items()))
+
     # Interface from BaseFolder
     def change_message_uid(self, ruid, new_ruid):
         """Change the message from existing ruid to new_ruid
@@ -328,11 +409,11 @@ class MappedIMAPFolder(IMAPFolder):
             if luid > 0: self.diskl2r[luid] = new_ruid
             if ruid > 0: del self.diskr2l[ruid]
             if new_ruid > 0: self.diskr2l[new_ruid] = luid
-            self._savemaps()
+            self._savemaps([(luid, new_ruid)] if luid > 0 else [])
 
     def _mapped_delete(self, uidlist):
         with self.maplock:
-            needssave = 0
+            changes = []
             for ruid in uidlist:
                 luid = self.r2l[ruid]
                 del self.r2l[ruid]
@@ -340,9 +421,9 @@ class MappedIMAPFolder(IMAPFolder):
                 if ruid > 0:
                     del self.diskr2l[ruid]
                     del self.diskl2r[luid]
-                    needssave = 1
-            if needssave:
-                self._savemaps()
+                    changes.append((luid, None))
+            if changes:
+                self._savemaps(changes)
 
     # Interface from BaseFolder
     def deletemessageflags(self, uid, flags):
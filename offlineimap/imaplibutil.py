@@ -34,7 +34,9 @@ from offlineimap.virtual_imaplib2 import IMAP4, IMAP4_SSL, InternalDate, Mon2num
 
 
 class UsefulIMAPMixIn(object):
-    def __getselectedfolder(self):
+    def getselectedfolder(self):
+        """Returns the mailbox selected on this connection, or None."""
+
         if self.state == 'SELECTED':
             return self.mailbox
         return None
@@ -42,11 +44,14 @@ class UsefulIMAPMixIn(object):
     def select(self, mailbox='INBOX', readonly=False, force=False):
         """Selects a mailbox on the IMAP server
 
+        A mailbox already selected read-write is kept as is when read-only
+        access is requested, since it allows reading as well.
+
         :returns: 'OK' on success, nothing if the folder was already
         selected or raises an :exc:`OfflineImapError`."""
 
-        if self.__getselectedfolder() == mailbox and \
-            self.is_readonly == readonly and \
+        if self.getselectedfolder() == mailbox and \
+            (self.is_readonly == readonly or readonly) and \
             not force:
             # No change; return.
             return
@@ -126,6 +131,12 @@ class IMAP4_Tunnel(UsefulIMAPMixIn, IMAP4):
         if "use_socket" in kwargs:
             self.socket = kwargs['use_socket']
             del kwargs['use_socket']
+        if "literal_reader" in kwargs:
+            self.literal_reader = kwargs['literal_reader']
+            del kwargs['literal_reader']
+        if "shared_io" in kwargs:
+            self.shared_io = kwargs['shared_io']
+            del kwargs['shared_io']
         IMAP4.__init__(self, tunnelcmd, **kwargs)
 
     def open(self, host, port):
@@ -156,6 +167,9 @@ class IMAP4_Tunnel(UsefulIMAPMixIn, IMAP4):
         if self.decompressor is None:
             return os.read(self.read_fd, size)
 
+        if hasattr(self, 'compression_stats'): # Bundled imaplib2.
+            return self._decompress(lambda n: os.read(self.read_fd, n), size)
+
         if self.decompressor.unconsumed_tail:
             data = self.decompressor.unconsumed_tail
         else:
@@ -165,8 +179,11 @@ class IMAP4_Tunnel(UsefulIMAPMixIn, IMAP4):
 
     def send(self, data):
         if self.compressor is not None:
-            data = self.compressor.compress(data)
-            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            if hasattr(self, 'compression_stats'): # Bundled imaplib2.
+                data = self._compress(data)
+            else:
+                data = self.compressor.compress(data)
+                data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
         self.outfd.write(data)
 
     def shutdown(self):
@@ -194,6 +211,12 @@ class WrappedIMAP4_SSL(UsefulIMAPMixIn, IMAP4_SSL):
         if "use_socket" in kwargs:
             self.socket = kwargs['use_socket']
             del kwargs['use_socket']
+        if "literal_reader" in kwargs:
+            self.literal_reader = kwargs['literal_reader']
+            del kwargs['literal_reader']
+        if "shared_io" in kwargs:
+            self.shared_io = kwargs['shared_io']
+            del kwargs['shared_io']
         self._fingerprint = kwargs.get('fingerprint', None)
         if type(self._fingerprint) != type([]):
             self._fingerprint = [self._fingerprint]
@@ -234,6 +257,12 @@ class WrappedIMAP4(UsefulIMAPMixIn, IMAP4):
         if "use_socket" in kwargs:
             self.socket = kwargs['use_socket']
             del kwargs['use_socket']
+        if "literal_reader" in kwargs:
+            self.literal_reader = kwargs['literal_reader']
+            del kwargs['literal_reader']
+        if "shared_io" in kwargs:
+            self.shared_io = kwargs['shared_io']
+            del kwargs['shared_io']
         IMAP4.__init__(self, *args, **kwargs)
 
 
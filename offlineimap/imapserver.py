@@ -27,6 +27,10 @@ from socket import gaierror
 from sys import exc_info
 from ssl import SSLError, cert_time_to_seconds
 from threading import Lock, BoundedSemaphore, Thread, Event, currentThread
+try:
+    from Queue import Queue, Empty
+except ImportError: # python3
+    from queue import Queue, Empty
 
 import six
 
@@ -120,8 +124,19 @@ class IMAPServer(object):
         self.availableconnections = []
         self.assignedconnections = []
         self.lastowner = {}
+        self.lastused = {}
+        self.poolmode = repos.getpoolmode()
+        self.literalreader = repos.getliteralreader()
+        self.sharedio = repos.getioengine() == 'shared'
+        self.compresslevel = repos.getcompressionlevel()
+        self.compresswbits = repos.getcompressionwindow()
+        # Compression byte counters of the connections closed since the
+        # last resetpoolstats().
+        self.closedcompression = {}
         self.semaphore = BoundedSemaphore(self.maxconnections)
         self.connectionlock = Lock()
+        self.poolstats = None
+        self.resetpoolstats()
         self.reference = repos.getreference()
         self.idlefolders = repos.getidlefolders()
         self.gss_vc = None
@@ -503,30 +518,58 @@ class IMAPServer(object):
 
         return ('%s no matching domain name found in certificate'% errstr)
 
-    def acquireconnection(self):
+    def acquireconnection(self, mailbox=None):
         """Fetches a connection from the pool, making sure to create a new one
         if needed, to obey the maximum connection limits, etc.
         Opens a connection to the server and returns an appropriate
-        object."""
-
-        self.semaphore.acquire()
+        object.
+
+        :param mailbox: the IMAP name of the folder the connection is wanted
+           for. A connection which has this mailbox selected already is
+           preferred so that we do not have to SELECT it again.  Otherwise,
+           the 'poolmode' of the repository decides: 'thread' prefers the
+           connection previously used by this thread, 'folder' the least
+           recently used one."""
+
+        if not self.semaphore.acquire(False):
+            # All the connections are busy, account the time we wait.
+            waitstart = time.time()
+            self.semaphore.acquire()
+            with self.connectionlock:
+                self.poolstats['waits'] += 1
+                self.poolstats['waittime'] += time.time() - waitstart
         self.connectionlock.acquire()
         curThread = currentThread()
         imapobj = None
 
         if len(self.availableconnections): # One is available.
-            # Try to find one that previously belonged to this thread
-            # as an optimization.  Start from the back since that's where
-            # they're popped on.
+            # Try to find one that has the mailbox selected or, else, that
+            # previously belonged to this thread as an optimization.  Start
+            # from the back since that's where they're popped on.
+            index = None
             for i in range(len(self.availableconnections) - 1, -1, -1):
                 tryobj = self.availableconnections[i]
-                if self.lastowner[tryobj] == curThread.ident:
-                    imapobj = tryobj
-                    del(self.availableconnections[i])
+                if mailbox is not None and \
+                        tryobj.getselectedfolder() == mailbox:
+                    index = i
                     break
-            if not imapobj:
-                imapobj = self.availableconnections[0]
-                del(self.availableconnections[0])
+                if self.poolmode == 'folder':
+                    if index is None or self.lastused[tryobj] < \
+                            self.lastused[self.availableconnections[index]]:
+                        index = i
+                elif index is None and \
+                        self.lastowner[tryobj] == curThread.ident:
+                    index = i
+                    if mailbox is None:
+                        break
+            if index is None:
+                index = 0
+            imapobj = self.availableconnections.pop(index)
+            if mailbox is not None:
+                if imapobj.getselectedfolder() == mailbox:
+                    self.poolstats['hits'] += 1
+                else:
+                    self.poolstats['misses'] += 1
             self.assignedconnections.append(imapobj)
             self.lastowner[imapobj] = curThread.ident
             self.connectionlock.release()
@@ -547,6 +590,8 @@ class IMAPServer(object):
                         self.tunnel,
                         timeout=socket.getdefaulttimeout(),
                         use_socket=self.proxied_socket,
+                        literal_reader=self.literalreader,
+                        shared_io=self.sharedio,
                         )
                     success = True
                 elif self.usessl:
@@ -567,6 +612,8 @@ class IMAPServer(object):
                         use_socket=self.proxied_socket,
                         tls_level=self.tlslevel,
                         af=self.af,
+                        literal_reader=self.literalreader,
+                        shared_io=self.sharedio,
                         )
                 else:
                     self.ui.connecting(
@@ -576,6 +623,8 @@ class IMAPServer(object):
                         timeout=socket.getdefaulttimeout(),
                         use_socket=self.proxied_socket,
                         af=self.af,
+                        literal_reader=self.literalreader,
+                        shared_io=self.sharedio,
                         )
 
                 if not self.preauth_tunnel:
@@ -589,6 +638,8 @@ class IMAPServer(object):
 
             # Enable compression
             if self.repos.getconfboolean('usecompression', 0):
+                imapobj.compress_level = self.compresslevel
+                imapobj.compress_wbits = self.compresswbits
                 imapobj.enable_compression()
 
             # update capabilities after login, e.g. gmail serves different ones
@@ -596,6 +647,22 @@ class IMAPServer(object):
             if dat != [None]:
                 imapobj.capabilities = tuple(dat[-1].upper().split())
 
+            # QRESYNC must be enabled before any SELECT so that the server
+            # reports VANISHED UIDs in CHANGEDSINCE fetches.
+            if self.repos.getcondstore() and \
+                    'QRESYNC' in imapobj.capabilities and \
+                    'ENABLE' in imapobj.capabilities:
+                try:
+                    typ, dat = imapobj.enable('QRESYNC')
+                finally:
+                    # imaplib2's enable() does not release the state change
+                    # lock taken by this synchronous command.
+                    imapobj._release_state_change()
+                imapobj.qresync_enabled = (typ == 'OK')
+                if typ != 'OK':
+                    self.ui.debug('imap', "ENABLE QRESYNC failed: %s %s"%
+                        (typ, dat))
+
             if self.delim == None:
                 listres = imapobj.list(self.reference, '""')[1]
                 if listres == [None] or listres == None:
@@ -618,6 +685,7 @@ class IMAPServer(object):
             with self.connectionlock:
                 self.assignedconnections.append(imapobj)
                 self.lastowner[imapobj] = curThread.ident
+                self.poolstats['new'] += 1
             return imapobj
         except Exception as e:
             """If we are here then we did not succeed in getting a
@@ -701,10 +769,12 @@ class IMAPServer(object):
             # deadlock! Audit & check!
             threadutil.semaphorereset(self.semaphore, self.maxconnections)
             for imapobj in self.assignedconnections + self.availableconnections:
+                self.__addcompressionstats(self.closedcompression, imapobj)
                 imapobj.logout()
             self.assignedconnections = []
             self.availableconnections = []
             self.lastowner = {}
+            self.lastused = {}
             # reset GSSAPI state
             self.gss_vc = None
             self.gssapi = False
@@ -763,12 +833,70 @@ class IMAPServer(object):
         self.assignedconnections.remove(connection)
         # Don't reuse broken connections
         if connection.Terminate or drop_conn:
+            self.__addcompressionstats(self.closedcompression, connection)
             connection.logout()
         else:
             self.availableconnections.append(connection)
+            self.lastused[connection] = time.time()
         self.connectionlock.release()
         self.semaphore.release()
 
+    def resetpoolstats(self):
+        """Reset the connection pool statistics."""
+
+        self.poolstats = {
+            'hits': 0,      # Got a connection with the mailbox selected.
+            'misses': 0,    # Got an available connection for another one.
+            'new': 0,       # Opened a new connection.
+            'waits': 0,     # Had to wait for a connection to be released.
+            'waittime': 0.0,
+        }
+        with self.connectionlock:
+            self.closedcompression = {}
+            for imapobj in self.assignedconnections + self.availableconnections:
+                stats = getattr(imapobj, 'compression_stats', None)
+                for key in stats or ():
+                    stats[key] = 0
+
+    def __addcompressionstats(self, total, imapobj):
+        # Only the bundled imaplib2 counts the bytes.
+        stats = getattr(imapobj, 'compression_stats', None)
+        for key, value in (stats or {}).items():
+            total[key] = total.get(key, 0) + value
+
+    def getpoolstats(self):
+        """Returns a copy of the connection pool statistics.
+
+        With usecompression, the 'compression' key holds the raw and
+        compressed byte counts received and sent, if available."""
+
+        with self.connectionlock:
+            stats = dict(self.poolstats)
+            compression = dict(self.closedcompression)
+            for imapobj in self.assignedconnections + self.availableconnections:
+                self.__addcompressionstats(compression, imapobj)
+            if compression.get('compressed_in') or \
+                    compression.get('compressed_out'):
+                stats['compression'] = compression
+            return stats
+
+
+def _syncfolder(imapserver, foldername):
+    """Sync the remote folder foldername of the imapserver account."""
+
+    account = imapserver.repos.account
+    remotefolder = account.remoterepos.getfolder(foldername, decode=False)
+
+    hook_env = {
+        'OIMAP_ACCOUNT_NAME': account.getname(),
+    }
+    account.callhook('presynchook', hook_env)
+    offlineimap.accounts.syncfolder(account, remotefolder, quick=False)
+    account.callhook('postsynchook', hook_env)
+
+    ui = getglobalui()
+    ui.unregisterthread(currentThread()) #syncfolder registered the thread
+
 
 class IdleThread(object):
     def __init__(self, parent, folder=None):
@@ -816,22 +944,7 @@ class IdleThread(object):
                 self.stop_sig.wait() # wait until we are supposed to quit
 
     def __dosync(self):
-        remoterepos = self.parent.repos
-        account = remoterepos.account
-        localrepos = account.localrepos
-        remoterepos = account.remoterepos
-        statusrepos = account.statusrepos
-        remotefolder = remoterepos.getfolder(self.folder, decode=False)
-
-        hook_env = {
-            'OIMAP_ACCOUNT_NAME': account.getname(),
-        }
-        account.callhook('presynchook', hook_env)
-        offlineimap.accounts.syncfolder(account, remotefolder, quick=False)
-        account.callhook('postsynchook', hook_env)
-
-        ui = getglobalui()
-        ui.unregisterthread(currentThread()) #syncfolder registered the thread
+        _syncfolder(self.parent, self.folder)
 
     def __idle(self):
         """Invoke IDLE mode until timeout or self.stop() is invoked."""
@@ -899,3 +1012,225 @@ class IdleThread(object):
                 # another round and invoke actual syncing.
                 self.stop_sig.clear()
                 self.__dosync()
+
+
+class PushLoop(object):
+    """Syncs the folders the server reports changes for, from one thread.
+
+    With NOTIFY (RFC 5465) a single connection gets the changes of all the
+    folders. Otherwise, each spare connection of the pool IDLEs on one
+    folder (idlefolders and INBOX first), and the remaining folders are
+    polled with STATUS every 'timeout' seconds. One connection is always
+    left to the syncs.
+
+    The IDLE callbacks of imaplib2 only queue events: all the syncing is
+    done sequentially by the loop thread."""
+
+    # Untagged responses telling that the selected folder changed.
+    selected_changes = ('EXISTS', 'EXPUNGE', 'FETCH', 'RECENT', 'VANISHED')
+
+    def __init__(self, parent, timeout):
+        self.parent = parent
+        self.timeout = timeout
+        self.ui = getglobalui()
+        self.events = Queue()
+        self.names = {}     # IMAP folder name -> name for getfolder().
+        self.idling = {}    # imapobj -> selected IMAP folder name.
+        self.notifying = None # imapobj with NOTIFY set, if any.
+        self.polled = {}    # IMAP folder name -> last STATUS response.
+        self.thread = threadutil.ExitNotifyThread(target=self.__loop,
+            name="Push %s"% parent.repos.getname())
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.events.put(None)
+
+    def join(self):
+        self.thread.join()
+
+    def __idle(self, imapobj, imapname):
+        """Put imapobj in IDLE mode on imapname."""
+
+        imapobj.select(imapname, True)
+        self.__changes(imapobj) # Forget the responses to SELECT.
+        self.idling[imapobj] = imapname
+        imapobj.idle(callback=lambda args: self.events.put((imapobj, args)))
+
+    def __release(self, imapobj, drop_conn=False):
+        """End IDLE mode, if any, and release imapobj."""
+
+        self.idling.pop(imapobj, None)
+        if imapobj is self.notifying:
+            self.notifying = None
+        if not drop_conn:
+            try:
+                imapobj.noop() # Ends IDLE mode.
+            except (imapobj.abort, imapobj.error):
+                drop_conn = True
+        self.parent.releaseconnection(imapobj, drop_conn)
+
+    def __changes(self, imapobj):
+        """Returns the IMAP names of the folders imapobj reported changes
+        for, and forgets the responses."""
+
+        changed = set()
+        for code in self.selected_changes:
+            typ, dat = imapobj.response(code)
+            if dat != [None]:
+                changed.add(self.idling.get(imapobj))
+        typ, dat = imapobj.response('STATUS')
+        for item in dat:
+            if item is not None:
+                changed.add(imaputil.dequote(imaputil.imapsplit(item)[0]))
+        changed.discard(None)
+        return changed
+
+    def __notify(self, imapobj, imapnames):
+        """Ask for the changes of all the folders on imapobj.
+
+        :returns: True if the server accepted the NOTIFY command."""
+
+        mailboxes = ' '.join([imaputil.quote(name) for name in imapnames])
+        try:
+            typ, dat = imapobj.notify('SET',
+                "'(selected (MessageNew MessageExpunge FlagChange)) "
+                "(mailboxes (%s) (MessageNew MessageExpunge FlagChange))'"%
+                mailboxes)
+        except imapobj.error as e:
+            self.ui.debug('imap', 'push: NOTIFY failed: %s'% e)
+            return False
+        return typ == 'OK'
+
+    def __priority(self, imapname):
+        """Sort key giving IDLE to idlefolders, then INBOX."""
+
+        if imapname in self.parent.idlefolders or \
+                self.names[imapname] in self.parent.idlefolders:
+            return 0
+        if imapname == 'INBOX':
+            return 1
+        return 2
+
+    def __arm(self):
+        """IDLE on as many folders as possible, see the class docstring."""
+
+        if self.notifying is not None:
+            return # It watches all the folders already.
+        pending = [name for name in self.names
+            if name not in self.idling.values()]
+        pending.sort(key=self.__priority)
+        while pending and self.parent.maxconnections - \
+                len(self.idling) > 1:
+            imapname = pending.pop(0)
+            imapobj = self.parent.acquireconnection(imapname)
+            try:
+                # A system imaplib2 has no notify().
+                if not self.idling and 'NOTIFY' in imapobj.capabilities \
+                        and hasattr(imapobj, 'notify'):
+                    imapobj.select(imapname, True)
+                    if self.__notify(imapobj, list(self.names)):
+                        self.notifying = imapobj
+                        self.__idle(imapobj, imapname)
+                        self.polled = {}
+                        return
+                self.__idle(imapobj, imapname)
+            except OfflineImapError as e:
+                # E.g. the folder was deleted, poll it from now on.
+                self.ui.error(e, exc_info()[2])
+                self.idling.pop(imapobj, None)
+                self.parent.releaseconnection(imapobj, True)
+                pending.append(imapname)
+                break
+        for name in pending:
+            self.polled.setdefault(name, None)
+
+    def __poll(self):
+        """Returns the polled folders whose STATUS changed."""
+
+        changed = set()
+        polled = [name for name in self.polled
+            if name not in self.idling.values()]
+        if not polled:
+            return changed
+        imapobj = self.parent.acquireconnection()
+        drop_conn = False
+        try:
+            for name in polled:
+                typ, dat = imapobj.status(imaputil.quote(name),
+                    '(MESSAGES UIDNEXT UIDVALIDITY)')
+                if typ != 'OK' or dat[0] is None:
+                    self.ui.debug('imap', "push: STATUS '%s' failed: %s %s"%
+                        (name, typ, dat))
+                    continue
+                status = imaputil.imapsplit(dat[0])[1]
+                if self.polled[name] not in (None, status):
+                    changed.add(name)
+                self.polled[name] = status
+        except imapobj.abort:
+            drop_conn = True
+            raise
+        finally:
+            self.parent.releaseconnection(imapobj, drop_conn)
+        return changed
+
+    def __sync(self, imapname):
+        account = self.parent.repos.account
+        foldername = self.names[imapname]
+        localfolder = account.get_local_folder(
+            account.remoterepos.getfolder(foldername, decode=False))
+        if localfolder.sync_this:
+            _syncfolder(self.parent, foldername)
+
+    def __cycle(self, event):
+        """Syncs the folders changed according to event and polling, then
+        IDLEs again."""
+
+        changed = set()
+        if event:
+            imapobj, (result, cb_arg, exc_data) = event
+            try:
+                if exc_data is None:
+                    changed = self.__changes(imapobj)
+            finally:
+                # IDLE ended. The connection can serve the syncs, __arm()
+                # IDLEs again afterwards. Drop it if it failed.
+                self.__release(imapobj, exc_data is not None)
+        changed.update(self.__poll())
+        for imapname in changed:
+            if imapname in self.names:
+                self.ui.debug('imap', "push: '%s' changed"% imapname)
+                self.__sync(imapname)
+        self.__arm()
+
+    def __loop(self):
+        self.ui.debug('imap', 'push: loop started')
+        for remotefolder in self.parent.repos.getfolders():
+            if remotefolder.sync_this:
+                self.names[remotefolder.getfullIMAPname()] = \
+                    remotefolder.getname()
+        try:
+            try:
+                self.__arm()
+                self.__poll() # Record the initial states.
+            except Exception as e:
+                self.ui.error(e, exc_info()[2], msg="push: could not watch "
+                    "repository %s"% self.parent.repos)
+            while True:
+                try:
+                    event = self.events.get(timeout=self.timeout)
+                except Empty:
+                    event = False
+                if event is None:
+                    break # stop()
+                try:
+                    self.__cycle(event)
+                except Exception as e:
+                    # Keep pushing, the next cycle polls and IDLEs again.
+                    self.ui.error(e, exc_info()[2], msg="push: error while "
+                        "watching repository %s"% self.parent.repos)
+        finally:
+            for imapobj in list(self.idling):
+                self.__release(imapobj)
+        self.ui.debug('imap', 'push: loop exited')
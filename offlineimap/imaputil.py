@@ -251,6 +251,25 @@ def uid_sequence(uidlist):
     retval.append(getrange(start, end)) # Add final range/item
     return ",".join(retval)
 
+def uid_sequence_expand(sequence):
+    """Expand a sequence set into the list of UIDs it denotes
+
+    "1:5,10,12:13" will return [1,2,3,4,5,10,12,13].  This is the reverse
+    of uid_sequence(), used e.g. to parse VANISHED responses.  Ranges may
+    be given in either order ("5:1") as allowed by RFC 3501.
+    :returns: sorted list of UIDs as integers."""
+
+    uids = set()
+    for item in sequence.strip().split(','):
+        if not item:
+            continue
+        if ':' in item:
+            start, end = sorted(map(int, item.split(':', 1)))
+            uids.update(range(start, end + 1))
+        else:
+            uids.add(int(item))
+    return sorted(uids)
+
 
 def __split_quoted(s):
     """Looks for the ending quote character in the string that starts
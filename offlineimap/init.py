@@ -23,6 +23,7 @@ import socket
 import logging
 import traceback
 import collections
+import multiprocessing
 from optparse import OptionParser
 
 import offlineimap
@@ -34,6 +35,7 @@ from offlineimap.ui import UI_LIST, setglobalui, getglobalui
 from offlineimap import threadutil, accounts, folder, mbnames
 from offlineimap import globals as glob
 from offlineimap.CustomConfig import CustomConfigParser
+from offlineimap.error import OfflineImapError
 from offlineimap.utils import stacktrace
 from offlineimap.repository import Repository
 from offlineimap.folder.IMAP import MSGCOPY_NAMESPACE
@@ -42,17 +44,133 @@ from offlineimap.folder.IMAP import MSGCOPY_NAMESPACE
 ACCOUNT_LIMITED_THREAD_NAME = 'MAX_ACCOUNTS'
 PYTHON_VERSION = sys.version.split(' ')[0]
 
+# The account processes currently running (accountbackend = processes).
+_accountprocesses = []
+_accountprocesseslock = threading.Lock()
+
+
+def getaccountbackend(config):
+    """Returns how the accounts are run: 'threads' or 'processes'."""
+
+    backend = config.getdefault('general', 'accountbackend', 'threads')
+    if backend not in ('threads', 'processes'):
+        raise OfflineImapError("Unknown accountbackend '%s', expected "
+            "'threads' or 'processes'"% backend,
+            OfflineImapError.ERROR.CRITICAL)
+    if backend == 'processes':
+        ui = getglobalui()
+        if not hasattr(os, 'fork'):
+            ui.warn("accountbackend: processes are not supported on this "
+                "platform, using threads")
+            return 'threads'
+        if not ui.forksafe:
+            ui.warn("accountbackend: processes are not supported by the %s "
+                "UI, using threads"% ui.__class__.__name__)
+            return 'threads'
+    return backend
+
+
+def getsyncengine(config):
+    """Returns the target running the accounts in multithreading mode."""
+
+    engine = config.getdefault('general', 'syncengine', 'threads')
+    if engine == 'threads':
+        return syncitall
+    if engine == 'asyncio':
+        try:
+            from offlineimap import asyncengine
+        except (ImportError, SyntaxError):
+            raise OfflineImapError("syncengine asyncio requires Python 3",
+                OfflineImapError.ERROR.CRITICAL)
+        return asyncengine.syncitall
+    raise OfflineImapError("Unknown syncengine '%s', expected 'threads' or "
+        "'asyncio'"% engine, OfflineImapError.ERROR.CRITICAL)
+
+
+def _accountprocess(account):
+    """Entry point of an account process: syncs the account the way the
+    main process does with threads and exits with the run status."""
+
+    global _accountprocesses, _accountprocesseslock
+
+    # Forked from an account thread: only this thread survived.
+    _accountprocesses = []
+    _accountprocesseslock = threading.Lock()
+    threadutil.reinit_after_fork()
+    getglobalui().reinit_after_fork()
+
+    t = threadutil.ExitNotifyThread(
+        target=account.syncrunner,
+        name="Account sync %s"% account.getname()
+        )
+    t.exit_message = threadutil.STOP_MONITOR
+    t.start()
+    threadutil.monitor()
+
+    # The errors were logged by this process, the main process only
+    # learns about them from the exit status.
+    ui = getglobalui()
+    if ui.uidval_problem:
+        sys.exit(2)
+    sys.exit(0 if ui.exc_queue.empty() else 1)
+
+
+def _runaccountprocess(account):
+    """Syncs account in a worker process and waits for it to exit."""
+
+    # Python 2 has no contexts, but always forks on POSIX.
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing
+    process = context.Process(
+        target=_accountprocess,
+        args=(account,),
+        name="Account sync %s"% account.getname()
+        )
+    with _accountprocesseslock:
+        process.start()
+        _accountprocesses.append(process)
+    process.join()
+    with _accountprocesseslock:
+        _accountprocesses.remove(process)
+
+    ui = getglobalui()
+    if process.exitcode == 2:
+        ui.uidval_problem = True
+    elif process.exitcode != 0:
+        ui.error(OfflineImapError("account process exited with status %s"%
+            process.exitcode, OfflineImapError.ERROR.REPO),
+            msg="Account %s"% account.getname())
+
+
+def _signalaccountprocesses(sig):
+    """Forwards the signal sig to the account processes."""
+
+    with _accountprocesseslock:
+        for process in _accountprocesses:
+            try:
+                os.kill(process.pid, sig)
+            except OSError:
+                pass # Already exited.
+
 
 def syncitall(list_accounts, config):
     """The target when in multithreading mode for running accounts threads."""
 
+    backend = getaccountbackend(config)
     threads = threadutil.accountThreads() # The collection of accounts threads.
     for accountname in list_accounts:
         # Start a new thread per account and store it in the collection.
         account = accounts.SyncableAccount(config, accountname)
+        if backend == 'processes':
+            # The thread only waits for the account process.
+            target = lambda account=account: _runaccountprocess(account)
+        else:
+            target = account.syncrunner
         thread = threadutil.InstanceLimitedThread(
             ACCOUNT_LIMITED_THREAD_NAME,
-            target = account.syncrunner,
+            target = target,
             name = "Account sync %s"% accountname
             )
         thread.setDaemon(True)
@@ -117,6 +235,12 @@ class OfflineImap(object):
                   default=False,
                   help="dry run mode")
 
+        parser.add_option("--plan-only",
+                  action="store_true", dest="planonly",
+                  default=False,
+                  help="only output the number of changes a sync would make"
+                  " to each folder (implies --dry-run)")
+
         parser.add_option("--info",
                   action="store_true", dest="diagnostics",
                   default=False,
@@ -260,7 +384,7 @@ class OfflineImap(object):
             ui_type = 'ttyui' # Enforce this UI for --info.
 
         # dry-run? Set [general]dry-run=True.
-        if options.dryrun:
+        if options.dryrun or options.planonly:
             dryrun = config.set('general', 'dry-run', 'True')
         config.set_if_not_exists('general', 'dry-run', 'False')
 
@@ -424,6 +548,9 @@ class OfflineImap(object):
         already."""
 
         def sig_handler(sig, frame):
+            if sig not in (signal.SIGINT, signal.SIGQUIT):
+                # Account processes get the terminal signals by themselves.
+                _signalaccountprocesses(sig)
             if sig == signal.SIGUSR1:
                 # tell each account to stop sleeping
                 accounts.Account.set_abort_event(self.config, 1)
@@ -469,7 +596,7 @@ class OfflineImap(object):
             else:
                 # Multithreaded.
                 t = threadutil.ExitNotifyThread(
-                    target=syncitall,
+                    target=getsyncengine(self.config),
                     name='Sync Runner',
                     args=(activeaccounts, self.config,)
                     )
@@ -0,0 +1,172 @@
+# Linux inotify support to track changes of Maildir folders
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+from threading import Lock
+
+
+# Flags from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# What may change the list of messages, their flags or their content.
+MAILDIR_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[].
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Minimal binding to the Linux inotify API, using ctypes.
+
+    The file descriptor is non-blocking: read() only returns the events
+    already queued."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True)
+        try:
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_uint32]
+        self.fd = self._init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        """Returns the watch descriptor of path."""
+
+        if not isinstance(path, bytes):
+            path = path.encode('utf-8')
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        """Returns the list of pending (wd, mask, name) events."""
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = data[pos:pos + length].rstrip(b'\0')
+                pos += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MaildirWatcher(object):
+    """Records which Maildir folders changed since they were last scanned.
+
+    Folders are identified by their full path. The 'new' and 'cur'
+    directories of a folder are watched from the first call to
+    scanning(). A folder only counts as unchanged once the sync following
+    its scan succeeded, see synced(). If the kernel queue overflows, all
+    the folders are considered changed so that they get scanned again."""
+
+    def __init__(self):
+        self.inotify = Inotify()
+        self.lock = Lock()
+        self.wds = {}          # Watch descriptor -> folder path.
+        self.watched = set()   # Folder paths.
+        self.changed = set()   # Folder paths changed since scanning().
+        self.unsynced = set()  # Folder paths scanned but not synced yet.
+
+    def _drain(self):
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, don't trust anything.
+                self.changed.update(self.watched)
+                continue
+            path = self.wds.get(wd)
+            if path is None:
+                continue
+            self.changed.add(path)
+            if mask & IN_IGNORED:
+                # Directory deleted or moved away: forget the folder.
+                for other in [w for w, p in self.wds.items() if p == path]:
+                    del self.wds[other]
+                self.watched.discard(path)
+
+    def scanning(self, path):
+        """To be called right before path is scanned.
+
+        Watches the folder if needed. Events from now on mark it changed
+        again, and it stays changed anyway until synced() is called."""
+
+        with self.lock:
+            self._drain()
+            if path not in self.watched:
+                try:
+                    for dirannex in ('new', 'cur'):
+                        wd = self.inotify.add_watch(
+                            os.path.join(path, dirannex), MAILDIR_MASK)
+                        self.wds[wd] = path
+                except OSError:
+                    # E.g. out of watches: the folder will always be
+                    # considered changed.
+                    return
+                self.watched.add(path)
+            self.changed.discard(path)
+            self.unsynced.add(path)
+
+    def synced(self, path):
+        """To be called once the changes found by the last scan of path
+        were synced and saved in the status."""
+
+        with self.lock:
+            self.unsynced.discard(path)
+
+    def haschanged(self, path):
+        """Returns True unless path is watched, was synced after its last
+        scan and had no event since that scan."""
+
+        with self.lock:
+            self._drain()
+            return path not in self.watched or path in self.changed or \
+                path in self.unsynced
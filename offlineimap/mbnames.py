@@ -20,8 +20,12 @@ import codecs
 import re   # For folderfilter.
 import json
 from threading import Lock
-from os import listdir, makedirs, path, unlink
+from os import listdir, makedirs, path, rename, unlink
 from sys import exc_info
+try:
+    import fcntl
+except ImportError:
+    pass # Windows: no cross-process locking of the mbnames file.
 try:
     from ConfigParser import NoSectionError
 except ImportError: # Py3.
@@ -120,9 +124,12 @@ class _IntermediateMbnames(object):
         if self._dryrun:
             self.ui.info("mbnames would write %s"% self._path)
         else:
+            # Written aside then renamed: other account processes may be
+            # reading the intermediate files.
             with codecs.open(
-                self._path, "wt", encoding='UTF-8') as intermediateFD:
+                self._path + '.tmp', "wt", encoding='UTF-8') as intermediateFD:
                 json.dump(itemlist, intermediateFD)
+            rename(self._path + '.tmp', self._path)
 
 
 class _Mbnames(object):
@@ -231,6 +238,25 @@ class _Mbnames(object):
             self._removeIntermediateFile(intermediateFile)
 
     def write(self):
+        # Account processes (accountbackend = processes) may write the
+        # mbnames file concurrently.
+        lockfd = None
+        if not self._dryrun:
+            try:
+                lockfd = open(path.join(self._mbnamesdir, 'mbnames.lock'), 'w')
+                fcntl.lockf(lockfd, fcntl.LOCK_EX)
+            except NameError:
+                pass # fcntl not available.
+            except (OSError, IOError) as e:
+                self.ui.error(e, exc_info()[2],
+                    "could not lock the mbnames file %s"% self._path)
+        try:
+            self._write()
+        finally:
+            if lockfd is not None:
+                lockfd.close() # Releases the lock.
+
+    def _write(self):
         itemlist = []
 
         for intermediateFile in self._iterIntermediateFiles():
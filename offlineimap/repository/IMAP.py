@@ -26,6 +26,7 @@ from threading import Event
 import six
 
 from offlineimap import folder, imaputil, imapserver, OfflineImapError
+from offlineimap import virtual_imaplib2
 from offlineimap.repository.Base import BaseRepository
 from offlineimap.threadutil import ExitNotifyThread
 from offlineimap.utils.distro import get_os_sslcertfile, get_os_sslcertfile_searchpath
@@ -45,6 +46,7 @@ class IMAPRepository(BaseRepository):
         # Keep alive.
         self.kaevent = None
         self.kathread = None
+        self.pushloop = None
 
         # Only set the newmail_hook in an IMAP repository.
         if self.config.has_option(self.getsection(), 'newmail_hook'):
@@ -59,6 +61,16 @@ class IMAPRepository(BaseRepository):
         keepalivetime = self.getkeepalive()
         if not keepalivetime:
             return
+        if self.getpush():
+            if self.getmaxconnections() < 2:
+                self.ui.warn("push: repository '%s' has a single connection, "
+                    "its folders are only polled every %d seconds. Raise "
+                    "maxconnections to IDLE."% (self.name, keepalivetime))
+            # The push loop keeps the connections alive.
+            self.pushloop = imapserver.PushLoop(self.imapserver,
+                keepalivetime)
+            self.pushloop.start()
+            return
         self.kaevent = Event()
         self.kathread = ExitNotifyThread(target=self.imapserver.keepalive,
                                          name="Keep alive " + self.getname(),
@@ -67,6 +79,11 @@ class IMAPRepository(BaseRepository):
         self.kathread.start()
 
     def stopkeepalive(self):
+        if self.pushloop is not None:
+            # Wait for the current sync, if any, before the account syncs.
+            self.pushloop.stop()
+            self.pushloop.join()
+            self.pushloop = None
         if self.kaevent is None:
             return # Keepalive is not active.
 
@@ -75,6 +92,8 @@ class IMAPRepository(BaseRepository):
         self.kaevent = None
 
     def holdordropconnections(self):
+        self.ui.connectionpoolstats(self, self.imapserver.getpoolstats())
+        self.imapserver.resetpoolstats()
         if not self.getholdconnectionopen():
             self.dropconnections()
 
@@ -95,13 +114,13 @@ class IMAPRepository(BaseRepository):
         return self.copy_ignore_eval(foldername)
 
     def getholdconnectionopen(self):
-        if self.getidlefolders():
+        if self.getidlefolders() or self.getpush():
             return True
         return self.getconfboolean("holdconnectionopen", False)
 
     def getkeepalive(self):
         num = self.getconfint("keepalive", 0)
-        if num == 0 and self.getidlefolders():
+        if num == 0 and (self.getidlefolders() or self.getpush()):
             return 29*60
         return num
 
@@ -364,6 +383,49 @@ class IMAPRepository(BaseRepository):
             )
         return self.idlefolders
 
+    def getpush(self):
+        return self.getconfboolean('push', False)
+
+    def getpoolmode(self):
+        mode = self.getconf('poolmode', 'thread')
+        if mode not in ('thread', 'folder'):
+            raise OfflineImapError("Invalid poolmode '%s' for repository "
+                "'%s'. Supported values are 'thread' and 'folder'."%
+                (mode, self.name), OfflineImapError.ERROR.REPO)
+        return mode
+
+    def getioengine(self):
+        engine = self.getconf('ioengine', 'threads')
+        if engine not in ('threads', 'shared'):
+            raise OfflineImapError("Invalid ioengine '%s' for repository "
+                "'%s'. Supported values are 'threads' and 'shared'."%
+                (engine, self.name), OfflineImapError.ERROR.REPO)
+        if engine == 'shared' and (virtual_imaplib2.DESC != 'bundled' or
+                virtual_imaplib2.imaplib.selectors is None):
+            self.ui.warn("ioengine 'shared' of repository '%s' requires the "
+                "bundled imaplib2 and Python 3, using threads"% self.name)
+            engine = 'threads'
+        return engine
+
+    def getcompressionlevel(self):
+        level = self.getconfint('compressionlevel', -1)
+        if not -1 <= level <= 9:
+            raise OfflineImapError("Invalid compressionlevel %d for repository "
+                "'%s'. Supported values are -1 (default) to 9."%
+                (level, self.name), OfflineImapError.ERROR.REPO)
+        return level
+
+    def getcompressionwindow(self):
+        wbits = self.getconfint('compressionwindow', 15)
+        if not 9 <= wbits <= 15:
+            raise OfflineImapError("Invalid compressionwindow %d for "
+                "repository '%s'. Supported values are 9 to 15."%
+                (wbits, self.name), OfflineImapError.ERROR.REPO)
+        return wbits
+
+    def getliteralreader(self):
+        return self.getconfboolean('literalreader', False)
+
     def getmaxconnections(self):
         num1 = len(self.getidlefolders())
         num2 = self.getconfint('maxconnections', 1)
@@ -372,6 +434,21 @@ class IMAPRepository(BaseRepository):
     def getexpunge(self):
         return self.getconfboolean('expunge', True)
 
+    def getcondstore(self):
+        return self.getconfboolean('usecondstore', False)
+
+    def getfetchbatchmessages(self):
+        return self.getconfint('fetchbatchmessages', 1)
+
+    def getfetchbatchbytes(self):
+        return self.getconfint('fetchbatchbytes', 4194304)
+
+    def getappendbatchmessages(self):
+        return self.getconfint('appendbatchmessages', 1)
+
+    def getappendbatchbytes(self):
+        return self.getconfint('appendbatchbytes', 4194304)
+
     def getpassword(self):
         """Return the IMAP password for this repository.
 
@@ -585,3 +662,11 @@ class IMAPRepository(BaseRepository):
 class MappedIMAPRepository(IMAPRepository):
     def getfoldertype(self):
         return folder.UIDMaps.MappedIMAPFolder
+
+    def getuidmapformat(self):
+        mapformat = self.getconf('uidmapformat', 'plain')
+        if mapformat not in ('plain', 'log'):
+            raise OfflineImapError("Invalid uidmapformat '%s' for repository "
+                "'%s'. Supported values are 'plain' and 'log'."%
+                (mapformat, self.name), OfflineImapError.ERROR.REPO)
+        return mapformat
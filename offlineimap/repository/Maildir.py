@@ -15,7 +15,7 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 
-from offlineimap import folder
+from offlineimap import folder, inotify
 from offlineimap.ui import getglobalui
 from offlineimap.error import OfflineImapError
 from offlineimap.repository.Base import BaseRepository
@@ -31,6 +31,7 @@ class MaildirRepository(BaseRepository):
 
         self.root = self.getlocalroot()
         self.folders = None
+        self.watcher = None
         self.ui = getglobalui()
         self.debug("MaildirRepository initialized, sep is %s"% repr(self.getsep()))
         self.folder_atimes = []
@@ -70,6 +71,35 @@ class MaildirRepository(BaseRepository):
             os.utime(new_dir, (new_atime, os.path.getmtime(new_dir)))
             os.utime(cur_dir, (cur_atime, os.path.getmtime(cur_dir)))
 
+    def getscancachedir(self):
+        """Returns the directory holding the folders' scan caches
+
+        Controlled by the 'scancache' config parameter (default False).
+        :returns: the directory path, or None if scan caches are disabled."""
+
+        if not self.getconfboolean('scancache', False):
+            return None
+        cachedir = os.path.join(self.config.getmetadatadir(),
+            'Repository-' + self.name, 'MaildirScanCache')
+        if not os.path.exists(cachedir):
+            os.mkdir(cachedir, 0o700)
+        return cachedir
+
+    def getwatcher(self):
+        """Returns the inotify.MaildirWatcher of this repository
+
+        Controlled by the 'inotify' config parameter (default False).
+        :returns: the watcher, or None if disabled or not supported."""
+
+        if self.watcher is None and self.getconfboolean('inotify', False):
+            try:
+                self.watcher = inotify.MaildirWatcher()
+            except OSError as e:
+                self.ui.warn("Repository %s: can't watch folders with "
+                    "inotify, scanning them instead: %s"% (self, e))
+                self.watcher = False
+        return self.watcher or None
+
     def getlocalroot(self):
         xforms = [os.path.expanduser, os.path.expandvars]
         return self.getconf_xform('localfolders', xforms)
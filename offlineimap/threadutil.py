@@ -16,11 +16,13 @@
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 
 from threading import Lock, Thread, BoundedSemaphore
+from sys import exc_info
 try:
     from Queue import Queue, Empty
 except ImportError: # python3
     from queue import Queue, Empty
 import traceback
+import six
 from offlineimap.ui import getglobalui
 
 
@@ -76,6 +78,13 @@ class accountThreads(object):
 
 exitedThreads = Queue()
 
+def reinit_after_fork():
+    """Resets the monitor queue in a forked process, which only runs the
+    threads it starts itself."""
+
+    global exitedThreads
+    exitedThreads = Queue()
+
 def monitor():
     """An infinite "monitoring" loop watching for finished ExitNotifyThread's.
 
@@ -154,7 +163,6 @@ class ExitNotifyThread(Thread):
     def run(self):
         """Allow profiling of a run and store exceptions."""
 
-        global exitedThreads
         try:
             Thread.run(self)
         except Exception as e:
@@ -162,6 +170,15 @@ class ExitNotifyThread(Thread):
             tb = traceback.format_exc()
             self.set_exit_exception(e, tb)
 
+        self.notify_exit()
+
+    def notify_exit(self):
+        """Hands the thread to the monitor, which reports its exit.
+
+        Also used to report the failure of a run made by other means than
+        a thread, after set_exit_exception()."""
+
+        global exitedThreads
         exitedThreads.put(self, True)
 
     def set_exit_exception(self, exc, st=None):
@@ -191,6 +208,7 @@ class ExitNotifyThread(Thread):
 ######################################################################
 
 limitedNamespaces = {}
+instanceLimits = {}
 
 def initInstanceLimit(limitNamespace, instancemax):
     """Initialize the instance-limited thread implementation.
@@ -198,10 +216,11 @@ def initInstanceLimit(limitNamespace, instancemax):
     Run up to intancemax threads for the given limitNamespace. This allows to
     honor maxsyncaccounts and maxconnections."""
 
-    global limitedNamespaces
+    global limitedNamespaces, instanceLimits
 
     if not limitNamespace in limitedNamespaces:
         limitedNamespaces[limitNamespace] = BoundedSemaphore(instancemax)
+        instanceLimits[limitNamespace] = instancemax
 
 
 class InstanceLimitedThread(ExitNotifyThread):
@@ -224,3 +243,83 @@ class InstanceLimitedThread(ExitNotifyThread):
         finally:
             if limitedNamespaces and limitedNamespaces[self.limitNamespace]:
                 limitedNamespaces[self.limitNamespace].release()
+
+
+class InstanceLimitedPool(object):
+    """Bounded pool of worker threads running jobs for a limitNamespace.
+
+    Up to instancemax workers, as given to initInstanceLimit() for the
+    namespace, are started on demand and run the submitted jobs in turn.
+    Each running job holds a slot of the namespace semaphore, so the limit
+    is shared with the other pools and InstanceLimitedThreads of the
+    namespace.
+
+    The first exception raised by a job is kept and re-raised by the next
+    submit() or by join(), once the workers are stopped: the jobs submitted
+    in between are dropped. Jobs are expected to report the errors they
+    don't raise themselves."""
+
+    def __init__(self, limitNamespace, name, initializer=None):
+        """:param initializer: callable run once by each worker when it
+        starts, e.g. to register the thread with the UI."""
+
+        self.limitNamespace = limitNamespace
+        self.name = name
+        self.initializer = initializer
+        self.maxworkers = instanceLimits[limitNamespace]
+        self.workers = []
+        # Do not queue more jobs than we can run at once.
+        self.jobs = Queue(self.maxworkers)
+        self.failure = None # exc_info() of the first failed job.
+        self.failurelock = Lock()
+
+    def submit(self, target, *args):
+        """Queue target(*args) to be run by a worker.
+
+        Blocks while the queue of the pending jobs is full. Raises the
+        exception of a failed job instead, see join()."""
+
+        if self.failure is not None:
+            self.join()
+        if len(self.workers) < self.maxworkers:
+            worker = ExitNotifyThread(target=self.__work, name=self.name)
+            worker.start()
+            self.workers.append(worker)
+        self.jobs.put((target, args))
+
+    def join(self):
+        """Wait for all the submitted jobs to be done and stop the workers.
+
+        Raises the exception of the first failed job, if any."""
+
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self.failure is not None:
+            failure, self.failure = self.failure, None
+            six.reraise(*failure)
+
+    def __work(self):
+        global limitedNamespaces
+
+        if self.initializer is not None:
+            self.initializer()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.failure is not None:
+                continue # Drop the jobs left after a failure.
+            target, args = job
+            limitedNamespaces[self.limitNamespace].acquire()
+            try:
+                target(*args)
+            except Exception:
+                # Keep the worker alive so that the queue is still drained.
+                with self.failurelock:
+                    if self.failure is None:
+                        self.failure = exc_info()
+            finally:
+                limitedNamespaces[self.limitNamespace].release()
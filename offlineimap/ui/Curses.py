@@ -343,6 +343,9 @@ class Blinkenlights(UIBase, CursesUtil):
        - threadframes:
        - accframes[account]: 'Accountframe'"""
 
+    # Worker processes can't draw on the parent's screen.
+    forksafe = False
+
     def __init__(self, *args, **kwargs):
         super(Blinkenlights, self).__init__(*args, **kwargs)
         CursesUtil.__init__(self)
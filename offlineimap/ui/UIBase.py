@@ -51,6 +51,9 @@ def getglobalui():
 
 
 class UIBase(object):
+    # Whether accounts can be synced in forked processes with this UI.
+    forksafe = True
+
     def __init__(self, config, loglevel=logging.INFO):
         self.config = config
         # Is this a 'dryrun'?
@@ -93,6 +96,15 @@ class UIBase(object):
         self.logger.info(offlineimap.banner)
         return ch
 
+    def reinit_after_fork(self):
+        """Re-creates the locks of the logging handlers in a forked process.
+
+        Python 2 doesn't, so a handler lock held by another thread of the
+        parent at fork time would never be released in the child."""
+
+        for handler in self.logger.handlers:
+            handler.createLock()
+
     def setup_sysloghandler(self):
         """Backend specific syslog handler."""
 
@@ -334,6 +346,25 @@ class UIBase(object):
         self.acct_startimes[account] = time.time()
         self.logger.info("*** Processing account %s"% account)
 
+    def connectionpoolstats(self, repository, stats):
+        """Output the connection pool statistics of a repository."""
+
+        compression = stats.get('compression')
+        if compression is not None:
+            self.logger.info("Compression of %s: received %d bytes for %d, "
+                "sent %d bytes for %d"% (repository,
+                compression['compressed_in'], compression['raw_in'],
+                compression['compressed_out'], compression['raw_out']))
+        if stats['hits'] + stats['misses'] + stats['new'] == 0:
+            return
+        avgwait = 0
+        if stats['waits'] > 0:
+            avgwait = stats['waittime'] / stats['waits']
+        self.logger.info("Connection pool of %s: %d hits, %d misses, "
+            "%d new, %d waits (average wait %.2fs)"% (repository,
+            stats['hits'], stats['misses'], stats['new'], stats['waits'],
+            avgwait))
+
     def acctdone(self, account):
         """Output that we finished syncing an account (in which time)."""
 
@@ -385,6 +416,17 @@ class UIBase(object):
         self.logger.debug("Message list for %s[%s] loaded: %d messages" % (
                 self.getnicename(repos), folder, count))
 
+    def syncplan(self, srcfolder, dstfolder, plan):
+        """Output the number of changes a sync would make (--plan-only)."""
+
+        self.logger.info("Plan %s[%s] -> %s[%s]: copy %d (%d ignored), "
+            "delete %d, add %d flags, remove %d flags"% (
+            self.getnicename(srcfolder.repository), srcfolder,
+            self.getnicename(dstfolder.repository), dstfolder,
+            len(plan['copy']), len(plan['ignore']), len(plan['delete']),
+            sum([len(uids) for uids in plan['addflags'].values()]),
+            sum([len(uids) for uids in plan['delflags'].values()])))
+
     ############################## Message syncing
 
     def syncingmessages(self, sr, srcfolder, dr, dstfolder):
@@ -22,7 +22,10 @@
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA
 
 import os
+import sys
 from distutils.core import setup, Command
+from distutils.command.build_py import build_py
+from distutils.command.install_lib import install_lib
 import logging
 
 from os import path
@@ -58,6 +61,23 @@ class TestCommand(Command):
         #TODO: failfast does not seem to exist in python2.6?
         TextTestRunner(verbosity=2,failfast=True).run(suite)
 
+# Modules using Python 3 only syntax, not byte-compiled by Python 2.
+py3_modules = [path.join('offlineimap', 'asyncengine.py')]
+
+def compilable(files):
+    if sys.version_info[0] >= 3:
+        return files
+    return [f for f in files
+            if not any(f.endswith(m) for m in py3_modules)]
+
+class BuildPyCommand(build_py):
+    def byte_compile(self, files):
+        build_py.byte_compile(self, compilable(files))
+
+class InstallLibCommand(install_lib):
+    def byte_compile(self, files):
+        install_lib.byte_compile(self, compilable(files))
+
 reqs = [
     'six',
     'rfc6555'
@@ -76,7 +96,9 @@ setup(name = "offlineimap",
       scripts = ['bin/offlineimap'],
       license = __copyright__ + \
                 ", Licensed under the GPL version 2",
-      cmdclass = { 'test': TestCommand},
+      cmdclass = { 'test': TestCommand,
+                   'build_py': BuildPyCommand,
+                   'install_lib': InstallLibCommand},
       install_requires = reqs
 )
 
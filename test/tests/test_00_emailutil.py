@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest
+
+from offlineimap import emailutil
+from offlineimap.emailutil import MessageChunks
+
+
+class TestMessageChunks(unittest.TestCase):
+
+    message = 'From: a@b\r\nSubject: test\r\n\r\nline 1\nline 2\r\n\r\nend\n'
+
+    def test_split(self):
+        chunks = MessageChunks.split(self.message, '\r\n')
+        self.assertEqual(chunks.head, 'From: a@b\r\nSubject: test\r\n\r\n')
+        self.assertEqual(chunks.start, len(chunks.head))
+
+    def test_split_without_body(self):
+        chunks = MessageChunks.split('From: a@b\nSubject: test\n', '\n')
+        self.assertEqual(chunks.head, 'From: a@b\nSubject: test\n')
+        self.assertEqual(str(chunks), 'From: a@b\nSubject: test\n')
+
+    def test_find_eoh(self):
+        self.assertEqual(emailutil.find_eoh('a: b\n\nbody'), 6)
+        self.assertEqual(emailutil.find_eoh('a: b\r\n\r\nbody\n\n'), 8)
+        self.assertEqual(emailutil.find_eoh('a: b\n'), -1)
+
+    def test_str(self):
+        crlf = self.message.replace('\r\n', '\n').replace('\n', '\r\n')
+        lf = self.message.replace('\r\n', '\n')
+        self.assertEqual(str(MessageChunks.split(self.message, '\r\n')), crlf)
+        self.assertEqual(str(MessageChunks.split(self.message, '\n')), lf)
+
+    def test_head_and_tail(self):
+        chunks = MessageChunks.split(self.message, '\n', tail=' {12}')
+        chunks.head = 'X-Test: 1\n' + chunks.head
+        self.assertEqual(str(chunks),
+            'X-Test: 1\n' + self.message.replace('\r\n', '\n') + ' {12}')
+
+    def test_len(self):
+        for linebreak in ('\n', '\r\n'):
+            chunks = MessageChunks.split(self.message, linebreak, tail='xyz')
+            self.assertEqual(len(chunks), len(str(chunks)))
+
+    def test_encodedlen(self):
+        chunks = MessageChunks.split(self.message, '\r\n')
+        self.assertEqual(chunks.encodedlen(), len(chunks))
+        chunks = MessageChunks.split(u'Subject: caf\xe9\n\nna\xefve\n', '\r\n')
+        self.assertEqual(chunks.encodedlen(),
+            len(''.join(chunks).encode('utf-8')))
+        self.assertEqual(chunks.encodedlen(), len(chunks) + 2)
+
+    def test_small_chunks(self):
+        # CRLF must never be split between two chunks.
+        for chunksize in range(1, 12):
+            chunks = MessageChunks.split(self.message, '\r\n',
+                chunksize=chunksize)
+            for chunk in chunks:
+                self.assertFalse(chunk.endswith('\r'))
+                self.assertFalse(chunk.startswith('\n'))
+            self.assertEqual(len(chunks), len(str(chunks)))
+            self.assertEqual(str(chunks), self.message.replace('\r\n',
+                '\n').replace('\n', '\r\n'))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMessageChunks)
+    unittest.TextTestRunner(verbosity=2).run(suite)
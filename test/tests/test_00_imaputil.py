@@ -92,3 +92,9 @@ class TestInternalFunctions(unittest.TestCase):
         """Test imaputil.uid_sequence()"""
         res = imaputil.uid_sequence([1,2,3,4,5,10,12,13])
         self.assertEqual(res, b'1:5,10,12:13')
+
+    def test_08_uid_sequence_expand(self):
+        """Test imaputil.uid_sequence_expand()"""
+        res = imaputil.uid_sequence_expand('1:5,10,13:12')
+        self.assertEqual(res, [1,2,3,4,5,10,12,13])
+        self.assertEqual(imaputil.uid_sequence_expand(''), [])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import sqlite3
+import unittest
+
+from offlineimap.folder.LocalStatusSQLite import LocalStatusSQLiteFolder, \
+    DatabaseFileLock, StatusMessageList
+from offlineimap.folder.MessageList import CompactMessageList
+
+
+class TestLazyStatusUIDs(unittest.TestCase):
+    """Tests the UID set queries of a lazy SQLite status folder."""
+
+    def setUp(self):
+        folder = LocalStatusSQLiteFolder.__new__(LocalStatusSQLiteFolder)
+        folder.connection = sqlite3.connect(':memory:')
+        folder.connection.execute('CREATE TABLE status (id INTEGER PRIMARY '
+            'KEY, flags VARCHAR(50), mtime INTEGER, labels VARCHAR(256))')
+        folder.connection.executemany('INSERT INTO status VALUES (?,?,0,"")',
+            [(1, 'S'), (2, ''), (3, 'FS'), (5, 'R')])
+        folder._databaseFileLock = DatabaseFileLock()
+        folder._in_transactions = 0
+        folder._lazy = True
+        folder.messagelist = StatusMessageList(folder)
+        self.folder = folder
+
+    def test_compare(self):
+        compact = CompactMessageList()
+        for uid in (2, 3, 4):
+            compact[uid] = {'uid': uid}
+        for uids in ([4, 3, 2], compact):
+            self.assertEqual(self.folder.uidsin(uids), [2, 3])
+            self.assertEqual(self.folder.uidsmissing(uids), [4])
+            self.assertEqual(self.folder.uidsnotin(uids), [1, 5])
+        self.assertEqual(self.folder.uidsnotin([]), [1, 2, 3, 5])
+
+    def test_getmessagesflags(self):
+        self.assertEqual(self.folder.getmessagesflags([1, 3, 4]),
+            {1: set(['S']), 3: set(['F', 'S'])})
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLazyStatusUIDs)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import copy
+import random
+import unittest
+
+from offlineimap.folder.Base import BaseFolder
+from offlineimap.folder.MessageList import CompactMessageList
+
+
+DEFAULTS = {'uid': 0, 'flags': set(), 'time': 0, 'labels': set(),
+            'keywords': set()}
+FLAGS = ['D', 'F', 'P', 'R', 'S', 'T', 'a', 'z', '\\Custom']
+
+
+class TestCompactMessageList(unittest.TestCase):
+    """Runs random operations on a CompactMessageList and on a dict of
+    dicts, checking that both always hold the same messages."""
+
+    def randomitem(self, rnd, uid):
+        item = {'uid': uid,
+                'flags': set(rnd.sample(FLAGS, rnd.randint(0, 3)))}
+        if rnd.random() < 0.8:
+            item['time'] = rnd.choice([0, None, rnd.randint(0, 2**40)])
+        if rnd.random() < 0.5:
+            item['mtime'] = rnd.randint(-2**40, 2**40)
+        if rnd.random() < 0.5:
+            item['labels'] = set(rnd.sample(['l1', 'l2', 'l3'],
+                rnd.randint(0, 2)))
+        if rnd.random() < 0.5:
+            item['keywords'] = set(rnd.sample(['k1', 'k2'], rnd.randint(0, 1)))
+        if rnd.random() < 0.5:
+            item['size'] = rnd.choice([rnd.randint(0, 2**30), 1.5])
+        if rnd.random() < 0.2:
+            item['filename'] = 'file%d'% rnd.randint(0, 9)
+        return item
+
+    def check(self, compact, model):
+        self.assertEqual(len(compact), len(model))
+        self.assertEqual(compact.keys(), sorted(model))
+        for uid, item in model.items():
+            self.assertTrue(uid in compact)
+            self.assertEqual(dict(compact[uid].items()), item)
+            for key in ('flags', 'time', 'mtime', 'labels', 'keywords',
+                        'size', 'filename'):
+                if key in item:
+                    self.assertEqual(compact[uid][key], item[key])
+                else:
+                    self.assertRaises(KeyError, lambda: compact[uid][key])
+
+    def runtrial(self, seed):
+        rnd = random.Random(seed)
+        compact = CompactMessageList(copy.deepcopy(DEFAULTS))
+        model = {}
+        for step in range(200):
+            op = rnd.random()
+            uid = rnd.randint(-20, 200)
+            if op < 0.4:
+                if rnd.random() < 0.5 and model:
+                    uid = max(model) + rnd.randint(1, 3) # Append in order.
+                item = self.randomitem(rnd, uid)
+                compact[uid] = copy.deepcopy(item)
+                model[uid] = item
+            elif op < 0.55 and model:
+                uid = rnd.choice(list(model))
+                if rnd.random() < 0.5:
+                    del compact[uid]
+                    del model[uid]
+                else:
+                    self.assertEqual(dict(compact.pop(uid).items()),
+                        model.pop(uid))
+            elif op < 0.8 and model:
+                uid = rnd.choice(list(model))
+                key = rnd.choice(['flags', 'time', 'mtime', 'labels', 'size'])
+                value = self.randomitem(rnd, uid).get(key,
+                    copy.deepcopy(DEFAULTS.get(key, 0)))
+                compact[uid][key] = copy.deepcopy(value)
+                model[uid][key] = value
+            else:
+                self.assertEqual(uid in compact, uid in model)
+                self.assertEqual(compact.get(uid) is None, uid not in model)
+            if step % 20 == 0:
+                self.check(compact, model)
+        self.check(compact, model)
+
+    def test_random_operations(self):
+        for seed in range(100):
+            self.runtrial(seed)
+
+    def test_set_operations(self):
+        rnd = random.Random(0)
+        for trial in range(50):
+            lists, sets = [], []
+            for n in range(2):
+                compact = CompactMessageList(copy.deepcopy(DEFAULTS))
+                uids = set(rnd.sample(range(100), rnd.randint(0, 50)))
+                for uid in rnd.sample(sorted(uids), len(uids)):
+                    compact[uid] = {'uid': uid}
+                for uid in rnd.sample(sorted(uids), min(len(uids), 5)):
+                    del compact[uid]
+                    uids.remove(uid)
+                lists.append(compact)
+                sets.append(uids)
+            mine, theirs = lists
+            self.assertEqual(mine.uids().tolist(), sorted(sets[0]))
+            for other in (theirs, sorted(sets[1]), iter(sets[1])):
+                self.assertEqual(mine.difference(other),
+                    sorted(sets[0] - sets[1]))
+            for other in (theirs, list(sets[1])):
+                self.assertEqual(mine.intersection(other),
+                    sorted(sets[0] & sets[1]))
+
+    def test_missing_uid(self):
+        compact = CompactMessageList(copy.deepcopy(DEFAULTS))
+        compact[1] = {'uid': 1}
+        item = compact[1]
+        del compact[1]
+        compact.keys()
+        self.assertRaises(KeyError, item.keys)
+        self.assertRaises(KeyError, lambda: item['flags'])
+
+    def test_no_extras_for_defaults(self):
+        compact = CompactMessageList(copy.deepcopy(DEFAULTS))
+        for uid in range(1, 100):
+            compact[uid] = {'uid': uid, 'flags': set(['S']), 'time': uid,
+                'labels': set(), 'keywords': set(), 'size': uid * 1000}
+            self.assertEqual(compact[uid]['keywords'], set())
+            self.assertEqual(compact[uid]['size'], uid * 1000)
+        compact.keys()
+        self.assertEqual([v for v in compact._extras.values() if v], [])
+
+    def test_defaults(self):
+        compact = CompactMessageList(copy.deepcopy(DEFAULTS))
+        compact[1] = {'uid': 1, 'flags': set(), 'time': 0, 'labels': set()}
+        # Mutable defaults can be modified in place once accessed.
+        compact[1]['labels'].add('l1')
+        self.assertEqual(compact[1]['labels'], set(['l1']))
+        self.assertEqual(compact[1]['flags'], set())
+
+
+class TestFolderUIDs(unittest.TestCase):
+    """Checks the UID comparisons of BaseFolder used by the sync planner,
+    between folders with dict and compact messagelists."""
+
+    def folder(self, uids, compact):
+        folder = BaseFolder.__new__(BaseFolder)
+        folder.messagelist = {}
+        if compact:
+            folder.messagelist = CompactMessageList(copy.deepcopy(DEFAULTS))
+        for uid in uids:
+            folder.messagelist[uid] = {'uid': uid}
+        return folder
+
+    def test_compare(self):
+        rnd = random.Random(0)
+        for trial in range(50):
+            mine = set(rnd.sample(range(-5, 100), rnd.randint(0, 50)))
+            theirs = set(rnd.sample(range(-5, 100), rnd.randint(0, 50)))
+            for compact in (False, True):
+                for othercompact in (False, True):
+                    folder = self.folder(mine, compact)
+                    other = self.folder(theirs, othercompact)
+                    uids = other.getmessageuidset()
+                    self.assertEqual(folder.uidsin(uids), sorted(mine & theirs))
+                    self.assertEqual(folder.uidsmissing(uids),
+                        sorted(theirs - mine))
+                    self.assertEqual(folder.uidsnotin(uids),
+                        sorted(mine - theirs))
+                    self.assertEqual(folder.uidsnotin(list(theirs)),
+                        sorted(mine - theirs))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCompactMessageList)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 John Goerzen & contributors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import tempfile
+import unittest
+from threading import Lock
+
+from offlineimap.folder.UIDMaps import MappedIMAPFolder
+
+
+class FakeUI(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+
+class FakeRepository(object):
+    def __init__(self, mapdir):
+        self.mapdir = mapdir
+
+    def getmapdir(self):
+        return self.mapdir
+
+
+class TestUIDMaps(unittest.TestCase):
+    """Tests the loading and saving of the UID mapping file, without the
+    IMAP side of MappedIMAPFolder."""
+
+    def setUp(self):
+        self.mapdir = tempfile.mkdtemp()
+        self.mapfile = os.path.join(self.mapdir, 'INBOX')
+
+    def tearDown(self):
+        shutil.rmtree(self.mapdir)
+
+    def folder(self, maplog):
+        folder = MappedIMAPFolder.__new__(MappedIMAPFolder)
+        folder.ui = FakeUI()
+        folder.repository = FakeRepository(self.mapdir)
+        folder.getfolderbasename = lambda: 'INBOX'
+        folder.dofsync = lambda: False
+        folder.dryrun = False
+        folder.maplock = Lock()
+        folder._maplog = maplog
+        folder._maplogsize = 0
+        folder.diskr2l, folder.diskl2r = folder._loadmaps()
+        return folder
+
+    def write(self, data):
+        with open(self.mapfile, 'w') as mapfile:
+            mapfile.write(data)
+
+    def lines(self):
+        with open(self.mapfile) as mapfile:
+            return mapfile.read().splitlines()
+
+    def test_load(self):
+        for maplog in (False, True):
+            self.write("1:10\n2:20\n")
+            folder = self.folder(maplog)
+            self.assertEqual(folder.diskl2r, {1: 10, 2: 20})
+            self.assertEqual(folder.diskr2l, {10: 1, 20: 2})
+
+    def test_load_without_final_newline(self):
+        # Still a valid file in both formats.
+        for maplog in (False, True):
+            self.write("1:10\n2:20")
+            folder = self.folder(maplog)
+            self.assertEqual(folder.diskl2r, {1: 10, 2: 20})
+            self.assertEqual(folder.ui.warnings, [])
+
+    def test_append(self):
+        self.write("1:10\n2:20\n")
+        folder = self.folder(True)
+        folder.diskl2r = {1: 10, 3: 30}
+        folder.diskr2l = {10: 1, 30: 3}
+        folder._savemaps([(3, 30), (2, None)])
+        self.assertEqual(self.lines(), ['1:10', '2:20', '3:30', '-2'])
+        folder = self.folder(True)
+        self.assertEqual(folder.diskl2r, {1: 10, 3: 30})
+        self.assertEqual(folder.diskr2l, {10: 1, 30: 3})
+
+    def test_remap(self):
+        self.write("1:10\n1:11\n")
+        folder = self.folder(True)
+        self.assertEqual(folder.diskl2r, {1: 11})
+        self.assertEqual(folder.diskr2l, {11: 1})
+
+    def test_plain_format_rewrites(self):
+        self.write("1:10\n")
+        folder = self.folder(False)
+        folder.diskl2r[2] = 20
+        folder._savemaps([(2, 20)])
+        self.assertEqual(sorted(self.lines()), ['1:10', '2:20'])
+        self.assertEqual(folder._maplogsize, 2)
+
+    def test_compact(self):
+        folder = self.folder(True)
+        folder.maplogslack = 2
+        for uid in range(1, 6):
+            folder.diskl2r = {uid: uid * 10}
+            folder.diskr2l = {uid * 10: uid}
+            if uid > 1:
+                changes = [(uid - 1, None), (uid, uid * 10)]
+            else:
+                changes = [(uid, uid * 10)]
+            folder._savemaps(changes)
+            self.assertTrue(len(self.lines()) <= 2 * 1 + 2)
+        self.assertEqual(self.folder(True).diskl2r, {5: 50})
+
+    def test_truncated_last_line(self):
+        self.write("1:10\n2:20\n3:")
+        folder = self.folder(True)
+        self.assertEqual(folder.diskl2r, {1: 10, 2: 20})
+        self.assertEqual(len(folder.ui.warnings), 1)
+        # The next save rewrites the file.
+        folder.diskl2r[4] = 40
+        folder.diskr2l[40] = 4
+        folder._savemaps([(4, 40)])
+        self.assertEqual(sorted(self.lines()), ['1:10', '2:20', '4:40'])
+
+    def test_truncated_last_line_plain_format(self):
+        self.write("1:10\n2:20\n3:")
+        self.assertRaises(Exception, self.folder, False)
+
+    def test_corrupt_line(self):
+        self.write("1:10\n2:\n3:30\n")
+        self.assertRaises(Exception, self.folder, True)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestUIDMaps)
+    unittest.TextTestRunner(verbosity=2).run(suite)